@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Latency of the exclusion of the already alerted objects as the
+``__corral_alerted__`` table grows.
+
+Run it from the root of the repository with::
+
+    $ python -m benchmarks.bench_alerted --sizes 0 1000 10000 100000
+
+"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import os
+import sys
+import time
+import json
+import argparse
+import datetime
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+DEFAULT_SETTINGS = "benchmarks.settings"
+
+DEFAULT_SIZES = (0, 1000, 10000, 100000)
+
+DEFAULT_CANDIDATES = 100
+
+DEFAULT_REPEAT = 5
+
+INSERT_CHUNK = 10000
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def populate(registered, candidates):
+    """Create ``registered`` objects already alerted by ``BenchAlert`` and
+    ``candidates`` objects not alerted yet.
+
+    """
+    from corral import db, util
+    from corral.db.default_models import Alerted
+
+    from .models import BenchModel
+    from .alerts import BenchAlert
+
+    db.Model.metadata.drop_all(db.engine)
+    db.create_all()
+
+    alert_columns = Alerted.alert_to_columns(BenchAlert)
+    alert_columns.update(Alerted.model_class_to_column(BenchModel))
+    now = datetime.datetime.utcnow()
+
+    with db.engine.begin() as connection:
+        total = registered + candidates
+        for ids in util.chunks(range(1, total + 1), INSERT_CHUNK):
+            connection.execute(BenchModel.__table__.insert(), [
+                {"id": idx, "name": "obj_{}".format(idx),
+                 "value": float(idx), "status": "alert"} for idx in ids])
+        for ids in util.chunks(range(1, registered + 1), INSERT_CHUNK):
+            rows = []
+            for idx in ids:
+                row = {"model_key": str(idx), "created_at": now}
+                row.update(alert_columns)
+                rows.append(row)
+            connection.execute(Alerted.__table__.insert(), rows)
+
+
+def time_exclusion(repeat):
+    """Return the pending objects and the best time (in seconds) of
+    ``repeat`` executions of the ``BenchAlert.generate()`` query.
+
+    """
+    from corral import db
+
+    from .alerts import BenchAlert
+
+    times, pending = [], None
+    for _ in range(repeat):
+        with db.session_scope() as session:
+            alert = BenchAlert(session)
+            start = time.time()
+            pending = len(alert.generate().all())
+            times.append(time.time() - start)
+    return pending, min(times)
+
+
+def bench(sizes, candidates, repeat):
+    results = []
+    for registered in sizes:
+        populate(registered, candidates)
+        pending, best = time_exclusion(repeat)
+        if pending != candidates:
+            raise AssertionError(
+                "Expected {} pending objects, found {}".format(
+                    candidates, pending))
+        results.append({
+            "registered": registered, "candidates": candidates,
+            "best_seconds": best})
+    return results
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=(
+        "Benchmark the exclusion of already alerted objects"))
+    parser.add_argument(
+        "--sizes", dest="sizes", nargs="+", type=int, default=DEFAULT_SIZES,
+        help="Number of registered alerts to benchmark")
+    parser.add_argument(
+        "--candidates", dest="candidates", type=int,
+        default=DEFAULT_CANDIDATES, help="Number of objects not alerted yet")
+    parser.add_argument(
+        "--repeat", dest="repeat", type=int, default=DEFAULT_REPEAT,
+        help="Executions by size (the best one is reported)")
+    parser.add_argument(
+        "--json", dest="json", default=None,
+        help="Write the results as JSON to this file")
+    return parser
+
+
+def main(argv):
+    parser = create_parser()
+    arguments = parser.parse_args(argv)
+
+    os.environ.setdefault("CORRAL_SETTINGS_MODULE", DEFAULT_SETTINGS)
+
+    from corral import core
+    core.setup_environment()
+
+    results = bench(arguments.sizes, arguments.candidates, arguments.repeat)
+
+    print("{:>12} {:>12} {:>12}".format("REGISTERED", "CANDIDATES", "MS"))
+    for result in results:
+        print("{:>12} {:>12} {:>12.3f}".format(
+            result["registered"], result["candidates"],
+            result["best_seconds"] * 1000))
+
+    if arguments.json:
+        with open(arguments.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Database connections opened by the parent and the runners during
+``run-all``-like executions of the benchmark pipeline.
+
+Run it from the root of the repository with::
+
+    $ python -m benchmarks.bench_connections --rounds 10 --size 1000
+
+``--dispose`` emulates the old behavior of disposing the pool of the parent
+before starting every runner. Use ``CORRAL_BENCH_CONNECTION`` to measure a
+real server (the SQLite default only measures the pool bookkeeping).
+
+"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+DEFAULT_SETTINGS = "benchmarks.settings"
+
+DEFAULT_ROUNDS = 10
+
+DEFAULT_SIZE = 1000
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def count_connections(engine):
+    """Count the new DBAPI connections of the engine in this process and
+    in all the processes forked from it.
+
+    """
+    from sqlalchemy import event
+
+    counter = multiprocessing.Value("L", 0)
+
+    def on_connect(dbapi_connection, connection_record):
+        with counter.get_lock():
+            counter.value += 1
+
+    event.listen(engine, "connect", on_connect)
+    return counter
+
+
+def prepare(size):
+    from corral import run
+
+    from .loader import BenchLoader
+    from .bench_pipeline import reset_database
+
+    reset_database()
+    BenchLoader.size = size
+    run.execute_loader(BenchLoader, sync=True)
+
+
+def execute(processor_cls, dispose):
+    from corral import db, run
+
+    if dispose:
+        db.engine.dispose()
+    if issubclass(processor_cls, run.Step):
+        return run.execute_step(processor_cls)
+    return run.execute_alert(processor_cls)
+
+
+def bench(rounds, size, dispose):
+    from corral import db, run
+
+    prepare(size)
+    processors = list(run.load_steps()) + list(run.load_alerts())
+    counter = count_connections(db.engine)
+
+    start = time.time()
+    for _ in range(rounds):
+        # the parent reads the database between the executions, like the
+        # scheduler of a pipeline with a pool of processors
+        with db.session_scope() as session:
+            session.execute("SELECT 1")
+        exitcodes = run.schedule(
+            processors, lambda proc_cls: execute(proc_cls, dispose))
+        if any(exitcodes):
+            raise AssertionError("Failed runners: {}".format(exitcodes))
+    elapsed = time.time() - start
+
+    executions = rounds * len(processors)
+    return {
+        "rounds": rounds, "size": size, "dispose": dispose,
+        "executions": executions,
+        "connections": counter.value,
+        "connections_by_execution": counter.value / float(executions),
+        "seconds": elapsed}
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=(
+        "Benchmark the database connections opened by run-all"))
+    parser.add_argument(
+        "--rounds", dest="rounds", type=int, default=DEFAULT_ROUNDS,
+        help="Executions of all the steps and alerts")
+    parser.add_argument(
+        "--size", dest="size", type=int, default=DEFAULT_SIZE,
+        help="Number of loaded objects")
+    parser.add_argument(
+        "--dispose", dest="dispose", action="store_true", default=False,
+        help="Dispose the pool of the parent before every execution")
+    parser.add_argument(
+        "--json", dest="json", default=None,
+        help="Write the results as JSON to this file")
+    return parser
+
+
+def main(argv):
+    parser = create_parser()
+    arguments = parser.parse_args(argv)
+
+    os.environ.setdefault("CORRAL_SETTINGS_MODULE", DEFAULT_SETTINGS)
+
+    from corral import core
+    core.setup_environment()
+
+    result = bench(arguments.rounds, arguments.size, arguments.dispose)
+
+    print("{:>12} {:>12} {:>16} {:>10}".format(
+        "EXECUTIONS", "CONNECTIONS", "CONN/EXECUTION", "SECONDS"))
+    print("{:>12} {:>12} {:>16.2f} {:>10.3f}".format(
+        result["executions"], result["connections"],
+        result["connections_by_execution"], result["seconds"]))
+
+    if arguments.json:
+        with open(arguments.json, "w") as fp:
+            json.dump(result, fp, indent=2)
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
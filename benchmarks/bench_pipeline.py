@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Throughput of the Loader, the Steps and the Alerts of a synthetic
+pipeline at different scales.
+
+Run it from the root of the repository with::
+
+    $ python -m benchmarks.bench_pipeline --sizes 1e3 1e4 1e5 --json new.json
+
+And compare the results of two commits with ``benchmarks.compare``.
+
+"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import os
+import sys
+import json
+import argparse
+import platform
+import datetime
+import subprocess
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+DEFAULT_SETTINGS = "benchmarks.settings"
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+DEFAULT_ALERTED = 0
+
+INSERT_CHUNK = 10000
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def reset_database():
+    from corral import db
+
+    db.Model.metadata.drop_all(db.engine)
+    db.create_all()
+
+
+def populate_alerted(count, offset):
+    """Register ``count`` alerts of ``BenchAlert`` for objects that don't
+    exist (with ids greater than ``offset``), so only grows the table where
+    the alert excludes the already alerted objects.
+
+    """
+    from corral import db, util
+    from corral.db.default_models import Alerted
+
+    from .models import BenchModel
+    from .alerts import BenchAlert
+
+    columns = Alerted.alert_to_columns(BenchAlert)
+    columns.update(Alerted.model_class_to_column(BenchModel))
+    now = datetime.datetime.utcnow()
+
+    ids = range(offset + 1, offset + count + 1)
+    with db.engine.begin() as connection:
+        for chunk in util.chunks(ids, INSERT_CHUNK):
+            rows = []
+            for idx in chunk:
+                row = {"model_key": str(idx), "created_at": now}
+                row.update(columns)
+                rows.append(row)
+            connection.execute(Alerted.__table__.insert(), rows)
+
+
+def execute(processor_cls):
+    """Execute the processor in this process and return its metrics."""
+    from corral import run
+
+    if issubclass(processor_cls, run.Loader):
+        procs = run.execute_loader(processor_cls, sync=True)
+    elif issubclass(processor_cls, run.Step):
+        procs = run.execute_step(processor_cls, sync=True)
+    else:
+        procs = run.execute_alert(processor_cls, sync=True)
+    return procs[0].collect_metrics()
+
+
+def bench_size(size, alerted):
+    from .loader import BenchLoader
+    from .steps import BenchScale, BenchClassify
+    from .alerts import BenchAlert
+
+    reset_database()
+    populate_alerted(alerted, size)
+
+    BenchLoader.size = size
+    processors = (BenchLoader, BenchScale, BenchClassify, BenchAlert)
+
+    results = []
+    for processor_cls in processors:
+        metrics = execute(processor_cls)
+        wall_time = metrics["wall_time"]
+        results.append({
+            "size": size,
+            "alerted": alerted,
+            "processor": metrics["processor_path"],
+            "type": metrics["processor_type"],
+            "objects": metrics["generated"],
+            "seconds": wall_time,
+            "objects_per_second": (
+                metrics["generated"] / wall_time if wall_time else None),
+            "generate_seconds": metrics["generate_time"],
+            "process_seconds": metrics["process_time"],
+            "commit_seconds": metrics["commit_time"],
+            "db_seconds": metrics["db_time"],
+            "peak_rss": metrics["peak_rss"]})
+    return results
+
+
+def git_revision():
+    try:
+        output = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode("ascii").strip()
+
+
+def environment():
+    from corral import VERSION, db
+
+    return {
+        "date": datetime.datetime.utcnow().isoformat(),
+        "revision": git_revision(),
+        "corral": VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": db.engine.dialect.name}
+
+
+def bench(sizes, alerted):
+    results = []
+    for size in sizes:
+        results.extend(bench_size(size, alerted))
+    return {"environment": environment(), "results": results}
+
+
+def scale(value):
+    """Parse a size (``1e5`` is accepted)."""
+    try:
+        number = int(float(value))
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise argparse.ArgumentTypeError(
+            "'{}' must be a positive number".format(value))
+    return number
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=(
+        "Benchmark the Loader, Steps and Alerts of a synthetic pipeline"))
+    parser.add_argument(
+        "--sizes", dest="sizes", nargs="+", type=scale,
+        default=DEFAULT_SIZES, help="Number of loaded objects to benchmark")
+    parser.add_argument(
+        "--alerted", dest="alerted", type=scale, default=DEFAULT_ALERTED,
+        help="Number of alerts already registered before every run")
+    parser.add_argument(
+        "--json", dest="json", default=None,
+        help="Write the results as JSON to this file")
+    return parser
+
+
+def main(argv):
+    parser = create_parser()
+    arguments = parser.parse_args(argv)
+
+    os.environ.setdefault("CORRAL_SETTINGS_MODULE", DEFAULT_SETTINGS)
+
+    from corral import core
+    core.setup_environment()
+
+    report = bench(arguments.sizes, arguments.alerted)
+
+    print("{:>10} {:<32} {:>10} {:>10} {:>12}".format(
+        "SIZE", "PROCESSOR", "OBJECTS", "SECONDS", "OBJECTS/S"))
+    for result in report["results"]:
+        print("{:>10} {:<32} {:>10} {:>10.3f} {:>12.1f}".format(
+            result["size"], result["processor"], result["objects"],
+            result["seconds"], result["objects_per_second"] or 0))
+
+    if arguments.json:
+        with open(arguments.json, "w") as fp:
+            json.dump(report, fp, indent=2)
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
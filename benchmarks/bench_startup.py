@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Cold start time of the command line of a new pipeline.
+
+Run it from the root of the repository with::
+
+    $ python -m benchmarks.bench_startup --command "run --help"
+
+"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+DEFAULT_COMMANDS = ("--help", "run --help", "lssteps")
+
+DEFAULT_REPEAT = 10
+
+PIPELINE_NAME = "startup_bench"
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def create_pipeline(directory):
+    from corral import creator
+
+    path = os.path.join(directory, PIPELINE_NAME)
+    creator.create_pipeline(path)
+    return path
+
+
+def time_command(path, command, repeat):
+    """Return the times (in seconds) of ``repeat`` executions of the
+    command in new interpreters.
+
+    """
+    env = dict(os.environ)
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (repo, env.get("PYTHONPATH")) if p)
+
+    argv = [sys.executable, "in_corral.py"] + command.split()
+    times = []
+    with open(os.devnull, "w") as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.check_call(
+                argv, cwd=path, env=env, stdout=devnull, stderr=devnull)
+            times.append(time.time() - start)
+    return times
+
+
+def bench(commands, repeat):
+    directory = tempfile.mkdtemp(prefix="corral_startup_")
+    try:
+        path = create_pipeline(directory)
+        results = []
+        for command in commands:
+            times = sorted(time_command(path, command, repeat))
+            results.append({
+                "command": command, "repeat": repeat,
+                "best_seconds": times[0],
+                "median_seconds": times[len(times) // 2]})
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=(
+        "Benchmark the cold start of the command line of a pipeline"))
+    parser.add_argument(
+        "--command", dest="commands", action="append", default=None,
+        help="Command to benchmark (can be used many times)")
+    parser.add_argument(
+        "--repeat", dest="repeat", type=int, default=DEFAULT_REPEAT,
+        help="Executions by command")
+    parser.add_argument(
+        "--json", dest="json", default=None,
+        help="Write the results as JSON to this file")
+    return parser
+
+
+def main(argv):
+    parser = create_parser()
+    arguments = parser.parse_args(argv)
+
+    results = bench(arguments.commands or DEFAULT_COMMANDS, arguments.repeat)
+
+    print("{:<24} {:>10} {:>10}".format("COMMAND", "BEST MS", "MEDIAN MS"))
+    for result in results:
+        print("{:<24} {:>10.1f} {:>10.1f}".format(
+            result["command"], result["best_seconds"] * 1000,
+            result["median_seconds"] * 1000))
+
+    if arguments.json:
+        with open(arguments.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
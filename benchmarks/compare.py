@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Compare two JSON results of ``benchmarks.bench_pipeline`` and fail if
+any processor is slower than the threshold::
+
+    $ python -m benchmarks.compare old.json new.json --threshold 0.1
+
+"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import sys
+import json
+import argparse
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+DEFAULT_THRESHOLD = 0.2
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def index(report):
+    return {
+        (r["size"], r["alerted"], r["processor"]): r
+        for r in report["results"]}
+
+
+def compare(old, new):
+    """Return a list of ``(key, old_seconds, new_seconds, ratio)`` for all
+    the benchmarks present in both reports.
+
+    """
+    old, new = index(old), index(new)
+    rows = []
+    for key in sorted(set(old).intersection(new)):
+        old_seconds, new_seconds = old[key]["seconds"], new[key]["seconds"]
+        ratio = new_seconds / old_seconds if old_seconds else None
+        rows.append((key, old_seconds, new_seconds, ratio))
+    return rows
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=(
+        "Compare two results of benchmarks.bench_pipeline"))
+    parser.add_argument("old", help="JSON results of the base commit")
+    parser.add_argument("new", help="JSON results of the new commit")
+    parser.add_argument(
+        "--threshold", dest="threshold", type=float,
+        default=DEFAULT_THRESHOLD,
+        help=("Maximum allowed slowdown (0.2 means 20%% slower) "
+              "(default: %(default)s)"))
+    return parser
+
+
+def main(argv):
+    parser = create_parser()
+    arguments = parser.parse_args(argv)
+
+    with open(arguments.old) as fp:
+        old = json.load(fp)
+    with open(arguments.new) as fp:
+        new = json.load(fp)
+
+    rows = compare(old, new)
+    if not rows:
+        print("No common benchmarks (compare results of the same sizes)")
+        return 1
+
+    regressions = 0
+    print("{:>10} {:<32} {:>10} {:>10} {:>8}".format(
+        "SIZE", "PROCESSOR", "OLD", "NEW", "RATIO"))
+    for (size, _, processor), old_s, new_s, ratio in rows:
+        regression = ratio is not None and ratio > 1 + arguments.threshold
+        regressions += regression
+        print("{:>10} {:<32} {:>10.3f} {:>10.3f} {:>8} {}".format(
+            size, processor, old_s, new_s,
+            "-" if ratio is None else "{:.2f}".format(ratio),
+            "REGRESSION" if regression else ""))
+
+    return 1 if regressions else 0
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import logging
+import os
+import tempfile
+
+from sqlalchemy.pool import QueuePool
+
+# =============================================================================
+# CONF
+# =============================================================================
+
+PATH = os.path.abspath(os.path.dirname(__file__))
+
+DEBUG_PROCESS = False
+
+LOG_LEVEL = logging.WARNING
+
+PIPELINE_SETUP = "benchmarks.pipeline.BenchPipeline"
+
+CONNECTION = os.environ.get(
+    "CORRAL_BENCH_CONNECTION",
+    "sqlite:///{}".format(
+        os.path.join(tempfile.gettempdir(), "corral_bench.db")))
+
+# SQLite files are not pooled by default, so the connection benchmarks
+# would measure nothing
+CONNECTION_OPTIONS = (
+    {"poolclass": QueuePool} if CONNECTION.startswith("sqlite") else {})
+
+RECORD_RUNS = False
+
+LOADER = "benchmarks.loader.BenchLoader"
+
+STEPS = ["benchmarks.steps.BenchScale", "benchmarks.steps.BenchClassify"]
+
+ALERTS = ["benchmarks.alerts.BenchAlert"]
@@ -164,7 +164,23 @@ def load_project_commands():
     return commands
 
 
-def create_parser():
+def selected_command(argv):
+    """Title of the command selected in the command line arguments (or an
+    empty string if there is no command).
+
+    """
+    for arg in argv:
+        if not arg.startswith("-"):
+            return arg
+    return ""
+
+
+def create_parser(only=None):
+    """Create the parser of all the commands. If ``only`` is given, only the
+    command with that title is setup (so the other commands don't load
+    their dependencies nor compute their options).
+
+    """
 
     from . import commands  # noqa
 
@@ -199,13 +215,14 @@ def create_parser():
         command = cls()
         sub_parser = parser.add_subparser(title, command, mode, **options)
         command.configure(sub_parser)
-        command.setup()
+        if only is None or only == title:
+            command.setup()
 
     return parser
 
 
 def run_from_command_line():
-    parser = create_parser()
+    parser = create_parser(only=selected_command(sys.argv[1:]))
     if sys.argv[1:] in (['--help'], ['-h']):
         sys.stdout.write(parser.main_help_text() + "\n\n")
         sys.exit(0)
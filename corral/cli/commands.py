@@ -44,6 +44,8 @@
 
 import inspect
 import collections
+import contextlib
+import functools
 import code
 import os
 import logging
@@ -51,23 +53,66 @@ import sys
 import argparse
 import shutil
 import pstats
+import signal
 import tempfile
 
-import sh
-
 import six
 
 from texttable import Texttable
 
-from .. import db, run, creator, qa, docs, cli, setup, res, util
-from ..libs import (
-    sqlalchemy_sql_shell as sql_shell,
-    argparse_ext as ape)
+from .. import creator, cli, setup, res, util
+from ..libs import argparse_ext as ape
 
 from .base import BaseCommand
 
 conf = util.dimport("corral.conf", lazy=True)
 
+# the heavy dependencies are imported only by the commands that use them
+sh = util.dimport("sh", lazy=True)
+db = util.dimport("corral.db", lazy=True)
+run = util.dimport("corral.run", lazy=True)
+qa = util.dimport("corral.qa", lazy=True)
+docs = util.dimport("corral.docs", lazy=True)
+sql_shell = util.dimport("corral.libs.sqlalchemy_sql_shell", lazy=True)
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def execute_processor(processor, pool=None):
+    kwargs = {} if pool is None else {"pool": pool}
+    if issubclass(processor, run.Loader):
+        return run.execute_loader(processor, **kwargs)
+    elif issubclass(processor, run.Step):
+        return run.execute_step(processor, **kwargs)
+    return run.execute_alert(processor, **kwargs)
+
+
+@contextlib.contextmanager
+def processors_executor(pool_size):
+    """Context manager that returns a function to execute the processors,
+    in a ProcessorPool if ``pool_size`` is not None.
+
+    """
+    if pool_size is None:
+        yield execute_processor
+    else:
+        with run.ProcessorPool(pool_size) as pool:
+            yield functools.partial(execute_processor, pool=pool)
+
+
+def check_positive(parser, option, value, cast=int):
+    try:
+        number = cast(value)
+    except ValueError:
+        number = 0
+    if number <= 0:
+        parser.error(
+            "'{}' must be a number greater than 0. Found '{}'".format(
+                option, value))
+    return number
+
 
 # =============================================================================
 # BUILT-INS COMMANDS
@@ -404,7 +449,8 @@ class Load(BaseCommand):
 
     def handle(self):
         cls = run.load_loader()
-        run.execute_loader(cls, sync=True)
+        procs = run.execute_loader(cls, sync=True)
+        run.exposition.observe(procs)
 
 
 class Groups(BaseCommand):
@@ -457,16 +503,17 @@ class Run(BaseCommand):
     def _by_name(self, name):
         if not hasattr(self, "_buff"):
             self._buff = set()
-            self._mapped_cls = {cls.__name__: cls for cls in run.load_steps()}
-        try:
-            cls = self._mapped_cls[name]
-            if cls in self._buff:
-                self.parser.error("Duplicated step name '{}'".format(name))
-            self._buff.add(cls)
-        except KeyError:
+        cls = run.step.registry.by_name(name)
+        if cls is None:
             self.parser.error("Invalid step name '{}'".format(name))
+        if cls in self._buff:
+            self.parser.error("Duplicated step name '{}'".format(name))
+        self._buff.add(cls)
         return cls
 
+    def _procno(self, value):
+        return check_positive(self.parser, "--procs", value)
+
     def setup(self):
         group = self.parser.add_mutually_exclusive_group()
         group.add_argument(
@@ -479,18 +526,29 @@ class Run(BaseCommand):
         self.parser.add_argument(
             "--sync", dest="sync", action="store_true",
             help="Execute every step synchronous", default=False)
+        self.parser.add_argument(
+            "--procs", dest="procno", action="store", type=self._procno,
+            default=None,
+            help=("Number of processes to split every step "
+                  "(overrides the 'procno' of the steps)"))
 
-    def handle(self, steps, groups, sync):
+    def handle(self, steps, groups, sync, procno):
         if not steps:
             steps = run.load_steps(groups or None)
 
+        kwargs = {"sync": sync}
+        if procno is not None:
+            kwargs["procno"] = procno
+
         procs = []
         for step_cls in steps:
-            proc = run.execute_step(step_cls, sync=sync)
+            proc = run.execute_step(step_cls, **kwargs)
             procs.extend(proc)
         if not sync:
             for proc in procs:
                 proc.join()
+        run.exposition.observe(procs)
+        if not sync:
             exitcodes = [proc.exitcode for proc in procs]
 
             status = sum(exitcodes)
@@ -534,14 +592,12 @@ class CheckAlerts(BaseCommand):
     def _by_name(self, name):
         if not hasattr(self, "_buff"):
             self._buff = set()
-            self._mapped_cls = {cls.__name__: cls for cls in run.load_alerts()}
-        try:
-            cls = self._mapped_cls[name]
-            if cls in self._buff:
-                self.parser.error("Duplicated alert name '{}'".format(name))
-            self._buff.add(cls)
-        except KeyError:
+        cls = run.alert.registry.by_name(name)
+        if cls is None:
             self.parser.error("Invalid alert name '{}'".format(name))
+        if cls in self._buff:
+            self.parser.error("Duplicated alert name '{}'".format(name))
+        self._buff.add(cls)
         return cls
 
     def setup(self):
@@ -568,6 +624,8 @@ class CheckAlerts(BaseCommand):
         if not sync:
             for proc in procs:
                 proc.join()
+        run.exposition.observe(procs)
+        if not sync:
             exitcodes = [proc.exitcode for proc in procs]
 
             status = sum(exitcodes)
@@ -578,31 +636,207 @@ class CheckAlerts(BaseCommand):
 class RunAll(BaseCommand):
     """Shortcut command to run the loader, steps and alerts asynchronous.
 
+    The processors are started as soon as all the processors declared in
+    their 'depends_on' (or producing what they 'consumes') finish.
     For more control check the commands 'load', 'run' and 'check-alerts'.
 
     """
 
     options = {"title": "run-all"}
 
-    def handle(self):
-        procs = []
+    def _workers(self, value):
+        return check_positive(self.parser, "--workers", value)
 
-        loader_runner = [run.load_loader()], run.execute_loader
-        steps_runner = run.load_steps(), run.execute_step
-        alerts_runner = run.load_alerts(), run.execute_alert
-
-        for processors, runner in [loader_runner, steps_runner, alerts_runner]:
-            for processor in processors:
-                proc = runner(processor)
-                procs.extend(proc)
-        for proc in procs:
-            proc.join()
-        exitcodes = [proc.exitcode for proc in procs]
+    def setup(self):
+        self.parser.add_argument(
+            "-w", "--workers", dest="workers", action="store",
+            type=self._workers, default=None,
+            help=("Maximum number of processors running at the same time "
+                  "(by default unlimited)"))
+        self.parser.add_argument(
+            "--pool-size", dest="pool_size", action="store",
+            type=self._workers, default=None,
+            help=("Execute the processors in a pool of reusable worker "
+                  "processes of the given size instead of one new process "
+                  "by processor"))
+
+    def handle(self, workers, pool_size):
+        processors = [run.load_loader()]
+        processors.extend(run.load_steps())
+        processors.extend(run.load_alerts())
+
+        with processors_executor(pool_size) as execute:
+            exitcodes = run.schedule(
+                processors, execute, max_workers=workers)
         status = sum(exitcodes)
         if status:
             sys.exit(status)
 
 
+class Serve(BaseCommand):
+    """Run the steps and alerts forever, waiting more time between the
+    executions of the processors that have nothing to process
+
+    """
+
+    options = {"title": "serve"}
+
+    def _workers(self, value):
+        return check_positive(self.parser, "--workers", value)
+
+    def _interval(self, value):
+        return check_positive(self.parser, "interval", value, cast=float)
+
+    def setup(self):
+        self.parser.add_argument(
+            "-l", "--loader", dest="loader", action="store_true",
+            default=False, help="Also execute the loader in every cycle")
+        self.parser.add_argument(
+            "--min-interval", dest="min_interval", action="store",
+            type=self._interval, default=run.daemon.MIN_INTERVAL,
+            help=("Seconds between executions of a processor "
+                  "(default: %(default)s)"))
+        self.parser.add_argument(
+            "--max-interval", dest="max_interval", action="store",
+            type=self._interval, default=run.daemon.MAX_INTERVAL,
+            help=("Maximum seconds between executions of an idle processor "
+                  "(default: %(default)s)"))
+        self.parser.add_argument(
+            "-w", "--workers", dest="workers", action="store",
+            type=self._workers, default=None,
+            help=("Maximum number of processors running at the same time "
+                  "(by default unlimited)"))
+        self.parser.add_argument(
+            "--pool-size", dest="pool_size", action="store",
+            type=self._workers, default=None,
+            help=("Execute the processors in a pool of reusable worker "
+                  "processes of the given size instead of one new process "
+                  "by execution"))
+        self.parser.add_argument(
+            "--metrics-port", dest="metrics_port", action="store",
+            type=self._workers, default=None,
+            help=("Expose the metrics of the runs in the OpenMetrics format "
+                  "by HTTP in the given port"))
+
+    def install_signals(self):
+        main_pid = os.getpid()
+
+        def handler(signum, frame):
+            if os.getpid() != main_pid:
+                # forked runners must die as usual
+                signal.signal(signum, signal.SIG_DFL)
+                os.kill(os.getpid(), signum)
+            else:
+                print("Stopping, waiting for the running processors...")
+                self._stop = True
+
+        self._stop = False
+        return {
+            signum: signal.signal(signum, handler)
+            for signum in (signal.SIGINT, signal.SIGTERM)}
+
+    def handle(self, loader, min_interval, max_interval, workers,
+               pool_size, metrics_port):
+        if min_interval > max_interval:
+            self.parser.error(
+                "'--min-interval' can't be greater than '--max-interval'")
+
+        processors = [run.load_loader()] if loader else []
+        processors.extend(run.load_steps())
+        processors.extend(run.load_alerts())
+
+        metrics_server = None
+        if metrics_port:
+            metrics_server = run.exposition.start_http_server(metrics_port)
+
+        original_handlers = self.install_signals()
+        try:
+            with processors_executor(pool_size) as execute:
+                failures = run.serve(
+                    processors, execute, min_interval=min_interval,
+                    max_interval=max_interval, max_workers=workers,
+                    should_stop=lambda: self._stop)
+        finally:
+            for signum, handler in original_handlers.items():
+                signal.signal(signum, handler)
+            if metrics_server is not None:
+                metrics_server.shutdown()
+                metrics_server.server_close()
+        if failures:
+            self.exit_with(1)
+
+
+class Stats(BaseCommand):
+    """Show the throughput and latency of the recorded runs of every
+    Loader, Step and Alert"""
+
+    options = {"title": "stats"}
+
+    def setup(self):
+        self.parser.add_argument(
+            "-p", "--processors", dest="processors", action="store",
+            nargs="+", default=None,
+            help="Show only the Loader, Steps or Alerts with this names")
+        self.parser.add_argument(
+            "-n", "--last", dest="last", action="store", default=None,
+            type=functools.partial(check_positive, self.parser, "--last"),
+            help="Use only the last N runs of every processor")
+
+    def handle(self, processors, last):
+        from ..db.default_models import ProcessorRun
+
+        by_path = collections.OrderedDict()
+        with db.session_scope() as session:
+            # one row by processor, the most recently executed first
+            paths = session.query(
+                ProcessorRun.processor_path, ProcessorRun.processor_type
+            ).group_by(
+                ProcessorRun.processor_path, ProcessorRun.processor_type
+            ).order_by(db.func.max(ProcessorRun.started_at).desc())
+            if processors:
+                paths = paths.filter(db.or_(
+                    ProcessorRun.processor_path.in_(processors), *[
+                        ProcessorRun.processor_path.endswith(
+                            "." + name, autoescape=True)
+                        for name in processors]))
+
+            for path, ptype in paths:
+                query = session.query(ProcessorRun).filter(
+                    ProcessorRun.processor_path == path,
+                    ProcessorRun.processor_type == ptype
+                ).order_by(ProcessorRun.started_at.desc())
+                if last is not None:
+                    query = query.limit(last)
+                by_path[(path, ptype)] = query.all()
+
+            if not by_path:
+                print("  NO RUNS RECORDED")
+                return
+
+            table = Texttable(max_width=0)
+            table.set_deco(
+                Texttable.BORDER | Texttable.HEADER | Texttable.VLINES)
+            table.header((
+                "Processor", "Type", "Runs", "Fails", "Objects", "Obj/sec",
+                "p50 (s)", "p95 (s)", "p99 (s)", "Gen/Proc/Commit (s)",
+                "Process Peak RSS (MiB)", "Last Run"))
+            for (path, ptype), runs in by_path.items():
+                summary = run.metrics.summarize(runs)
+                table.add_row([
+                    path, ptype, summary["runs"], summary["failures"],
+                    summary["generated"],
+                    "{:.2f}".format(summary["throughput"] or 0),
+                    "{:.3f}".format(summary["p50"] or 0),
+                    "{:.3f}".format(summary["p95"] or 0),
+                    "{:.3f}".format(summary["p99"] or 0),
+                    "{:.2f}/{:.2f}/{:.2f}".format(
+                        summary["generate_time"], summary["process_time"],
+                        summary["commit_time"]),
+                    "{:.1f}".format((summary["peak_rss"] or 0) / 1024.),
+                    summary["last_run"].isoformat()])
+            print(table.draw())
+
+
 class Test(BaseCommand):
     """Run all unittests for your pipeline"""
 
@@ -611,28 +845,23 @@ class Test(BaseCommand):
     def _step_by_name(self, name):
         if not hasattr(self, "_sbuff"):
             self._sbuff = set()
-            self._smapped_cls = {cls.__name__: cls for cls in run.load_steps()}
-        try:
-            cls = self._smapped_cls[name]
-            if cls in self._sbuff:
-                self.parser.error("Duplicated step name '{}'".format(name))
-            self._sbuff.add(cls)
-        except KeyError:
+        cls = run.step.registry.by_name(name)
+        if cls is None:
             self.parser.error("Invalid step name '{}'".format(name))
+        if cls in self._sbuff:
+            self.parser.error("Duplicated step name '{}'".format(name))
+        self._sbuff.add(cls)
         return cls
 
     def _alert_by_name(self, name):
         if not hasattr(self, "_abuff"):
             self._abuff = set()
-            self._amapped_cls = {
-                cls.__name__: cls for cls in run.load_alerts()}
-        try:
-            cls = self._amapped_cls[name]
-            if cls in self._abuff:
-                self.parser.error("Duplicated alert name '{}'".format(name))
-            self._abuff.add(cls)
-        except KeyError:
+        cls = run.alert.registry.by_name(name)
+        if cls is None:
             self.parser.error("Invalid alert name '{}'".format(name))
+        if cls in self._abuff:
+            self.parser.error("Duplicated alert name '{}'".format(name))
+        self._abuff.add(cls)
         return cls
 
     def _command_by_name(self, name):
@@ -857,11 +1086,17 @@ class CreateDoc(BaseCommand):
 
 
 class Profile(BaseCommand):
-    """Run a CPU profile (with cProfile) and then open the report with
-    your default browser
+    """Run a CPU profile (with cProfile) of the tests, the loader, the steps
+    or the alerts and then open the report with your default browser
 
     """
 
+    commands = ("test", "load", "run", "check-alerts")
+
+    def _sample_interval(self, value):
+        return check_positive(
+            self.parser, "--sample-interval", value, cast=float)
+
     options = {"mode": "out"}
 
     def setup(self):
@@ -889,6 +1124,19 @@ class Profile(BaseCommand):
             default=False,
             help='start SnakeViz in server-only mode--'
                  'no attempt will be to open a browser')
+        self.parser.add_argument(
+            "--sample-interval", dest="sample_interval", action="store",
+            type=self._sample_interval, default=None,
+            help=("Also sample the stack of the runners every given seconds "
+                  "of CPU and write them as collapsed stacks (for "
+                  "flamegraphs)"))
+        self.parser.add_argument(
+            "profiled", nargs="?", default="test", choices=self.commands,
+            metavar="command",
+            help="command to profile (default: %(default)s)")
+        self.parser.add_argument(
+            "arguments", nargs=argparse.REMAINDER,
+            help="arguments of the profiled command")
 
     def _print(self, report_file, kwargs):
         ps = pstats.Stats(report_file, stream=sys.stdout)
@@ -899,20 +1147,30 @@ class Profile(BaseCommand):
             kwargs.pop("browser")
         sh.snakeviz(report_file, **kwargs)
 
-    def handle(self, out, serve, **snakeviz_kwargs):
-        print("Running tests for profile, please wait...")
-        report = qa.run_profile()
+    def handle(self, out, serve, profiled, arguments, sample_interval,
+               **snakeviz_kwargs):
+        print("Running '{}' for profile, please wait...".format(profiled))
         out_func = self._serve if serve else self._print
 
         if out is None:
-            with tempfile.NamedTemporaryFile() as tfp:
-                with open(tfp.name, "w"):
-                    tfp.write(report)
-                tfp.seek(0)
-                out_func(tfp.name, snakeviz_kwargs)
-        else:
-            with open(out, "w") as fp:
-                fp.write(report)
+            with tempfile.NamedTemporaryFile(suffix=".prof") as tfp:
+                if self._profile(
+                        tfp.name, profiled, arguments, sample_interval):
+                    out_func(tfp.name, snakeviz_kwargs)
+        elif self._profile(out, profiled, arguments, sample_interval):
             print("Your profile file '{}' was created.".format(out))
             print("")
             out_func(out, snakeviz_kwargs)
+
+    def _profile(self, out, command, arguments, sample_interval):
+        try:
+            samples = qa.run_profile(
+                out, command, arguments, sample_interval=sample_interval)
+        except ValueError as err:
+            sys.stderr.write("{}\n".format(err))
+            self.exit_with(1)
+            return False
+        if samples:
+            print("The samples of the runners are in '{}'.".format(samples))
+            print("")
+        return True
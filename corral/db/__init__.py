@@ -34,18 +34,24 @@
 # IMPORTS
 # =============================================================================
 
+import os
+import random
+import itertools
+import multiprocessing.util
 from contextlib import contextmanager
 
 from sqlalchemy import *  # noqa
 from sqlalchemy.orm import *  # noqa
+from sqlalchemy import orm
 from sqlalchemy.ext import declarative
 from sqlalchemy.engine import url
 
 from sqlalchemy_utils import *  # noqa
 
-from alembic.config import main as alembic_main
+import six
 
 from .. import util, exceptions
+from ..core import logger
 
 conf = util.dimport("corral.conf", lazy=True)
 
@@ -58,25 +64,159 @@ IN_MEMORY_CONNECTIONS = ("sqlite:///:memory:", "sqlite:///")
 
 engine = None
 
-Session = sessionmaker()  # noqa
+# engines of the READ_CONNECTION replicas
+read_engines = []
+
+# how many objects read in a replica are re-read together in the primary
+REREAD_SIZE = 100
 
 Model = declarative.declarative_base(name="Model")
 
+# the pools inherited by a forked process are never closed there, because
+# their sockets are shared with the parent process
+_inherited_pools = []
+
+_fork_hook_registered = False
+
+
+# =============================================================================
+# SESSION
+# =============================================================================
+
+class RoutingSession(orm.Session):
+    """Session that executes the queries in the primary database (the
+    ``CONNECTION``) except inside ``on_replica()``, where the reads go to
+    one of the ``READ_CONNECTION`` replicas (the same during all the life
+    of the session). The flushes always go to the primary.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RoutingSession, self).__init__(*args, **kwargs)
+        self._on_replica = False
+        self._replica = None
+
+    @property
+    def replicated(self):
+        return bool(read_engines)
+
+    @contextmanager
+    def on_replica(self):
+        previous, self._on_replica = self._on_replica, True
+        try:
+            yield
+        finally:
+            self._on_replica = previous
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._on_replica and read_engines and not self._flushing:
+            if self._replica is None:
+                self._replica = random.choice(read_engines)
+            return self._replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    def reread(self, query, objs):
+        """Load again the objects from the primary with the filters of the
+        query (which must return them), and return only the objects that
+        still match it. The loaded objects are the same instances, with
+        the values of the primary.
+
+        """
+        if not objs:
+            return objs
+        entity = query.column_descriptions[0]["entity"]
+        pks = inspect(entity).primary_key  # noqa
+        identities = [inspect(obj).identity for obj in objs]  # noqa
+        if len(pks) == 1:
+            key, values = pks[0], [identity[0] for identity in identities]
+        else:
+            key, values = tuple_(*pks), identities  # noqa
+        query = query.enable_assertions(False).limit(None).offset(None)
+        fresh = set(map(id, query.order_by(None).populate_existing().filter(
+            key.in_(values))))
+        return [obj for obj in objs if id(obj) in fresh]
+
+    def iterate_replica(self, query, iterable, size=REREAD_SIZE):
+        """Iterate ``iterable`` (the result of ``query``, maybe streamed or
+        paginated) reading from the replica, but re-read every ``size``
+        objects in the primary so the replication lag never returns stale
+        objects.
+
+        """
+        iterator = None
+        while True:
+            with self.on_replica():
+                if iterator is None:
+                    iterator = iter(iterable)
+                chunk = list(itertools.islice(iterator, size))
+            if not chunk:
+                break
+            for obj in self.reread(query, chunk):
+                yield obj
+
+
+Session = sessionmaker(class_=RoutingSession)  # noqa
+
 
 # =============================================================================
 # FUNCTIONS
 # =============================================================================
 
 def setup(test_connection=False):
-    global engine, Session, Model
+    global engine, Session, Model, read_engines
     if engine:
         return
 
     conn = get_url(test_connection)
+    options = get_connection_options(test_connection)
 
-    engine = create_engine(conn, echo=False)  # noqa
+    engine = create_engine(conn, echo=False, **options)  # noqa
+    read_engines = [
+        create_engine(read_conn, echo=False, **options)  # noqa
+        for read_conn in get_read_urls(test_connection)]
     Session.configure(bind=engine)
     Model.metadata.bind = engine
+    register_fork_hook()
+
+
+def get_connection_options(test_connection=False):
+    """Extra arguments of ``create_engine()`` (pool size, overflow,
+    pre-ping, recycle, isolation level...) from the ``CONNECTION_OPTIONS``
+    setting. The test connection always uses the defaults.
+
+    """
+    if test_connection:
+        return {}
+    options = conf.settings.get("CONNECTION_OPTIONS", None) or {}
+    if not isinstance(options, dict):
+        msg = "CONNECTION_OPTIONS must be a dict. Found '{}'"
+        raise exceptions.ImproperlyConfigured(msg.format(options))
+    return dict(options)
+
+
+def reset_after_fork():
+    """Give the engine of a forked process its own connection pool, so the
+    child never uses (nor closes) the connections of the parent and the
+    parent keeps its pool.
+
+    """
+    for eng in [engine] + read_engines:
+        if eng is not None:
+            _inherited_pools.append(eng.pool)
+            eng.pool = eng.pool.recreate()
+
+
+def register_fork_hook():
+    global _fork_hook_registered
+    if _fork_hook_registered:
+        return
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=reset_after_fork)
+    else:  # pragma: no cover
+        # only the processes forked by multiprocessing
+        multiprocessing.util.register_after_fork(
+            reset_after_fork, lambda func: func())
+    _fork_hook_registered = True
 
 
 def get_url(test_connection=False):
@@ -86,6 +226,23 @@ def get_url(test_connection=False):
         conf.settings.CONNECTION)
 
 
+def get_read_urls(test_connection=False):
+    """The urls of the ``READ_CONNECTION`` setting (one url or a list of
+    urls of read replicas of the ``CONNECTION``). The tests don't use
+    replicas.
+
+    """
+    if test_connection:
+        return []
+    urls = conf.settings.get("READ_CONNECTION", None) or []
+    if isinstance(urls, six.string_types):
+        urls = [urls]
+    if not isinstance(urls, (list, tuple)):
+        msg = "READ_CONNECTION must be an url or a list of urls. Found '{}'"
+        raise exceptions.ImproperlyConfigured(msg.format(urls))
+    return list(urls)
+
+
 def get_urlo(test_connection=False):
     uri = get_url(test_connection)
     return url.make_url(uri)
@@ -126,6 +283,7 @@ def create_all(model_cls=None, **kwargs):
 def alembic(*args):
     if not db_exists():
         raise exceptions.DBError("Database do not exists")
+    from alembic.config import main as alembic_main
     aargs = ["--config", conf.settings.MIGRATIONS_SETTINGS] + list(args)
     return alembic_main(aargs, "corral")
 
@@ -136,7 +294,15 @@ def makemigrations(message=None):
 
 
 def migrate():
-    return alembic("upgrade", "head")
+    result = alembic("upgrade", "head")
+
+    # the objects alerted by older versions must keep being excluded
+    from .default_models import Alerted
+    with session_scope() as session:
+        filled = Alerted.fill_model_keys(session)
+    if filled:
+        logger.info("{} alerted objects updated".format(filled))
+    return result
 
 
 @contextmanager
@@ -34,34 +34,169 @@
 # IMPORTS
 # =============================================================================
 
+import six
+
 from sqlalchemy.orm import object_session
 
-from corral import db, util
+from corral import db, util, exceptions
+from corral.core import logger
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+# separator of the primary key values of composite keys in Alerted.model_key
+KEY_SEPARATOR = ","
 
+# the only primary key types rendered with the same text by Python and by
+# a CAST in the database
+KEY_TYPES = (db.Integer, db.String)
+
+
+# =============================================================================
+# MODELS
+# =============================================================================
 
 class Alerted(db.Model):
 
     __tablename__ = '__corral_alerted__'
+    __table_args__ = (
+        db.Index(
+            "ix_corral_alerted_path_table_key",
+            "alert_path", "model_table", "model_key"),)
 
     id = db.Column(db.Integer, primary_key=True)
     alert_path = db.Column(db.String(1000))
     model_table = db.Column(db.String(1000))
-    model_ids = db.Column(db.PickleType)
+    model_key = db.Column(db.String(255))
     created_at = db.Column(db.DateTime(timezone=True))
 
+    # primary key of the objects alerted by older versions of Corral (a
+    # pickled dict), only read to fill the model_key of those rows
+    model_ids = db.Column(db.PickleType)
+
     @classmethod
     def model_class_to_column(cls, mcls):
         table = mcls.__table__
         return {"model_table": table.name}
 
+    @classmethod
+    def key_columns(cls, mcls):
+        """Primary key columns of the model class ``mcls``. Raise
+        ``ImproperlyConfigured`` if some of them has a type that can't be
+        stored as a ``model_key``.
+
+        """
+        columns = db.inspect(mcls).primary_key
+        for column in columns:
+            if not isinstance(column.type, KEY_TYPES) or isinstance(
+                    column.type, db.Enum):
+                msg = (
+                    "The alerted objects of '{}' can't be registered: the "
+                    "primary key column '{}' must be an integer or a string. "
+                    "Found '{}'")
+                raise exceptions.ImproperlyConfigured(
+                    msg.format(mcls.__name__, column.key, column.type))
+        return columns
+
+    @classmethod
+    def values_to_key(cls, mcls, values):
+        columns = cls.key_columns(mcls)
+        values = [six.text_type(value) for value in values]
+        if len(columns) > 1:
+            values = [
+                value.replace(u"\\", u"\\\\").replace(
+                    KEY_SEPARATOR, u"\\" + KEY_SEPARATOR)
+                for value in values]
+        return KEY_SEPARATOR.join(values)
+
+    @classmethod
+    def key_to_values(cls, mcls, key):
+        """Inverse of ``values_to_key``: split the ``key`` (undoing the
+        escaping of the separator) and convert every value to the python
+        type of its primary key column.
+
+        """
+        columns = cls.key_columns(mcls)
+        if len(columns) > 1:
+            values, current, chars = [], [], iter(key)
+            for char in chars:
+                if char == u"\\":
+                    current.append(next(chars, u""))
+                elif char == KEY_SEPARATOR:
+                    values.append(u"".join(current))
+                    current = []
+                else:
+                    current.append(char)
+            values.append(u"".join(current))
+        else:
+            values = [key]
+        if len(values) != len(columns):
+            msg = "Invalid key {!r} for the model '{}'"
+            raise ValueError(msg.format(key, mcls.__name__))
+        return tuple(
+            value if isinstance(column.type, db.String) else
+            column.type.python_type(value)
+            for column, value in zip(columns, values))
+
+    @classmethod
+    def model_to_key(cls, m):
+        mapper = db.inspect(type(m))
+        return cls.values_to_key(
+            type(m), mapper.primary_key_from_instance(m))
+
+    @classmethod
+    def model_class_to_key_expression(cls, mcls):
+        """SQL expression that builds the ``model_key`` of the rows of the
+        model class ``mcls`` in the database (so the registered objects
+        can be excluded with a correlated subquery).
+
+        """
+        pks = cls.key_columns(mcls)
+        columns = [db.cast(c, db.String) for c in pks]
+        if len(columns) > 1:
+            # escape the separator like values_to_key
+            columns = [
+                db.func.replace(
+                    db.func.replace(
+                        c, u"\\", u"\\\\", type_=db.String),
+                    KEY_SEPARATOR, u"\\" + KEY_SEPARATOR, type_=db.String)
+                for c in columns]
+        expression = columns[0]
+        for column in columns[1:]:
+            expression = expression + KEY_SEPARATOR + column
+        return expression
+
+    @classmethod
+    def fill_model_keys(cls, session):
+        """Fill the ``model_key`` of the rows stored by older versions of
+        Corral (with only ``model_ids``), so their objects are not alerted
+        again. Return how many rows are updated.
+
+        """
+        query = session.query(cls).filter(
+            cls.model_key.is_(None), cls.model_ids.isnot(None))
+        filled = 0
+        for alerted in query:
+            Model = cls.all_models().get(alerted.model_table)
+            if Model is None:
+                logger.warning(
+                    "Can't fill the key of the alerted object {} of '{}': "
+                    "unknown table '{}'".format(
+                        alerted.model_ids, alerted.alert_path,
+                        alerted.model_table))
+                continue
+            values = [
+                alerted.model_ids[c.key] for c in cls.key_columns(Model)]
+            alerted.model_key = cls.values_to_key(Model, values)
+            filled += 1
+        return filled
+
     @classmethod
     def model_to_columns(cls, m):
-        table = m.__table__
-        instance_as_dict = m._sa_instance_state.dict
-        ids = {
-            c: instance_as_dict[c] for c in table.primary_key.columns.keys()}
         columns = cls.model_class_to_column(type(m))
-        columns.update({"model_ids": ids})
+        columns.update({"model_key": cls.model_to_key(m)})
         return columns
 
     @classmethod
@@ -82,15 +217,15 @@ class Alerted(db.Model):
         if not hasattr(self, "_m"):
             session = object_session(self)
             Model = self.all_models()[self.model_table]
-            filters = self.model_ids
-            self._m = session.query(Model).filter_by(**filters).first()
+            ids = self.key_to_values(Model, self.model_key)
+            self._m = session.query(Model).get(ids)
         return self._m
 
     @model.setter
     def model(self, m):
         columns = self.model_to_columns(m)
         self.model_table = columns["model_table"]
-        self.model_ids = columns["model_ids"]
+        self.model_key = columns["model_key"]
 
     @property
     def alert(self):
@@ -100,3 +235,62 @@ class Alerted(db.Model):
     def alert(self, a):
         columns = self.alert_to_columns(a)
         self.alert_path = columns["alert_path"]
+
+
+class ProcessorRun(db.Model):
+    """Metrics of one execution of a Loader, Step or Alert (in a single
+    process).
+
+    """
+
+    __tablename__ = '__corral_runs__'
+    __table_args__ = (
+        db.Index(
+            "ix_corral_runs_path_started", "processor_path", "started_at"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    processor_path = db.Column(db.String(1000))
+    processor_type = db.Column(db.String(20))
+    proc_number = db.Column(db.Integer)
+    proc_n = db.Column(db.Integer)
+    started_at = db.Column(db.DateTime(timezone=True))
+    wall_time = db.Column(db.Float)
+    generate_time = db.Column(db.Float)
+    process_time = db.Column(db.Float)
+    commit_time = db.Column(db.Float)
+    db_time = db.Column(db.Float)
+    deliver_time = db.Column(db.Float)
+    generated = db.Column(db.Integer)
+    saved = db.Column(db.Integer)
+    commits = db.Column(db.Integer)
+    peak_rss = db.Column(db.BigInteger)
+    exitcode = db.Column(db.Integer)
+
+    @property
+    def processor(self):
+        return util.dimport(self.processor_path)
+
+
+class Watermark(db.Model):
+    """Last value of the ``watermark`` column processed by a Step (in a
+    single process of ``proc_n``).
+
+    """
+
+    __tablename__ = '__corral_watermarks__'
+    __table_args__ = (
+        db.UniqueConstraint(
+            "processor_path", "proc_number", "proc_n",
+            name="uq_corral_watermarks_path_proc"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    processor_path = db.Column(db.String(1000))
+    proc_number = db.Column(db.Integer)
+    proc_n = db.Column(db.Integer)
+    column = db.Column(db.String(255))
+    value = db.Column(db.PickleType)
+    updated_at = db.Column(db.DateTime(timezone=True))
+
+    @property
+    def processor(self):
+        return util.dimport(self.processor_path)
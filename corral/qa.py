@@ -42,6 +42,7 @@ import inspect
 import pkgutil
 import os
 import sys
+import shutil
 import tempfile
 import multiprocessing
 import math
@@ -51,12 +52,6 @@ import six
 
 import mock
 
-import xmltodict
-
-from flake8 import engine, reporter
-
-import sh
-
 import attr
 
 from . import util, core, db, run, cli
@@ -66,6 +61,8 @@ from .run.base import Processor
 
 conf = util.dimport("corral.conf", lazy=True)
 
+sh = util.dimport("sh", lazy=True)
+
 
 # =============================================================================
 # CONSTANTS
@@ -510,6 +507,8 @@ def run_coverage(failfast, verbosity, default_logging=False):
     if default_logging:
         params["default-logging"] = True
 
+    import xmltodict
+
     sh.coverage.erase()
     try:
         sh.coverage.run("--source", to_coverage, executable, "test", **params)
@@ -528,6 +527,7 @@ def run_coverage(failfast, verbosity, default_logging=False):
 
 
 def run_style():
+    from flake8 import engine, reporter
 
     prj_path = util.dimport(conf.PACKAGE).__file__
     prj_path_len = len(os.path.dirname(os.path.dirname(prj_path)))
@@ -626,10 +626,42 @@ def qa_report(processors, commands, *args, **kwargs):
     return report
 
 
-def run_profile():
-    profile = sh.Command("python").bake(m="cProfile")
-    with tempfile.NamedTemporaryFile() as tfp:
-        profile("-o", tfp.name, "in_corral.py", "test", _no_out=True)
-        with open(tfp.name) as fp:
-            report = fp.read()
-    return report
+def run_profile(out, command="test", arguments=(), sample_interval=None):
+    """Profile a command of the pipeline and write the pstats report in
+    ``out``.
+
+    The ``test`` command is profiled as a whole. For ``load``, ``run`` and
+    ``check-alerts`` every runner (in any process) writes its own profile,
+    and all of them are merged in ``out``. If ``sample_interval`` is given
+    the runners are also sampled, and the merged collapsed stacks are
+    written next to ``out`` (with the ``.folded`` extension).
+
+    Return the path of the samples file (or None).
+
+    """
+    profiling = run.profiling
+
+    python = sh.Command("python")
+    directory = tempfile.mkdtemp(prefix="corral_profile_")
+    env = dict(os.environ)
+    try:
+        if command == "test":
+            python(
+                "-m", "cProfile", "-o", os.path.join(directory, "main.prof"),
+                "in_corral.py", "test", *arguments, _no_out=True)
+        else:
+            env[profiling.PROFILE_DIR_ENV] = directory
+            if sample_interval:
+                env[profiling.SAMPLE_INTERVAL_ENV] = str(sample_interval)
+            python("in_corral.py", command, *arguments, _no_out=True,
+                   _env=env)
+
+        if not profiling.merge_profiles(directory, out):
+            raise ValueError(
+                "The command '{}' executed no processor".format(command))
+
+        samples_path = os.path.splitext(out)[0] + profiling.SAMPLES_EXT
+        if profiling.merge_samples(directory, samples_path):
+            return samples_path
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
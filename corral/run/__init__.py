@@ -36,5 +36,14 @@
 
 from .loader import Loader, load_loader, execute_loader  # noqa
 from .step import Step, steps_groups, load_steps, execute_step  # noqa
+from .async_step import AsyncStep  # noqa
 from .alert import Alert, alerts_groups, load_alerts, execute_alert  # noqa
+from .scheduler import processors_dag, schedule  # noqa
+from .daemon import serve  # noqa
+from .pool import ProcessorPool  # noqa
 from . import endpoints  # noqa
+from . import templates  # noqa
+from . import metrics  # noqa
+from . import exposition  # noqa
+from . import profiling  # noqa
+from . import registry  # noqa
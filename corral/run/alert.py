@@ -34,17 +34,17 @@
 # IMPORTS
 # =============================================================================
 
+import time
 import inspect
 import datetime
-import collections
 
-import six
-
-from .. import db, util, exceptions
+from .. import db, util
 from ..db.default_models import Alerted
 from ..core import logger
 
+from .registry import ProcessorRegistry
 from .base import Processor, Runner
+from . import endpoints, templates
 
 conf = util.dimport("corral.conf", lazy=True)
 
@@ -68,19 +68,56 @@ class AlertRunner(Runner):
             msg = "alert_cls '{}' must be subclass of 'corral.run.Alert'"
             raise TypeError(msg.format(alert_cls))
 
+    def process_obj(self, alert, obj):
+        alert.validate(obj)
+        generator = alert.process(obj) or []
+        if not hasattr(generator, "__iter__"):
+            generator = (generator,)
+        for proc_obj in generator:
+            alert.validate(proc_obj)
+            alert.save(proc_obj)
+            self.metrics.add_saved()
+
+    def process_objs(self, alert, objs):
+        for obj in objs:
+            alert.validate(obj)
+        generator = alert.process_batch(objs) or []
+        if not hasattr(generator, "__iter__"):
+            generator = (generator,)
+        proc_objs = []
+        for proc_obj in generator:
+            alert.validate(proc_obj)
+            proc_objs.append(proc_obj)
+        alert.save_all(proc_objs)
+        self.metrics.add_saved(len(proc_objs))
+
     def run(self):
         alert_cls = self.target
         logger.info("Executing alert '{}'".format(alert_cls))
-        with db.session_scope() as session, alert_cls(session) as alert:
-            for obj in alert.generate():
-                alert.validate(obj)
-
-                generator = alert.process(obj) or []
-                if not hasattr(generator, "__iter__"):
-                    generator = (generator,)
-                for proc_obj in generator:
-                    alert.validate(proc_obj)
-                    alert.save(proc_obj)
+        with self.measure() as metrics:
+            alert = None
+            try:
+                with db.session_scope() as session, \
+                        alert_cls(session) as alert:
+                    metrics.watch(session)
+                    with metrics.timing("generate"):
+                        query = alert.generate()
+                    generator = metrics.iterate(self.read_replica(
+                        session, query, alert.stream(query)))
+                    batch_size = alert.get_batch_size()
+                    if batch_size:
+                        for objs in util.chunks(generator, batch_size):
+                            with metrics.timing("process"):
+                                self.process_objs(alert, objs)
+                            self.add_processed(len(objs))
+                    else:
+                        for obj in generator:
+                            with metrics.timing("process"):
+                                self.process_obj(alert, obj)
+                            self.add_processed()
+            finally:
+                if alert is not None:
+                    metrics.deliver_time = alert.delivery_time
         logger.info("Done Alert '{}'".format(alert_cls))
 
 
@@ -95,19 +132,73 @@ class Alert(Processor):
 
     auto_register = True
 
+    batch_size = None
+
+    delivery_workers = None
+    delivery_queue_size = 0
+
+    alert_template = ALERT_TEMPLATE
+
+    _delivery = None
+    _alert_template = None
+
+    delivery_time = 0.
+
+    @classmethod
+    def get_batch_size(cls):
+        return cls.get_positive_or_none("batch_size")
+
+    @classmethod
+    def get_delivery_workers(cls):
+        return cls.get_positive_or_none("delivery_workers")
+
+    @classmethod
+    def get_chunk_size(cls):
+        chunk_size = super(Alert, cls).get_chunk_size()
+        if chunk_size is None:
+            chunk_size = cls.get_positive_setting_or_none("ALERT_CHUNK_SIZE")
+        return chunk_size
+
     @classmethod
     def retrieve_python_path(cls):
-        for import_string in conf.settings.ALERTS:
-            if cls == util.dimport(import_string):
-                return import_string
+        return registry.python_path(cls)
 
     def setup(self):
+        self.delivery_time = 0.
+        self.get_alert_template()
         for ep in self.alert_to:
             ep.setup(self)
+        workers = self.get_delivery_workers()
+        self._delivery = (
+            endpoints.DeliveryQueue(workers, self.delivery_queue_size)
+            if workers else None)
 
     def teardown(self, type, value, traceback):
+        start = time.time()
+        try:
+            if self._delivery is not None:
+                self._delivery.join()
+            if type is None:
+                for ep in self.alert_to:
+                    ep.flush()
+        finally:
+            for ep in self.alert_to:
+                ep.teardown(type, value, traceback)
+            self.delivery_time += time.time() - start
+
+    def deliver(self, objs):
+        """Send the objects to all the endpoints. If ``delivery_workers``
+        is set, the endpoints that support it get only the rendered data
+        in background threads; the objects never leave this thread.
+
+        """
+        start = time.time()
         for ep in self.alert_to:
-            ep.teardown(type, value, traceback)
+            if self._delivery is not None and ep.background:
+                self._delivery.put(ep, ep.prepare(objs))
+            else:
+                ep.process_batch(objs)
+        self.delivery_time += time.time() - start
 
     def generate(self):
         if self.model is None or self.conditions is None:
@@ -130,17 +221,12 @@ class Alert(Processor):
     def _filter_auto_registered(self, query):
         filters = Alerted.alert_to_columns(type(self))
         filters.update(Alerted.model_class_to_column(self.model))
-        alerteds = self.session.query(Alerted.model_ids).filter_by(**filters)
-        if alerteds.count():
-            grouped_id = collections.defaultdict(set)
-            for row in alerteds.all():
-                for k, v in six.iteritems(row[0]):
-                    grouped_id[k].add(v)
-            exclude = []
-            for k, v in grouped_id.items():
-                exclude.append(getattr(self.model, k).in_(v))
-            query = query.filter(~db.and_(*exclude))
-        return query
+        key = Alerted.model_class_to_key_expression(self.model)
+        registered = db.exists().where(db.and_(
+            Alerted.alert_path == filters["alert_path"],
+            Alerted.model_table == filters["model_table"],
+            Alerted.model_key == key))
+        return query.filter(~registered)
 
     def _auto_register(self, obj):
         register = Alerted()
@@ -156,16 +242,36 @@ class Alert(Processor):
         raise NotImplementedError()
 
     def process(self, obj):
-        for ep in self.alert_to:
-            ep.process(obj)
+        self.deliver([obj])
         if self.auto_register:
             return self._auto_register(obj)
         else:
             return self.register(obj)
 
+    def process_batch(self, objs):
+        """Process a list of ``batch_size`` objects at once. By default
+        deliver all the objects to every endpoint with a single
+        ``EndPoint.process_batch()`` call and register them.
+
+        """
+        self.deliver(objs)
+        register = (
+            self._auto_register if self.auto_register else self.register)
+        return [register(obj) for obj in objs]
+
+    def get_alert_template(self):
+        if self._alert_template is None:
+            self._alert_template = templates.compile_template(
+                self.alert_template, project_name=conf.PACKAGE)
+            self._alert_template.check(("now",))
+        return self._alert_template
+
     def render_alert(self, utcnow, endpoint, obj):
-        return ALERT_TEMPLATE.format(
-            project_name=conf.PACKAGE, now=utcnow.isoformat(), obj=obj)
+        template = self._alert_template or self.get_alert_template()
+        return template.render(obj, now=utcnow.isoformat())
+
+
+registry = ProcessorRegistry("ALERTS", Alert)
 
 
 # =============================================================================
@@ -173,39 +279,28 @@ class Alert(Processor):
 # =============================================================================
 
 def alerts_groups():
-    groups = set()
-    for cls in load_alerts():
-        groups.update(cls.get_groups())
-    return tuple(sorted(groups))
+    return registry.groups()
 
 
 def load_alerts(groups=None):
-    alerts = []
-    logger.debug("Loading Alert Classes")
-    for import_string in conf.settings.ALERTS:
-        cls = util.dimport(import_string)
-        if not (inspect.isclass(cls) and issubclass(cls, Alert)):
-            msg = "STEP '{}' must be subclass of 'corral.run.Alert'"
-            raise exceptions.ImproperlyConfigured(msg.format(import_string))
-        if groups is None or set(cls.get_groups()).intersection(groups):
-            alerts.append(cls)
-    alerts.sort(key=lambda cls: cls.__name__)
-    return tuple(alerts)
-
-
-def execute_alert(alert_cls, sync=False):
+    return registry.processors(groups)
+
+
+def execute_alert(alert_cls, sync=False, pool=None):
     if not (inspect.isclass(alert_cls) and issubclass(alert_cls, Alert)):
         msg = "alert_cls '{}' must be subclass of 'corral.run.Alert'"
         raise TypeError(msg.format(alert_cls))
     procs = []
     alert_cls.class_setup()
-    runner = alert_cls.runner_class()
-    runner.setup(alert_cls)
-    if sync:
-        runner.run()
+    if pool is not None and not sync:
+        procs.append(pool.submit(alert_cls))
     else:
-        db.engine.dispose()
-        runner.start()
-    procs.append(runner)
+        runner = alert_cls.runner_class()
+        runner.setup(alert_cls)
+        if sync:
+            runner.run()
+        else:
+            runner.start()
+        procs.append(runner)
     alert_cls.class_teardown()
     return tuple(procs)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Steps with an asynchronous ``process()`` for I/O bound pipelines"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import time
+import functools
+
+from .. import exceptions
+from ..core import logger
+
+from .step import Step, StepRunner
+
+try:
+    import asyncio
+except ImportError:  # pragma: no cover
+    asyncio = None
+
+
+# =============================================================================
+# ASYNC STEP CLASSES
+# =============================================================================
+
+class AsyncStepRunner(StepRunner):
+    """Run the ``process()`` coroutines of an ``AsyncStep`` in an event
+    loop owned by the runner. The objects are generated and saved in the
+    runner thread, so the session is never shared between coroutines.
+
+    """
+
+    def wait_first(self, loop, futures):
+        """Run the loop until at least one of the futures is done and
+        return the done ones.
+
+        """
+        waiter = asyncio.Future(loop=loop)
+
+        def wakeup(future):
+            if not waiter.done():
+                waiter.set_result(None)
+
+        for future in futures:
+            future.add_done_callback(wakeup)
+        try:
+            loop.run_until_complete(waiter)
+        finally:
+            for future in futures:
+                future.remove_done_callback(wakeup)
+        return [future for future in futures if future.done()]
+
+    def iter_process(self, step, generator):
+        """Schedule ``step.process(obj)`` for every object of the generator
+        with at most ``concurrency`` pending coroutines, and yield how many
+        objects are saved when some of them are done.
+
+        """
+        concurrency = step.get_concurrency()
+        generator = self.metrics.iterate(generator)
+        loop, pending = asyncio.new_event_loop(), {}
+        wait = functools.partial(self.wait_first, loop)
+        try:
+            for obj in generator:
+                step.validate(obj)
+                future = asyncio.ensure_future(step.process(obj), loop=loop)
+                pending[future] = (obj, time.time())
+                if len(pending) >= concurrency:
+                    yield self.save_done(step, pending, wait)
+            while pending:
+                yield self.save_done(step, pending, wait)
+        finally:
+            if pending:
+                logger.debug("Cancelling {} pending '{}' coroutines".format(
+                    len(pending), type(step)))
+                for future in pending:
+                    future.cancel()
+                loop.run_until_complete(
+                    asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+
+
+class AsyncStep(Step):
+    """A Step with a ``process(obj)`` coroutine. Up to ``concurrency``
+    objects are processed at the same time and every one is saved as soon
+    as their coroutine is done.
+
+    """
+
+    runner_class = AsyncStepRunner
+
+    concurrency = 10
+
+    @classmethod
+    def get_concurrency(cls):
+        if asyncio is None:  # pragma: no cover
+            raise exceptions.ImproperlyConfigured(
+                "'{}' requires the asyncio module".format(cls.__name__))
+        concurrency = cls.get_positive_or_none("concurrency")
+        if concurrency is None:
+            msg = "'{}.concurrency' must be a number greater than 0"
+            raise exceptions.ImproperlyConfigured(msg.format(cls.__name__))
+        return concurrency
+
+    @classmethod
+    def get_batch_size(cls):
+        # the objects are already processed concurrently
+        return None
+
+    def process(self, obj):
+        clsname = type(self).__name__
+        raise NotImplementedError(
+            "'{}' subclass must redefine the 'process' coroutine".format(
+                clsname))
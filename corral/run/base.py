@@ -35,11 +35,14 @@
 # =============================================================================
 
 import abc
+import contextlib
 import multiprocessing
 
 import six
 
-from .. import db, util
+from .. import db, util, exceptions
+
+from . import metrics, profiling
 
 conf = util.dimport("corral.conf", lazy=True)
 
@@ -53,6 +56,12 @@ class Processor(object):
 
     runner_class = None
     groups = ["default"]
+    procno = 1
+    chunk_size = None
+
+    depends_on = ()
+    produces = ()
+    consumes = ()
 
     @classmethod
     def class_setup(cls):
@@ -66,12 +75,60 @@ class Processor(object):
     def get_groups(cls):
         return cls.groups
 
+    @classmethod
+    def get_depends_on(cls):
+        return tuple(cls.depends_on or ())
+
+    @classmethod
+    def get_produces(cls):
+        return tuple(cls.produces or ())
+
+    @classmethod
+    def get_consumes(cls):
+        return tuple(cls.consumes or ())
+
+    @classmethod
+    def get_procno(cls):
+        procno = cls.procno
+        if not isinstance(procno, six.integer_types) or procno < 1:
+            msg = "'{}.procno' must be an integer greater than 0. Found '{}'"
+            raise exceptions.ImproperlyConfigured(
+                msg.format(cls.__name__, procno))
+        return procno
+
+    @classmethod
+    def get_positive_or_none(cls, name, types=six.integer_types):
+        value = getattr(cls, name)
+        if value is not None and (not isinstance(value, types) or value <= 0):
+            msg = "'{}.{}' must be None or a number greater than 0. Found '{}'"
+            raise exceptions.ImproperlyConfigured(
+                msg.format(cls.__name__, name, value))
+        return value
+
+    @classmethod
+    def get_positive_setting_or_none(cls, name):
+        value = conf.settings.get(name)
+        if value is not None and (
+            not isinstance(value, six.integer_types) or value <= 0
+        ):
+            msg = (
+                "The setting '{}' must be None or a number greater than 0. "
+                "Found '{}'")
+            raise exceptions.ImproperlyConfigured(msg.format(name, value))
+        return value
+
+    @classmethod
+    def get_chunk_size(cls):
+        return cls.get_positive_or_none("chunk_size")
+
     @classmethod
     def retrieve_python_path(cls):
         return cls.__name__
 
-    def __init__(self, session):
+    def __init__(self, session, proc_number=0, proc_n=1):
         self.__session = session
+        self.__proc_number = proc_number
+        self.__proc_n = proc_n
 
     def __enter__(self):
         self.setup()
@@ -92,12 +149,82 @@ class Processor(object):
             raise TypeError(msg.format(obj))
 
     def filter_by_proc(self, query, proc_number, proc_n):
+        """Restrict the query to the slice of rows handled by the process
+        ``proc_number`` of ``proc_n``.
+
+        By default the rows are partitioned by the modulo of the first
+        primary key column of the queried model. Override this method if
+        the model has a non-integer primary key or the ``generate()`` does
+        not return a query.
+
+        """
+        if proc_n <= 1:
+            return query
+        if not isinstance(query, db.Query):
+            clsname = type(self).__name__
+            raise NotImplementedError(
+                "'{}' generate don't return a query; redefine "
+                "'filter_by_proc' to run in multiple processes".format(
+                    clsname))
+        entity = query.column_descriptions[0]["entity"]
+        pk = db.inspect(entity).primary_key[0]
+        return query.filter(pk % proc_n == proc_number)
+
+    def stream(self, query):
+        """If the processor has a ``chunk_size``, fetch the rows of the query
+        in batches of that size with a server side cursor (when the database
+        support it) instead of load all the result set into memory.
+
+        """
+        chunk_size = self.get_chunk_size()
+        if chunk_size and isinstance(query, db.Query):
+            query = query.yield_per(chunk_size)
         return query
 
+    def paginate(self, query, size):
+        """Iterate over the query in pages of ``size`` rows sorted by the
+        primary key of the queried model.
+
+        Every page is retrieved with an independent query filtered by the
+        last seen primary key, so no cursor is kept open between pages and
+        the session can be safely committed in the middle of the iteration.
+
+        """
+        if not isinstance(query, db.Query):
+            for obj in query:
+                yield obj
+            return
+
+        entity = query.column_descriptions[0]["entity"]
+        pks = db.inspect(entity).primary_key
+        key = pks[0] if len(pks) == 1 else db.tuple_(*pks)
+        query = query.order_by(None).order_by(*pks)
+
+        last = None
+        while True:
+            page_query = query if last is None else query.filter(key > last)
+            page = page_query.limit(size).all()
+            if page:
+                identity = db.inspect(page[-1]).identity
+                last = (
+                    identity[0] if len(pks) == 1 else db.tuple_(*identity))
+            for obj in page:
+                yield obj
+            if len(page) < size:
+                break
+
     def save(self, obj):
         if isinstance(obj, db.Model):
             self.session.add(obj)
 
+    def save_all(self, objs):
+        """Save a list of objects. By default call ``save`` with every
+        object, so redefine this method only to save them faster.
+
+        """
+        for obj in objs:
+            self.save(obj)
+
     def delete(self, obj):
         if isinstance(obj, db.Model):
             self.session.delete(obj)
@@ -110,10 +237,25 @@ class Processor(object):
     def session(self):
         return self.__session
 
+    @property
+    def proc_number(self):
+        return self.__proc_number
+
+    @property
+    def proc_n(self):
+        return self.__proc_n
+
 
 @six.add_metaclass(abc.ABCMeta)
 class Runner(multiprocessing.Process):
 
+    def __init__(self, *args, **kwargs):
+        super(Runner, self).__init__(*args, **kwargs)
+        self._processed = multiprocessing.Value("L", 0)
+        self._metrics_reader, self._metrics_writer = multiprocessing.Pipe(
+            duplex=False)
+        self._snapshot = None
+
     @abc.abstractmethod
     def validate_target(self, target):
         raise NotImplementedError  # pragma: no cover
@@ -122,6 +264,66 @@ class Runner(multiprocessing.Process):
     def run(self):
         raise NotImplementedError  # pragma: no cover
 
-    def setup(self, target):
+    def setup(self, target, proc_number=0, proc_n=1):
         self.validate_target(target)
         self.target = target
+        self.proc_number = proc_number
+        self.proc_n = proc_n
+        self.metrics = metrics.RunMetrics(target, proc_number, proc_n)
+
+    @contextlib.contextmanager
+    def measure(self):
+        """Collect the ``RunMetrics`` of the execution of the block and
+        record them when the block ends (with exitcode 1 on errors). The
+        block is also profiled if the ``profile`` command requested it.
+
+        """
+        self.metrics = metrics.RunMetrics(
+            self.target, self.proc_number, self.proc_n)
+        try:
+            with profiling.profile_run(self):
+                yield self.metrics
+        except BaseException:
+            self._finish_metrics(1)
+            raise
+        self._finish_metrics(0)
+
+    def _finish_metrics(self, exitcode):
+        self.metrics.finish(exitcode)
+        metrics.record_run(self.metrics)
+        self._snapshot = self.metrics.snapshot()
+        # if this is the runner process send the metrics to the parent
+        if multiprocessing.current_process() is self:
+            self._metrics_writer.send(self._snapshot)
+
+    def collect_metrics(self):
+        """Return the ``RunMetrics.snapshot()`` of the finished run (or None
+        if the run is not finished or was killed).
+
+        """
+        if self._snapshot is None and self._metrics_reader.poll():
+            self._snapshot = self._metrics_reader.recv()
+        return self._snapshot
+
+    def read_replica(self, session, query, iterable):
+        """If the database has read replicas, read the objects of
+        ``iterable`` (the result of ``query``) from a replica, re-reading
+        them in the primary before they are processed.
+
+        """
+        if isinstance(query, db.Query) and getattr(
+                session, "replicated", False):
+            return session.iterate_replica(query, iterable)
+        return iterable
+
+    def add_processed(self, number=1):
+        with self._processed.get_lock():
+            self._processed.value += number
+
+    @property
+    def processed(self):
+        """Number of objects generated by the processor and processed by
+        this runner (shared between the runner process and the parent).
+
+        """
+        return self._processed.value
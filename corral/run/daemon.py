@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# =============================================================================
+# DOC
+# =============================================================================
+
+"""Long-running execution of the processors with adaptive polling"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import time
+import collections
+
+from ..core import logger
+
+from . import exposition
+
+from .scheduler import POLL_INTERVAL
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+MIN_INTERVAL = 1.
+
+MAX_INTERVAL = 60.
+
+BACKOFF_FACTOR = 2.
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def next_interval(interval, processed, min_interval=MIN_INTERVAL,
+                  max_interval=MAX_INTERVAL, factor=BACKOFF_FACTOR):
+    """Return how many seconds wait until the next execution of a
+    processor: if the last execution processed nothing the interval grows
+    by ``factor`` (until ``max_interval``), otherwise it is reset to
+    ``min_interval``.
+
+    """
+    if processed:
+        return min_interval
+    return min(max(interval, min_interval) * factor, max_interval)
+
+
+def serve(processors, execute, min_interval=MIN_INTERVAL,
+          max_interval=MAX_INTERVAL, factor=BACKOFF_FACTOR,
+          max_workers=None, should_stop=None, poll_interval=POLL_INTERVAL):
+    """Execute the processors again and again until ``should_stop()``
+    returns True.
+
+    ``execute`` must be a function that receives a processor class, starts
+    it, and returns the started runners. Every processor is re-executed
+    ``min_interval`` seconds after the previous execution finish, and if
+    the execution processed nothing the wait grows exponentially until
+    ``max_interval``.
+
+    Return the number of failed executions.
+
+    """
+    processors = tuple(processors)
+    should_stop = should_stop or (lambda: False)
+
+    intervals = dict.fromkeys(processors, min_interval)
+    next_run = dict.fromkeys(processors, 0)
+    running = collections.OrderedDict()
+    failures = 0
+
+    while True:
+        stopping = should_stop()
+        if stopping and not running:
+            break
+
+        now = time.time()
+        for proc_cls in processors:
+            if stopping or (max_workers and len(running) >= max_workers):
+                break
+            if proc_cls not in running and now >= next_run[proc_cls]:
+                running[proc_cls] = tuple(execute(proc_cls) or ())
+
+        finished = [
+            proc_cls for proc_cls, procs in running.items()
+            if all(proc.exitcode is not None for proc in procs)]
+        for proc_cls in finished:
+            procs = running.pop(proc_cls)
+            processed, failed = 0, False
+            for proc in procs:
+                proc.join()
+                processed += proc.processed
+                failed = failed or bool(proc.exitcode)
+            exposition.observe(procs)
+            if failed:
+                failures += 1
+                logger.error("'{}' failed".format(proc_cls.__name__))
+
+            interval = next_interval(
+                intervals[proc_cls], processed, min_interval=min_interval,
+                max_interval=max_interval, factor=factor)
+            intervals[proc_cls] = interval
+            next_run[proc_cls] = time.time() + interval
+            logger.debug(
+                "'{}' processed {} objects. Next run in {} seconds".format(
+                    proc_cls.__name__, processed, interval))
+
+        time.sleep(poll_interval)
+
+    return failures
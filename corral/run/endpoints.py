@@ -34,19 +34,126 @@
 # IMPORTS
 # =============================================================================
 
+import os
 import abc
+import sys
+import gzip
+import json
+import time
+import atexit
+import shutil
+import socket
 import datetime
 import smtplib
 import codecs
+import threading
+import collections
 from email.mime.text import MIMEText
 
 import six
+from six.moves import queue
 
 from .. import util
+from . import templates
 
 conf = util.dimport("corral.conf", lazy=True)
 
 
+# =============================================================================
+# SMTP CONNECTION POOL
+# =============================================================================
+
+class SMTPPool(object):
+    """Process-wide pool of open SMTP connections, keyed by the EMAIL
+    settings that created them.
+
+    A connection idle more than ``check_after`` seconds is checked with a
+    ``NOOP`` before being reused, and discarded (and replaced with a new
+    one) if the server does not answer. Connections inherited through a
+    ``fork()`` are dropped without touching the parent sockets.
+
+    """
+
+    def __init__(self, check_after=0, max_idle=None):
+        self.check_after = check_after
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = collections.defaultdict(list)
+        self._pid = os.getpid()
+
+    def _key(self, settings):
+        return tuple(sorted(settings.items()))
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._idle.clear()
+            self._pid = os.getpid()
+
+    def connect(self, settings):
+        server = smtplib.SMTP(settings["server"])
+        if settings.get("tls"):
+            server.ehlo()
+            server.starttls()
+        if settings.get("password") is not None:
+            server.login(settings["user"], settings["password"])
+        return server
+
+    def is_alive(self, server):
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, socket.error):
+            return False
+
+    def discard(self, server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, socket.error):
+            server.close()
+
+    def acquire(self, settings):
+        """Return an open connection for the given settings (reused if
+        possible).
+
+        """
+        key = self._key(settings)
+        while True:
+            with self._lock:
+                self._check_pid()
+                idle = self._idle[key]
+                if not idle:
+                    break
+                server, released_at = idle.pop()
+            elapsed = time.time() - released_at
+            if self.max_idle is not None and elapsed > self.max_idle:
+                self.discard(server)
+            elif elapsed < self.check_after or self.is_alive(server):
+                return server
+            else:
+                self.discard(server)
+        return self.connect(settings)
+
+    def release(self, settings, server):
+        """Give back a connection obtained with ``acquire()``."""
+        with self._lock:
+            self._check_pid()
+            self._idle[self._key(settings)].append((server, time.time()))
+
+    def close(self):
+        """Close all the idle connections."""
+        with self._lock:
+            self._check_pid()
+            servers = [
+                server for idle in self._idle.values() for server, _ in idle]
+            self._idle.clear()
+        for server in servers:
+            self.discard(server)
+
+
+smtp_pool = SMTPPool()
+
+atexit.register(smtp_pool.close)
+
+
 # =============================================================================
 # BASE CLASS
 # =============================================================================
@@ -54,6 +161,9 @@ conf = util.dimport("corral.conf", lazy=True)
 @six.add_metaclass(abc.ABCMeta)
 class EndPoint(object):
 
+    # if True the alert can call deliver() from a background thread
+    background = False
+
     def setup(self, alert):
         self._alert = alert
 
@@ -61,6 +171,37 @@ class EndPoint(object):
     def process(self):
         raise NotImplementedError()  # pragma: no cover
 
+    def process_batch(self, objs):
+        """Deliver a list of objects at once. By default call ``process``
+        with every object.
+
+        """
+        for obj in objs:
+            self.process(obj)
+
+    def prepare(self, objs):
+        """Build (in the alert thread) the plain data that ``deliver()``
+        needs to send the objects. The background delivery threads never
+        receive the objects, because they and their session can only be
+        used by the alert thread.
+
+        """
+        raise NotImplementedError()  # pragma: no cover
+
+    def deliver(self, payload):
+        """Send the data returned by ``prepare()``, maybe from a background
+        thread if ``background`` is True.
+
+        """
+        raise NotImplementedError()  # pragma: no cover
+
+    def flush(self):
+        """Deliver everything buffered by the endpoint. Is called before the
+        ``teardown`` if the alert finish without errors.
+
+        """
+        pass
+
     def teardown(self, type, value, traceback):
         self._alert = None
         pass
@@ -80,25 +221,35 @@ class EndPoint(object):
 
 class Email(EndPoint):
 
-    def __init__(self, to, sent_from=None, subject=None, message=None):
+    background = True
+
+    def __init__(self, to, sent_from=None, subject=None, message=None,
+                 digest=False):
         self.server = None
         self.to = to
         self.sent_from = sent_from
         self.subject = subject
         self.message = message
+        self.digest = digest
+        self._digest = collections.OrderedDict()
+        self._subject = self._message = None
 
     def setup(self, alert):
         super(Email, self).setup(alert)
-        self.server = smtplib.SMTP(conf.settings.EMAIL["server"])
-        if conf.settings.EMAIL["tls"]:
-            self.server.ehlo()
-            self.server.starttls()
-        self.server.login(
-            conf.settings.EMAIL["user"], conf.settings.EMAIL["password"])
+        self._digest.clear()
+        self._subject = None
+        self._subject = self._default_subject()
+        self._message = (
+            None if self.message is None else
+            templates.compile_template(self.message))
+        if self._message is not None:
+            self._message.check()
+        self.server = smtp_pool.acquire(conf.settings.EMAIL)
 
     def teardown(self, *args):
         super(Email, self).teardown(*args)
-        self.server.quit()
+        self._digest.clear()
+        smtp_pool.release(conf.settings.EMAIL, self.server)
 
     def get_recipients(self, obj):
         return self.to
@@ -113,50 +264,272 @@ class Email(EndPoint):
             conf.settings.EMAIL["user"],
             conf.settings.EMAIL["server"].split(":", 1)[0])
 
+    def _default_subject(self):
+        if self._subject is not None:
+            return self._subject
+        return "[ALERT - {}] {}".format(
+            conf.PACKAGE, type(self.alert).__name__)
+
     def get_subject(self, obj):
         if self.subject is not None:
             return self.subject
-        return "[ALERT - {}] {}".format(
-            conf.PACKAGE, type(self.alert).__name__)
+        return self._default_subject()
 
     def get_message(self, obj):
-        if self.message is not None:
-            return self.message.format(obj)
-        return self.render_alert(obj)
-
-    def process(self, obj):
-        to = self.get_recipients(obj)
-        sent_from = self.get_sent_from(obj)
-        message = self.get_message(obj)
+        if self.message is None:
+            return self.render_alert(obj)
+        template = self._message or templates.compile_template(self.message)
+        return template.render(obj)
 
+    def send(self, sent_from, to, subject, message):
         msg = MIMEText(message)
-        msg['Subject'] = self.get_subject(obj)
+        msg['Subject'] = subject
         msg['From'] = sent_from
         msg['To'] = ",".join(to)
 
-        self.server.sendmail(sent_from, to, msg.as_string())
+        try:
+            self.server.sendmail(sent_from, to, msg.as_string())
+        except (smtplib.SMTPServerDisconnected, socket.error):
+            # the pooled connection was closed by the server; retry once
+            self.server.close()
+            self.server = smtp_pool.connect(conf.settings.EMAIL)
+            self.server.sendmail(sent_from, to, msg.as_string())
+
+    def prepare(self, objs):
+        return [
+            (self.get_sent_from(obj), tuple(self.get_recipients(obj)),
+             self.get_subject(obj), self.get_message(obj))
+            for obj in objs]
+
+    def deliver(self, payload):
+        for sent_from, to, subject, message in payload:
+            if self.digest:
+                key = (sent_from, to, subject)
+                self._digest.setdefault(key, []).append(message)
+            else:
+                self.send(sent_from, list(to), subject, message)
+
+    def process(self, obj):
+        self.deliver(self.prepare([obj]))
+
+    def process_batch(self, objs):
+        self.deliver(self.prepare(objs))
+
+    def flush(self):
+        """Send one email with all the messages buffered in digest mode for
+        every sender, recipients and subject.
+
+        """
+        while self._digest:
+            (sent_from, to, subject), messages = self._digest.popitem(
+                last=False)
+            self.send(sent_from, list(to), subject, "\n".join(messages))
 
 
 class File(EndPoint):
+    """Write the rendered alerts to a file (or to a StringIO if the path
+    is ``File.MEMORY``).
+
+    The writes can be buffered (``buffering`` bytes, flushed at most every
+    ``flush_interval`` seconds and optionally ``fsync``-ed), the file can
+    be rotated by size (``max_bytes``) or age (``rotate_interval``) and
+    the rotated files gzipped (``compress``). With ``json_lines`` every
+    alert is written as one JSON object by line.
+
+    """
 
     MEMORY = ":memory:"
 
-    def __init__(self, path, mode="a", encoding="utf8"):
+    background = True
+
+    def __init__(self, path, mode="a", encoding="utf8", buffering=None,
+                 flush_interval=None, fsync=False, max_bytes=None,
+                 rotate_interval=None, compress=False, json_lines=False):
         self.path = path
         self.mode = mode
         self.encoding = encoding
+        self.buffering = buffering
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.compress = compress
+        self.json_lines = json_lines
 
     def setup(self, alert):
         super(File, self).setup(alert)
         if self.path == File.MEMORY:
             self.fp = six.StringIO()
         else:
-            self.fp = codecs.open(self.path, self.mode, self.encoding)
+            self.open(self.mode)
 
     def teardown(self, *args):
         super(File, self).teardown(*args)
         if self.path != File.MEMORY and self.fp and not self.fp.closed:
             self.fp.close()
 
+    def open(self, mode):
+        new = mode.startswith("w") or not os.path.exists(self.path)
+        if self.buffering is None:
+            self.fp = codecs.open(self.path, mode, self.encoding)
+        else:
+            self.fp = codecs.open(
+                self.path, mode, self.encoding, buffering=self.buffering)
+        self._flushed_at = time.time()
+        self._created_at = self.load_created_at(new)
+        self._size = (
+            os.path.getsize(self.path) if os.path.exists(self.path) else 0)
+
+    @property
+    def created_path(self):
+        dirname, basename = os.path.split(self.path)
+        return os.path.join(dirname, ".{}.created".format(basename))
+
+    def load_created_at(self, new):
+        """Return when the current file was created. With a
+        ``rotate_interval`` the time is stored in a hidden file next to it,
+        so the age of the file is kept between the runs of the alert.
+
+        """
+        if self.rotate_interval is None:
+            return time.time()
+        if not new:
+            try:
+                with open(self.created_path) as fp:
+                    return float(fp.read())
+            except (IOError, OSError, ValueError):
+                pass
+        created_at = time.time()
+        with open(self.created_path, "w") as fp:
+            fp.write(repr(created_at))
+        return created_at
+
+    def must_rotate(self):
+        if self.path == File.MEMORY:
+            return False
+        elif self.max_bytes is not None and self._size >= self.max_bytes:
+            return True
+        elif self.rotate_interval is not None:
+            return time.time() - self._created_at >= self.rotate_interval
+        return False
+
+    def rotate(self):
+        """Rename the current file with the current UTC time as suffix
+        (gzipped if ``compress`` is True) and open a new one.
+
+        """
+        self.fp.close()
+        stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+        rotated = "{}.{}".format(self.path, stamp)
+        os.rename(self.path, rotated)
+        if self.compress:
+            with open(rotated, "rb") as src, \
+                    gzip.open(rotated + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+        self.open("a")
+
+    def write(self, text):
+        if self.must_rotate():
+            self.rotate()
+        self.fp.write(text)
+        if self.path == File.MEMORY:
+            return
+        self._size += len(text.encode(self.encoding))
+        if (self.flush_interval is not None and
+                time.time() - self._flushed_at >= self.flush_interval):
+            self.flush()
+
+    def render(self, obj):
+        rendered = self.render_alert(obj)
+        if not self.json_lines:
+            return rendered
+        alert_cls = type(self.alert)
+        return json.dumps({
+            "alert": ".".join([alert_cls.__module__, alert_cls.__name__]),
+            "timestamp": datetime.datetime.utcnow().isoformat(),
+            "message": rendered.rstrip("\n")}) + "\n"
+
+    def prepare(self, objs):
+        return "".join(self.render(obj) for obj in objs)
+
+    def deliver(self, payload):
+        self.write(payload)
+
     def process(self, obj):
-        self.fp.write(self.render_alert(obj))
+        self.deliver(self.prepare([obj]))
+
+    def process_batch(self, objs):
+        self.deliver(self.prepare(objs))
+
+    def flush(self):
+        self.fp.flush()
+        if self.fsync and self.path != File.MEMORY:
+            os.fsync(self.fp.fileno())
+        self._flushed_at = time.time()
+
+
+# =============================================================================
+# DELIVERY QUEUE
+# =============================================================================
+
+class DeliveryQueue(object):
+    """Deliver the payloads of the alerted objects (built with
+    ``EndPoint.prepare()``) to the endpoints in background threads.
+
+    Every endpoint is assigned to one of the ``workers`` threads, so the
+    payloads are delivered to a given endpoint in the same order that they
+    were alerted, and the endpoints are never called concurrently. When a
+    thread has ``maxsize`` pending deliveries, ``put()`` blocks.
+
+    """
+
+    def __init__(self, workers, maxsize=0):
+        self._queues = [queue.Queue(maxsize) for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._consume, args=(q,))
+            for q in self._queues]
+        self._endpoints = {}
+        self._exc_info = None
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _consume(self, q):
+        while True:
+            task = q.get()
+            if task is None:
+                break
+            func, args = task
+            if self._exc_info is None:
+                try:
+                    func(*args)
+                except Exception:
+                    self._exc_info = sys.exc_info()
+
+    def _raise_if_failed(self):
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+
+    def put(self, endpoint, payload):
+        """Enqueue the delivery of ``payload`` with ``endpoint.deliver()``.
+
+        Raise the error of any previously failed delivery.
+
+        """
+        self._raise_if_failed()
+        idx = self._endpoints.setdefault(
+            id(endpoint), len(self._endpoints) % len(self._queues))
+        self._queues[idx].put((endpoint.deliver, (payload,)))
+
+    def join(self):
+        """Wait for all the pending deliveries and stop the threads.
+
+        Raise the error of the first failed delivery.
+
+        """
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._raise_if_failed()
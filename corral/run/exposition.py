@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Exposition of the runs metrics in the OpenMetrics (Prometheus) text
+format, as a file or through HTTP.
+
+"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import os
+import time
+import tempfile
+import threading
+import collections
+
+from six.moves import BaseHTTPServer
+
+from .. import util
+from ..core import logger
+
+from .metrics import LATENCY_BUCKETS
+
+conf = util.dimport("corral.conf", lazy=True)
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# family name, help and key of the RunMetrics snapshot (None if computed)
+COUNTERS = (
+    ("corral_runs", "Executions of the processor", None),
+    ("corral_run_failures", "Failed executions of the processor", None),
+    ("corral_objects_processed", "Objects generated and processed",
+     "generated"),
+    ("corral_objects_saved", "Objects saved", "saved"),
+    ("corral_commits", "Transactions committed", "commits"),
+    ("corral_generate_seconds", "Time spent in generate()",
+     "generate_time"),
+    ("corral_process_seconds", "Time spent in process()", "process_time"),
+    ("corral_commit_seconds", "Time spent committing", "commit_time"),
+    ("corral_db_seconds", "Time spent executing SQL statements", "db_time"),
+    ("corral_delivery_seconds", "Time spent delivering alerts",
+     "deliver_time"))
+
+GAUGES = (
+    ("corral_last_run_timestamp_seconds",
+     "Unix time when the last execution finished"),
+    ("corral_last_run_duration_seconds",
+     "Duration of the last execution"),
+    ("corral_last_run_peak_rss_bytes",
+     "Maximum resident memory of the process of the last execution"))
+
+LATENCY_HISTOGRAM = (
+    "corral_process_latency_seconds", "Latency of every process() call")
+
+
+# =============================================================================
+# REGISTRY
+# =============================================================================
+
+class MetricsRegistry(object):
+    """Aggregate the metrics of the finished runs by processor."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = collections.OrderedDict()
+
+    def _new_series(self):
+        series = {name: 0 for name, _, _ in COUNTERS}
+        series.update({name: None for name, _ in GAUGES})
+        series["latency_buckets"] = [0] * len(LATENCY_BUCKETS)
+        series["latency_sum"] = 0.
+        return series
+
+    def observe(self, snapshot):
+        """Add the ``RunMetrics.snapshot()`` of a finished run."""
+        if not snapshot:
+            return
+        key = (snapshot["processor_path"], snapshot["processor_type"])
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = self._new_series()
+            series["corral_runs"] += 1
+            series["corral_run_failures"] += int(bool(snapshot["exitcode"]))
+            for name, _, skey in COUNTERS:
+                if skey is not None:
+                    series[name] += snapshot.get(skey) or 0
+            series["corral_last_run_timestamp_seconds"] = time.time()
+            series["corral_last_run_duration_seconds"] = (
+                snapshot["wall_time"])
+            series["corral_last_run_peak_rss_bytes"] = (
+                snapshot["peak_rss"] * 1024
+                if snapshot["peak_rss"] is not None else None)
+            for idx, count in enumerate(snapshot["process_latency"]):
+                series["latency_buckets"][idx] += count
+            series["latency_sum"] += snapshot["process_time"]
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        """Return all the metrics in the OpenMetrics text format."""
+        with self._lock:
+            series = [
+                (self._labels(path, ptype), values)
+                for (path, ptype), values in self._series.items()]
+
+        lines = []
+        for name, help_text, _ in COUNTERS:
+            lines.append("# TYPE {} counter".format(name))
+            lines.append("# HELP {} {}".format(name, help_text))
+            for labels, values in series:
+                lines.append("{}_total{{{}}} {}".format(
+                    name, labels, values[name]))
+
+        for name, help_text in GAUGES:
+            lines.append("# TYPE {} gauge".format(name))
+            lines.append("# HELP {} {}".format(name, help_text))
+            for labels, values in series:
+                if values[name] is not None:
+                    lines.append("{}{{{}}} {}".format(
+                        name, labels, values[name]))
+
+        name, help_text = LATENCY_HISTOGRAM
+        lines.append("# TYPE {} histogram".format(name))
+        lines.append("# HELP {} {}".format(name, help_text))
+        for labels, values in series:
+            cumulative = 0
+            for upper, count in zip(LATENCY_BUCKETS,
+                                    values["latency_buckets"]):
+                cumulative += count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    name, labels, self._format_bound(upper), cumulative))
+            lines.append("{}_count{{{}}} {}".format(name, labels, cumulative))
+            lines.append("{}_sum{{{}}} {}".format(
+                name, labels, values["latency_sum"]))
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def _labels(self, path, ptype):
+        escape = (
+            lambda v: v.replace("\\", "\\\\").replace('"', '\\"'))
+        return 'processor="{}",type="{}"'.format(escape(path), escape(ptype))
+
+    def _format_bound(self, upper):
+        return "+Inf" if upper == float("inf") else repr(float(upper))
+
+    def write(self, path):
+        """Write the metrics to ``path`` atomically (a temporary file in
+        the same directory is renamed over it).
+
+        """
+        dirname = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fp:
+                fp.write(self.render())
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+
+registry = MetricsRegistry()
+
+
+# =============================================================================
+# HTTP
+# =============================================================================
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    registry = registry
+
+    def do_GET(self):
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        logger.debug("metrics: " + fmt % args)
+
+
+def start_http_server(port, addr="", registry=registry):
+    """Serve the metrics of the registry in a background thread. Return
+    the server (call ``shutdown()`` to stop it).
+
+    """
+    handler = type(
+        "MetricsHandler", (MetricsHandler,), {"registry": registry})
+    server = BaseHTTPServer.HTTPServer((addr, port), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def observe(procs, registry=registry):
+    """Add the metrics of the finished runners (or pool tasks) to the
+    registry, and rewrite the ``METRICS_FILE`` if it is configured.
+
+    """
+    for proc in procs:
+        collect = getattr(proc, "collect_metrics", None)
+        if collect is not None:
+            registry.observe(collect())
+    path = conf.settings.get("METRICS_FILE")
+    if path:
+        try:
+            registry.write(path)
+        except Exception as err:
+            logger.warning("Can't write the metrics file: {}".format(err))
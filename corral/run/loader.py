@@ -35,6 +35,11 @@
 # =============================================================================
 
 import inspect
+import binascii
+import datetime
+import collections
+
+import six
 
 from .. import db, util, exceptions
 from ..core import logger
@@ -44,6 +49,16 @@ from .base import Processor, Runner
 conf = util.dimport("corral.conf", lazy=True)
 
 
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+# escapes of the PostgreSQL COPY text format
+COPY_ESCAPES = {
+    ord(u"\\"): u"\\\\", ord(u"\t"): u"\\t",
+    ord(u"\n"): u"\\n", ord(u"\r"): u"\\r"}
+
+
 # =============================================================================
 # LOADER CLASSES
 # =============================================================================
@@ -59,11 +74,29 @@ class LoaderRunner(Runner):
     def run(self):
         loader_cls = self.target
         logger.info("Executing loader '{}'".format(loader_cls))
-        with db.session_scope() as session, loader_cls(session) as ldr:
-            generator = ldr.generate()
-            for obj in (generator or []):
-                ldr.validate(obj)
-                ldr.save(obj)
+        with self.measure() as metrics, db.session_scope() as session, \
+                loader_cls(session) as ldr:
+            metrics.watch(session)
+            with metrics.timing("generate"):
+                generator = ldr.generate() or []
+            generator = metrics.iterate(generator)
+            bulk_size = ldr.get_bulk_size()
+            if bulk_size:
+                for objs in util.chunks(generator, bulk_size):
+                    with metrics.timing("process"):
+                        for obj in objs:
+                            ldr.validate(obj)
+                        ldr.bulk_save(objs)
+                    session.commit()
+                    metrics.add_saved(len(objs))
+                    self.add_processed(len(objs))
+            else:
+                for obj in generator:
+                    with metrics.timing("process"):
+                        ldr.validate(obj)
+                        ldr.save(obj)
+                    metrics.add_saved()
+                    self.add_processed()
         logger.info("Done Loader '{}'".format(loader_cls))
 
 
@@ -71,15 +104,126 @@ class Loader(Processor):
 
     runner_class = LoaderRunner
 
+    model = None
+
+    bulk_size = None
+    bulk_copy = False
+
     @classmethod
     def retrieve_python_path(cls):
         return conf.settings.LOADER
 
+    @classmethod
+    def get_bulk_size(cls):
+        bulk_size = cls.get_positive_or_none("bulk_size")
+        save = six.get_unbound_function(cls.save)
+        if bulk_size and save is not six.get_unbound_function(Processor.save):
+            msg = (
+                "'{}' redefines 'save', that is never called in bulk mode "
+                "(with 'bulk_size'); redefine 'bulk_save' instead")
+            raise exceptions.ImproperlyConfigured(msg.format(cls.__name__))
+        return bulk_size
+
+    def validate(self, obj):
+        # in bulk mode the dicts are rows of the model table
+        if not (isinstance(obj, dict) and self.bulk_size):
+            super(Loader, self).validate(obj)
+
+    def bulk_rows(self, objs):
+        """Convert a list of model instances and dicts (rows of the
+        ``model`` table) into a dict ``{(table, columns): [rows...]}``.
+
+        """
+        grouped = collections.OrderedDict()
+        for obj in objs:
+            if isinstance(obj, dict):
+                if self.model is None:
+                    clsname = type(self).__name__
+                    raise exceptions.ImproperlyConfigured(
+                        "'{}' must redefine the 'model' class-attribute to "
+                        "load dicts".format(clsname))
+                table, row = self.model.__table__, obj
+            elif isinstance(obj, db.Model):
+                state = db.inspect(obj)
+                for rel in state.mapper.relationships:
+                    if state.dict.get(rel.key):
+                        msg = (
+                            "The relationship '{}' of {} can't be bulk "
+                            "loaded; set the foreign key columns instead")
+                        raise exceptions.ImproperlyConfigured(
+                            msg.format(rel.key, obj))
+                table, row = obj.__table__, {
+                    prop.columns[0].key: state.dict[prop.key]
+                    for prop in state.mapper.column_attrs
+                    if prop.key in state.dict}
+            else:
+                msg = "{} must be a dict or an instance of corral.db.Model"
+                raise TypeError(msg.format(obj))
+            key = (table, tuple(sorted(row.keys())))
+            grouped.setdefault(key, []).append(row)
+        return grouped
+
+    def bulk_save(self, objs):
+        """Insert all the objects with one ``executemany`` by table (or a
+        COPY if ``bulk_copy`` is True and the database is PostgreSQL),
+        without pass through the session unit of work.
+
+        """
+        connection = self.session.connection()
+        use_copy = (
+            self.bulk_copy and
+            connection.dialect.name == "postgresql" and
+            connection.dialect.driver == "psycopg2")
+        for (table, columns), rows in self.bulk_rows(objs).items():
+            if use_copy:
+                copy_rows(connection, table, columns, rows)
+            else:
+                connection.execute(table.insert(), rows)
+
 
 # =============================================================================
 # FUNCTIONS
 # =============================================================================
 
+def copy_value(value):
+    if value is None:
+        return "\\N"
+    elif isinstance(value, bool):
+        return "t" if value else "f"
+    elif isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    elif isinstance(value, float):
+        # str() of python 2 rounds to 12 significant digits
+        value = repr(float(value))
+    elif isinstance(value, six.binary_type):
+        if six.PY2:  # the python 2 str are text
+            value = value.decode("utf8")
+        else:  # bytea in hex format, with the backslash escaped
+            return u"\\\\x" + binascii.hexlify(value).decode("ascii")
+    elif not isinstance(value, six.text_type):
+        value = six.text_type(value)
+    return value.translate(COPY_ESCAPES)
+
+
+def copy_rows(connection, table, columns, rows):
+    buff = six.StringIO()
+    for row in rows:
+        buff.write(u"\t".join(copy_value(row[col]) for col in columns))
+        buff.write(u"\n")
+    buff.seek(0)
+
+    sql = "COPY {} ({}) FROM STDIN".format(
+        connection.dialect.identifier_preparer.format_table(table),
+        ", ".join(
+            connection.dialect.identifier_preparer.quote(table.c[col].name)
+            for col in columns))
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(sql, buff)
+    finally:
+        cursor.close()
+
+
 def load_loader():
     logger.debug("Loading Loader Class")
     import_string = conf.settings.LOADER
@@ -90,7 +234,7 @@ def load_loader():
     return cls
 
 
-def execute_loader(loader_cls, sync=False):
+def execute_loader(loader_cls, sync=False, pool=None):
 
     if not (inspect.isclass(loader_cls) and issubclass(loader_cls, Loader)):
         msg = "loader_cls '{}' must be subclass of 'corral.run.Loader'"
@@ -98,13 +242,15 @@ def execute_loader(loader_cls, sync=False):
 
     procs = []
     loader_cls.class_setup()
-    runner = loader_cls.runner_class()
-    runner.setup(loader_cls)
-    if sync:
-        runner.run()
+    if pool is not None and not sync:
+        procs.append(pool.submit(loader_cls))
     else:
-        db.engine.dispose()
-        runner.start()
-    procs.append(runner)
+        runner = loader_cls.runner_class()
+        runner.setup(loader_cls)
+        if sync:
+            runner.run()
+        else:
+            runner.start()
+        procs.append(runner)
     loader_cls.class_teardown()
     return tuple(procs)
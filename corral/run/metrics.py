@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Runtime metrics of the Loader, Steps and Alerts executions"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import sys
+import math
+import time
+import datetime
+import contextlib
+
+from sqlalchemy import event
+
+from .. import db, util
+from ..core import logger
+from ..db.default_models import ProcessorRun
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+conf = util.dimport("corral.conf", lazy=True)
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+# upper bounds (in seconds) of the process() latency histogram
+LATENCY_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1., 5., 10.,
+    float("inf"))
+
+
+# =============================================================================
+# CLASSES
+# =============================================================================
+
+class RunMetrics(object):
+    """Accumulate the timings (in seconds) and counters of the execution
+    of a processor in a runner.
+
+    """
+
+    def __init__(self, processor_cls, proc_number=0, proc_n=1):
+        self.processor_cls = processor_cls
+        self.proc_number = proc_number
+        self.proc_n = proc_n
+        self.started_at = datetime.datetime.utcnow()
+        self.wall_time = None
+        self.generate_time = 0.
+        self.process_time = 0.
+        self.commit_time = 0.
+        self.db_time = 0.
+        self.deliver_time = 0.
+        self.generated = 0
+        self.saved = 0
+        self.commits = 0
+        self.process_latency = [0] * len(LATENCY_BUCKETS)
+        self.peak_rss = None
+        self.exitcode = None
+        self._start = time.time()
+        self._commit_start = None
+        self._cursor_start = None
+        self._engine = None
+
+    @contextlib.contextmanager
+    def timing(self, name):
+        """Add the time spent in the block to the ``<name>_time``
+        attribute.
+
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            setattr(self, name + "_time", getattr(self, name + "_time") +
+                    elapsed)
+            if name == "process":
+                self.observe_latency(elapsed)
+
+    def observe_latency(self, elapsed):
+        """Count ``elapsed`` in the first bucket of the process() latency
+        histogram that can contain it.
+
+        """
+        for idx, upper in enumerate(LATENCY_BUCKETS):
+            if elapsed <= upper:
+                self.process_latency[idx] += 1
+                break
+
+    def iterate(self, iterable):
+        """Iterate over the generated objects, counting them and adding the
+        time spent fetching them to ``generate_time``.
+
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                obj = next(iterator)
+            except StopIteration:
+                self.generate_time += time.time() - start
+                return
+            self.generate_time += time.time() - start
+            self.generated += 1
+            yield obj
+
+    def add_saved(self, number=1):
+        self.saved += number
+
+    def _before_commit(self, session):
+        self._commit_start = time.time()
+
+    def _after_commit(self, session):
+        if self._commit_start is not None:
+            self.commit_time += time.time() - self._commit_start
+            self.commits += 1
+            self._commit_start = None
+
+    def _before_cursor_execute(self, *args):
+        self._cursor_start = time.time()
+
+    def _after_cursor_execute(self, *args):
+        if self._cursor_start is not None:
+            self.db_time += time.time() - self._cursor_start
+            self._cursor_start = None
+
+    def watch(self, session):
+        """Measure the time spent in the commits (flush included) of the
+        session, and executing statements in the database.
+
+        """
+        event.listen(session, "before_commit", self._before_commit)
+        event.listen(session, "after_commit", self._after_commit)
+        self._engine = session.get_bind()
+        event.listen(
+            self._engine, "before_cursor_execute",
+            self._before_cursor_execute)
+        event.listen(
+            self._engine, "after_cursor_execute",
+            self._after_cursor_execute)
+
+    def unwatch(self):
+        if self._engine is not None:
+            event.remove(
+                self._engine, "before_cursor_execute",
+                self._before_cursor_execute)
+            event.remove(
+                self._engine, "after_cursor_execute",
+                self._after_cursor_execute)
+            self._engine = None
+
+    def finish(self, exitcode):
+        self.unwatch()
+        self.wall_time = time.time() - self._start
+        self.peak_rss = peak_rss()
+        self.exitcode = exitcode
+
+    def to_dict(self):
+        return {
+            "processor_path": ".".join([
+                self.processor_cls.__module__, self.processor_cls.__name__]),
+            "processor_type": processor_type(self.processor_cls),
+            "proc_number": self.proc_number,
+            "proc_n": self.proc_n,
+            "started_at": self.started_at,
+            "wall_time": self.wall_time,
+            "generate_time": self.generate_time,
+            "process_time": self.process_time,
+            "commit_time": self.commit_time,
+            "db_time": self.db_time,
+            "deliver_time": self.deliver_time,
+            "generated": self.generated,
+            "saved": self.saved,
+            "commits": self.commits,
+            "peak_rss": self.peak_rss,
+            "exitcode": self.exitcode}
+
+    def snapshot(self):
+        """``to_dict()`` plus the process() latency histogram (a list with
+        the count of every bucket of ``LATENCY_BUCKETS``).
+
+        """
+        snapshot = self.to_dict()
+        snapshot["process_latency"] = list(self.process_latency)
+        return snapshot
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def peak_rss():
+    """Maximum resident set size of the current process since it started
+    in KiB (None if is not available in this platform).
+
+    """
+    if resource is None:  # pragma: no cover
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def processor_type(processor_cls):
+    from .loader import Loader
+    from .step import Step
+    from .alert import Alert
+    for ptype, base in (("loader", Loader), ("step", Step),
+                        ("alert", Alert)):
+        if issubclass(processor_cls, base):
+            return ptype
+
+
+def record_run(metrics):
+    """Store the metrics in the ``__corral_runs__`` table (if the
+    ``RECORD_RUNS`` setting is not False). A failure to store them is only
+    logged.
+
+    """
+    if not conf.settings.get("RECORD_RUNS", True):
+        return
+    try:
+        with db.session_scope() as session:
+            session.add(ProcessorRun(**metrics.to_dict()))
+    except Exception as err:
+        logger.warning("Can't record the run metrics: {}".format(err))
+
+
+def percentile(values, q):
+    """Nearest-rank ``q`` percentile (0 < q <= 100) of the values."""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = int(math.ceil(q / 100. * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def summarize(runs):
+    """Aggregate a list of ``ProcessorRun`` of the same processor."""
+    walls = [r.wall_time for r in runs if r.wall_time is not None]
+    total_wall = sum(walls)
+    generated = sum(r.generated or 0 for r in runs)
+    return {
+        "runs": len(runs),
+        "failures": sum(1 for r in runs if r.exitcode),
+        "last_run": max(r.started_at for r in runs),
+        "generated": generated,
+        "saved": sum(r.saved or 0 for r in runs),
+        "throughput": generated / total_wall if total_wall else None,
+        "p50": percentile(walls, 50),
+        "p95": percentile(walls, 95),
+        "p99": percentile(walls, 99),
+        "generate_time": sum(r.generate_time or 0 for r in runs),
+        "process_time": sum(r.process_time or 0 for r in runs),
+        "commit_time": sum(r.commit_time or 0 for r in runs),
+        "peak_rss": max([r.peak_rss for r in runs if r.peak_rss] or [None])}
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# =============================================================================
+# DOC
+# =============================================================================
+
+"""Pool of long-lived worker processes to execute the processors"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import signal
+import multiprocessing
+
+from .. import db, core
+from ..core import logger
+
+
+# =============================================================================
+# WORKER FUNCTIONS
+# =============================================================================
+
+def setup_worker(test_mode=False):
+    # only the parent process handles a Ctrl-C: it must not kill the
+    # workers in the middle of a task (their results would never be ready),
+    # but the workers stay in the group of the parent so they still die
+    # with it (SIGHUP) and ProcessorPool.terminate() can stop them
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    # if the worker was not forked (spawn or forkserver start methods) the
+    # environment must be configured again
+    if db.engine is None:
+        core.setup_environment(test_mode=test_mode)
+
+
+def run_processor(processor_cls, proc_number=0, proc_n=1):
+    """Execute a processor inside the current process and return a tuple
+    with the exit code, the number of processed objects and the metrics of
+    the run.
+
+    """
+    runner = processor_cls.runner_class()
+    runner.setup(processor_cls, proc_number, proc_n)
+    try:
+        runner.run()
+    except Exception:
+        logger.exception("Error executing '{}' #{}".format(
+            processor_cls.__name__, proc_number + 1))
+        return 1, runner.processed, runner.collect_metrics()
+    return 0, runner.processed, runner.collect_metrics()
+
+
+# =============================================================================
+# CLASSES
+# =============================================================================
+
+class PoolTask(object):
+    """A processor execution submitted to a ProcessorPool, with the same
+    interface of a started runner (``exitcode``, ``processed``,
+    ``collect_metrics()`` and ``join()``).
+
+    """
+
+    def __init__(self, target, result):
+        self.target = target
+        self._result = result
+
+    def __repr__(self):
+        return "<PoolTask '{}'>".format(self.target.__name__)
+
+    def _get(self):
+        try:
+            return self._result.get()
+        except Exception:
+            return 1, 0, None
+
+    @property
+    def exitcode(self):
+        if not self._result.ready():
+            return None
+        return self._get()[0]
+
+    @property
+    def processed(self):
+        if not self._result.ready():
+            return 0
+        return self._get()[1]
+
+    def collect_metrics(self):
+        if not self._result.ready():
+            return None
+        return self._get()[2]
+
+    def join(self, timeout=None):
+        self._result.wait(timeout)
+
+
+class ProcessorPool(object):
+    """Pool of worker processes that are reused between executions of the
+    processors, so the pipeline modules are imported and the database
+    connections are opened only once by every worker.
+
+    """
+
+    def __init__(self, processes=None, maxtasksperchild=None):
+        self._pool = multiprocessing.Pool(
+            processes, initializer=setup_worker, initargs=(core.in_test(),),
+            maxtasksperchild=maxtasksperchild)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def submit(self, processor_cls, proc_number=0, proc_n=1):
+        result = self._pool.apply_async(
+            run_processor, (processor_cls, proc_number, proc_n))
+        return PoolTask(processor_cls, result)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Profiling of the runners (used by the ``profile`` command)"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import os
+import sys
+import glob
+import signal
+import pstats
+import cProfile
+import threading
+import contextlib
+import collections
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+#: directory where every runner writes its cProfile output
+PROFILE_DIR_ENV = "CORRAL_PROFILE_DIR"
+
+#: seconds between the samples of the sampling profiler (disabled if empty)
+SAMPLE_INTERVAL_ENV = "CORRAL_PROFILE_SAMPLE_INTERVAL"
+
+PROFILE_EXT = ".prof"
+
+SAMPLES_EXT = ".folded"
+
+
+# =============================================================================
+# SAMPLER
+# =============================================================================
+
+class Sampler(object):
+    """A statistical profiler that records the stack of the main thread
+    every ``interval`` seconds of CPU time (with ``SIGPROF``). The samples
+    are stored as "collapsed stacks" (the input of the flamegraph tools).
+
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._old_handler = None
+
+    @staticmethod
+    def is_available():
+        return (
+            hasattr(signal, "setitimer") and
+            threading.current_thread().name == "MainThread")
+
+    def _frame_name(self, frame):
+        code = frame.f_code
+        return "{}:{}:{}".format(
+            os.path.basename(code.co_filename), code.co_firstlineno,
+            code.co_name)
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(self._frame_name(frame))
+            frame = frame.f_back
+        self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._old_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._old_handler or signal.SIG_DFL)
+
+    def dump(self, path):
+        with open(path, "w") as fp:
+            for stack, count in self.samples.most_common():
+                fp.write("{} {}\n".format(stack, count))
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def profile_dir():
+    """The directory where the runners must write their profiles (or None
+    if the profiling is disabled).
+
+    """
+    return os.environ.get(PROFILE_DIR_ENV) or None
+
+
+def sample_interval():
+    value = os.environ.get(SAMPLE_INTERVAL_ENV)
+    return float(value) if value else None
+
+
+@contextlib.contextmanager
+def profile_run(runner):
+    """Profile the block with cProfile (and the sampler if
+    ``CORRAL_PROFILE_SAMPLE_INTERVAL`` is defined) if the
+    ``CORRAL_PROFILE_DIR`` environment variable is defined, and write the
+    outputs in that directory with a name unique by runner.
+
+    """
+    directory = profile_dir()
+    if directory is None:
+        yield
+        return
+
+    target = runner.target
+    basename = os.path.join(directory, "{}.{}-{}-{}".format(
+        target.__module__, target.__name__, runner.proc_number, os.getpid()))
+
+    interval = sample_interval()
+    sampler = (
+        Sampler(interval) if interval and Sampler.is_available() else None)
+
+    profiler = cProfile.Profile()
+    if sampler:
+        sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if sampler:
+            sampler.stop()
+            sampler.dump(basename + SAMPLES_EXT)
+        profiler.dump_stats(basename + PROFILE_EXT)
+
+
+def merge_profiles(directory, out):
+    """Merge all the cProfile outputs of the directory in one pstats file
+    and return the number of merged files.
+
+    """
+    paths = sorted(glob.glob(os.path.join(directory, "*" + PROFILE_EXT)))
+    if not paths:
+        return 0
+    stats = pstats.Stats(paths[0], stream=sys.stderr)
+    for path in paths[1:]:
+        stats.add(path)
+    stats.dump_stats(out)
+    return len(paths)
+
+
+def merge_samples(directory, out):
+    """Merge all the sampling profiler outputs of the directory in one
+    collapsed stacks file and return the number of merged files.
+
+    """
+    paths = sorted(glob.glob(os.path.join(directory, "*" + SAMPLES_EXT)))
+    if not paths:
+        return 0
+    samples = collections.Counter()
+    for path in paths:
+        with open(path) as fp:
+            for line in fp:
+                stack, count = line.rstrip("\n").rsplit(" ", 1)
+                samples[stack] += int(count)
+    with open(out, "w") as fp:
+        for stack, count in samples.most_common():
+            fp.write("{} {}\n".format(stack, count))
+    return len(paths)
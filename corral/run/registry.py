@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Indexes of the Steps and Alerts classes configured in the settings"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import inspect
+import collections
+
+from .. import util, exceptions
+from ..core import logger
+
+conf = util.dimport("corral.conf", lazy=True)
+
+
+# =============================================================================
+# CLASSES
+# =============================================================================
+
+class ProcessorRegistry(object):
+    """Import the processors listed in a setting only once by process and
+    index them by python path, class name and group.
+
+    The indexes are rebuilt only if the setting changes.
+
+    """
+
+    def __init__(self, setting, base_cls):
+        self.setting = setting
+        self.base_cls = base_cls
+        self.clear()
+
+    def clear(self):
+        self._import_strings = None
+        self._processors = ()
+        self._by_path = {}
+        self._paths = {}
+        self._by_name = {}
+        self._by_group = {}
+
+    def _build(self, import_strings):
+        logger.debug("Loading {} Classes".format(self.base_cls.__name__))
+        base_name = self.base_cls.__name__
+        by_path, paths, by_name = {}, {}, {}
+        by_group = collections.defaultdict(list)
+        for import_string in import_strings:
+            cls = util.dimport(import_string)
+            if not (inspect.isclass(cls) and issubclass(cls, self.base_cls)):
+                msg = "{} '{}' must be subclass of 'corral.run.{}'"
+                raise exceptions.ImproperlyConfigured(msg.format(
+                    base_name.upper(), import_string, base_name))
+            by_path[import_string] = cls
+            paths.setdefault(cls, import_string)
+            by_name.setdefault(cls.__name__, cls)
+        processors = tuple(sorted(paths, key=lambda cls: cls.__name__))
+        for cls in processors:
+            for group in cls.get_groups():
+                by_group[group].append(cls)
+
+        self._processors = processors
+        self._by_path, self._paths, self._by_name = by_path, paths, by_name
+        self._by_group = {k: tuple(v) for k, v in by_group.items()}
+        self._import_strings = import_strings
+
+    def _check(self):
+        import_strings = tuple(getattr(conf.settings, self.setting))
+        if import_strings != self._import_strings:
+            self._build(import_strings)
+
+    def processors(self, groups=None):
+        """All the processors sorted by name, or only the processors of
+        the given groups.
+
+        """
+        self._check()
+        if groups is None:
+            return self._processors
+        selected = set()
+        for group in groups:
+            selected.update(self._by_group.get(group, ()))
+        return tuple(cls for cls in self._processors if cls in selected)
+
+    def groups(self):
+        self._check()
+        return tuple(sorted(self._by_group))
+
+    def by_name(self, name):
+        """The processor with the given class name (or None)."""
+        self._check()
+        return self._by_name.get(name)
+
+    def by_path(self, import_string):
+        self._check()
+        return self._by_path.get(import_string)
+
+    def python_path(self, cls):
+        """The import string of the processor in the settings (or None)."""
+        self._check()
+        return self._paths.get(cls)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# =============================================================================
+# DOC
+# =============================================================================
+
+"""Execution of the processors respecting their declared dependencies"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import time
+import collections
+
+from .. import exceptions
+from ..core import logger
+
+from . import exposition
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+POLL_INTERVAL = 0.1
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def processors_dag(processors):
+    """Create a dict where every key is a processor class and the value is
+    the set of processors that must finish before the key can start.
+
+    A processor ``A`` depends on ``B`` if ``B`` is listed (as class, class
+    name or python path) in ``A.depends_on``, or if ``B.produces`` anything
+    that ``A.consumes``.
+
+    """
+    processors = tuple(processors)
+
+    by_name = {}
+    for proc_cls in processors:
+        by_name[proc_cls] = proc_cls
+        by_name[proc_cls.__name__] = proc_cls
+        by_name[proc_cls.retrieve_python_path()] = proc_cls
+
+    dag = collections.OrderedDict()
+    for proc_cls in processors:
+        upstream = set()
+        for dep in proc_cls.get_depends_on():
+            if dep in by_name:
+                upstream.add(by_name[dep])
+            else:
+                logger.warning(
+                    "'{}' depends on '{}' which is not scheduled".format(
+                        proc_cls.__name__, dep))
+        consumes = set(proc_cls.get_consumes())
+        if consumes:
+            for other in processors:
+                if consumes.intersection(other.get_produces()):
+                    upstream.add(other)
+        upstream.discard(proc_cls)
+        dag[proc_cls] = upstream
+
+    # Kahn's algorithm only to detect cycles
+    pending = {k: set(v) for k, v in dag.items()}
+    ready = [k for k, v in pending.items() if not v]
+    while ready:
+        node = ready.pop()
+        pending.pop(node)
+        for other, upstream in pending.items():
+            if node in upstream:
+                upstream.remove(node)
+                if not upstream:
+                    ready.append(other)
+    if pending:
+        names = ", ".join(sorted(k.__name__ for k in pending))
+        msg = "Cyclic dependencies between the processors: {}".format(names)
+        raise exceptions.ImproperlyConfigured(msg)
+
+    return dag
+
+
+def schedule(processors, execute, max_workers=None,
+             poll_interval=POLL_INTERVAL):
+    """Execute the processors as soon as all their upstream processors
+    finish, with at most ``max_workers`` processors running concurrently.
+
+    ``execute`` must be a function that receives a processor class, starts
+    it, and returns the started processes. If a processor fails all the
+    processors that depends on it are skipped.
+
+    Return a list with the exit codes of all the executed processes.
+
+    """
+    dag = processors_dag(processors)
+
+    pending = list(dag.keys())
+    running = collections.OrderedDict()
+    done, failed = set(), set()
+    exitcodes = []
+
+    while pending or running:
+        for proc_cls in list(pending):
+            if max_workers and len(running) >= max_workers:
+                break
+            upstream = dag[proc_cls]
+            if upstream.intersection(failed):
+                logger.error("Skipping '{}' because '{}' failed".format(
+                    proc_cls.__name__, ", ".join(
+                        sorted(u.__name__ for u in upstream & failed))))
+                pending.remove(proc_cls)
+                failed.add(proc_cls)
+            elif upstream.issubset(done):
+                pending.remove(proc_cls)
+                running[proc_cls] = tuple(execute(proc_cls) or ())
+
+        finished = [
+            proc_cls for proc_cls, procs in running.items()
+            if all(proc.exitcode is not None for proc in procs)]
+        for proc_cls in finished:
+            procs = running.pop(proc_cls)
+            codes = []
+            for proc in procs:
+                proc.join()
+                codes.append(proc.exitcode)
+            exposition.observe(procs)
+            exitcodes.extend(codes)
+            if any(codes):
+                failed.add(proc_cls)
+            else:
+                done.add(proc_cls)
+
+        if running and not finished:
+            time.sleep(poll_interval)
+
+    return exitcodes
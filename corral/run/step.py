@@ -34,42 +34,295 @@
 # IMPORTS
 # =============================================================================
 
-import abc
+import time
+import types
 import inspect
+import datetime
+import itertools
+import collections
+import multiprocessing
+
+import six
 
 from .. import db, util, exceptions
 from ..core import logger
+from ..db.default_models import Watermark
 
+from .registry import ProcessorRegistry
 from .base import Processor, Runner
 
+try:
+    from concurrent import futures
+except ImportError:  # pragma: no cover
+    futures = None
+
 conf = util.dimport("corral.conf", lazy=True)
 
 
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+EXECUTORS = (None, "threads")
+
+#: page size used by the checkpointed runs when the step only defines a
+#: ``commit_interval_seconds`` (and no ``commit_every`` or ``chunk_size``)
+CHECKPOINT_PAGE_SIZE = 1000
+
+
+# =============================================================================
+# WATERMARK
+# =============================================================================
+
+class WatermarkTracker(object):
+    """Follow the objects generated by a step (sorted by the ``watermark``
+    column) to know the greatest value of the column such that all the
+    objects up to it are saved, even if they are processed out of order.
+
+    """
+
+    def __init__(self, watermark):
+        self.key = watermark.key
+        self.pending = collections.deque()
+        self.entries = {}
+        self.value = None
+
+    def track(self, generator):
+        for obj in generator:
+            # the object is referenced until it is saved so its id is unique
+            entry = [obj, getattr(obj, self.key, None), False]
+            self.pending.append(entry)
+            self.entries[id(obj)] = entry
+            yield obj
+
+    def saved(self, obj):
+        entry = self.entries.pop(id(obj), None)
+        if entry is not None:
+            entry[2] = True
+
+    def advance(self):
+        """Return the new value of the watermark, or None if it has not
+        moved since the last call.
+
+        """
+        moved = False
+        while self.pending and self.pending[0][2]:
+            self.value = self.pending.popleft()[1]
+            moved = True
+        return self.value if moved else None
+
+
 # =============================================================================
 # STEP CLASSES
 # =============================================================================
 
 class StepRunner(Runner):
 
+    tracker = None
+    saved_objs = None
+
     def validate_target(self, step_cls):
         if not (inspect.isclass(step_cls) and issubclass(step_cls, Step)):
             msg = "step_cls '{}' must be subclass of 'corral.run.Step'"
             raise TypeError(msg.format(step_cls))
 
+    def process_obj(self, step, obj):
+        step.validate(obj)
+        self.save_processed(step, obj, step.process(obj))
+
+    def save_processed(self, step, obj, generator):
+        """Validate and save the object and all the new objects returned
+        by ``step.process(obj)``.
+
+        """
+        generator = generator or []
+        if not hasattr(generator, "__iter__"):
+            generator = (generator,)
+        proc_objs = []
+        for proc_obj in generator:
+            step.validate(proc_obj)
+            step.save(proc_obj)
+            proc_objs.append(proc_obj)
+            if proc_obj is not obj:
+                self.metrics.add_saved()
+        step.save(obj)
+        self.metrics.add_saved()
+        self.add_saved_objs(proc_objs + [obj])
+        if self.tracker is not None:
+            self.tracker.saved(obj)
+
+    def add_saved_objs(self, objs):
+        """Remember the saved objects to release them from the session in
+        the next commit of a checkpointed run.
+
+        """
+        if self.saved_objs is not None:
+            self.saved_objs.extend(objs)
+
+    def expunge_saved(self, session):
+        """Remove from the session only the objects already saved; the
+        generated objects waiting to be processed (the rest of the page
+        or the lookahead of the executors) keep attached to the session.
+
+        """
+        for obj in self.saved_objs:
+            if obj in session:
+                session.expunge(obj)
+        del self.saved_objs[:]
+
+    def save_done(self, step, pending, wait):
+        """Wait with ``wait(futures)`` until some of the ``pending`` futures
+        (a dict ``{future: (obj, submit_time)}``) are done, and save their
+        objects. Return how many objects are saved.
+
+        """
+        start = time.time()
+        done = wait(list(pending))
+        for future in done:
+            obj, submited = pending.pop(future)
+            self.save_processed(step, obj, future.result())
+            self.metrics.observe_latency(time.time() - submited)
+        self.metrics.process_time += time.time() - start
+        self.add_processed(len(done))
+        return len(done)
+
+    def process_objs(self, step, objs):
+        for obj in objs:
+            step.validate(obj)
+        generator = step.process_batch(objs) or []
+        if not hasattr(generator, "__iter__"):
+            generator = (generator,)
+        proc_objs, seen = [], set(map(id, objs))
+        for proc_obj in generator:
+            step.validate(proc_obj)
+            # the objects of the batch returned again are saved only once
+            if id(proc_obj) not in seen:
+                seen.add(id(proc_obj))
+                proc_objs.append(proc_obj)
+        step.save_all(proc_objs + objs)
+        self.metrics.add_saved(len(proc_objs) + len(objs))
+        self.add_saved_objs(proc_objs + objs)
+        if self.tracker is not None:
+            for obj in objs:
+                self.tracker.saved(obj)
+
+    def iter_threads(self, step, generator):
+        """Call ``step.process(obj)`` in a pool of ``max_workers`` threads
+        (with at most two pending objects by thread), and yield how many
+        objects are saved when some of them are done. The objects are
+        generated, validated and saved only in the runner thread.
+
+        """
+        max_workers = step.get_max_workers() or multiprocessing.cpu_count()
+
+        def wait(pending):
+            return futures.wait(
+                pending, return_when=futures.FIRST_COMPLETED).done
+
+        pending = {}
+        executor = futures.ThreadPoolExecutor(max_workers)
+        try:
+            for obj in generator:
+                step.validate(obj)
+                future = executor.submit(call_process, step, obj)
+                pending[future] = (obj, time.time())
+                if len(pending) >= max_workers * 2:
+                    yield self.save_done(step, pending, wait)
+            while pending:
+                yield self.save_done(step, pending, wait)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def iter_process(self, step, generator):
+        """Process all the objects of the generator and yield how many
+        objects are processed in every iteration.
+
+        """
+        batch_size = step.get_batch_size()
+        generator = self.metrics.iterate(generator)
+        if step.get_executor() == "threads":
+            for processed in self.iter_threads(step, generator):
+                yield processed
+        elif batch_size:
+            for objs in util.chunks(generator, batch_size):
+                with self.metrics.timing("process"):
+                    self.process_objs(step, objs)
+                self.add_processed(len(objs))
+                yield len(objs)
+        else:
+            for obj in generator:
+                with self.metrics.timing("process"):
+                    self.process_obj(step, obj)
+                self.add_processed()
+                yield 1
+
+    def track_watermark(self, step, generator):
+        """Follow the generated objects if the step has a ``watermark``."""
+        watermark = step.get_watermark()
+        if watermark is None:
+            self.tracker = None
+            return generator
+        self.tracker = WatermarkTracker(watermark)
+        return self.tracker.track(generator)
+
+    def store_watermark(self, step):
+        """Store (without commit) the value of the watermark column of the
+        last object such that all the previous objects are saved.
+
+        """
+        value = None if self.tracker is None else self.tracker.advance()
+        if value is not None:
+            step.save_watermark(value)
+
+    def run_checkpointed(self, session, step, query):
+        commit_every = step.get_commit_every()
+        interval = step.get_commit_interval_seconds()
+        page_size = (
+            commit_every or step.get_chunk_size() or CHECKPOINT_PAGE_SIZE)
+        generator = step.paginate(query, page_size)
+        generator = self.read_replica(session, query, generator)
+        generator = self.track_watermark(step, generator)
+
+        # the objects already processed never are refreshed after a commit
+        session.expire_on_commit = False
+        self.saved_objs = []
+
+        uncommitted, last_commit = 0, time.time()
+        for processed in self.iter_process(step, generator):
+            uncommitted += processed
+            if (commit_every and uncommitted >= commit_every) or (
+                interval and time.time() - last_commit >= interval
+            ):
+                self.store_watermark(step)
+                session.commit()
+                self.expunge_saved(session)
+                logger.debug("Step '{}' #{}: {} objects committed".format(
+                    type(step), self.proc_number + 1, uncommitted))
+                uncommitted, last_commit = 0, time.time()
+
     def run(self):
         step_cls = self.target
-        logger.info("Executing step '{}'".format(step_cls))
-        with db.session_scope() as session, step_cls(session) as step:
-            for obj in step.generate():
-                step.validate(obj)
-                generator = step.process(obj) or []
-                if not hasattr(generator, "__iter__"):
-                    generator = (generator,)
-                for proc_obj in generator:
-                    step.validate(proc_obj)
-                    step.save(proc_obj)
-                step.save(obj)
-        logger.info("Done Step '{}'".format(step_cls))
+        proc_number, proc_n = self.proc_number, self.proc_n
+        logger.info("Executing step '{}' #{}".format(
+            step_cls, proc_number + 1))
+        with self.measure() as metrics, db.session_scope() as session, \
+                step_cls(session, proc_number, proc_n) as step:
+            metrics.watch(session)
+            with metrics.timing("generate"):
+                query = step.filter_by_watermark(step.filter_by_proc(
+                    step.generate(), proc_number, proc_n))
+            if step.get_commit_every() or step.get_commit_interval_seconds():
+                self.run_checkpointed(session, step, query)
+            else:
+                generator = self.track_watermark(step, self.read_replica(
+                    session, query, step.stream(query)))
+                # consume the iterator without keep anything
+                collections.deque(
+                    self.iter_process(step, generator), maxlen=0)
+            self.store_watermark(step)
+        logger.info("Done Step '{}' #{}".format(step_cls, proc_number + 1))
 
 
 class Step(Processor):
@@ -81,11 +334,100 @@ class Step(Processor):
 
     ordering = None
 
+    commit_every = None
+    commit_interval_seconds = None
+
+    batch_size = None
+
+    executor = None
+    max_workers = None
+
+    watermark = None
+
+    @classmethod
+    def get_commit_every(cls):
+        return cls.get_positive_or_none("commit_every")
+
+    @classmethod
+    def get_commit_interval_seconds(cls):
+        return cls.get_positive_or_none(
+            "commit_interval_seconds", (float,) + six.integer_types)
+
+    @classmethod
+    def get_batch_size(cls):
+        return cls.get_positive_or_none("batch_size")
+
+    @classmethod
+    def get_executor(cls):
+        clsname = cls.__name__
+        if cls.executor not in EXECUTORS:
+            msg = "'{}.executor' must be None or 'threads'. Found '{}'"
+            raise exceptions.ImproperlyConfigured(
+                msg.format(clsname, cls.executor))
+        if cls.executor and cls.get_batch_size():
+            msg = "'{}' can't define both 'executor' and 'batch_size'"
+            raise exceptions.ImproperlyConfigured(msg.format(clsname))
+        if cls.executor == "threads" and futures is None:  # pragma: no cover
+            msg = "'{}' requires the 'futures' package to use threads"
+            raise exceptions.ImproperlyConfigured(msg.format(clsname))
+        return cls.executor
+
+    @classmethod
+    def get_max_workers(cls):
+        return cls.get_positive_or_none("max_workers")
+
+    @classmethod
+    def get_watermark(cls):
+        watermark = cls.watermark
+        if watermark is None:
+            return None
+        clsname = cls.__name__
+        if not isinstance(watermark, db.orm.attributes.QueryableAttribute):
+            msg = "'{}.watermark' must be None or a model column. Found '{}'"
+            raise exceptions.ImproperlyConfigured(
+                msg.format(clsname, watermark))
+        pks = db.inspect(watermark.class_).primary_key
+        columns = getattr(watermark.property, "columns", ())
+        if not any(cls.is_unique_column(c, pks) for c in columns):
+            # with repeated values the rows that share the stored value
+            # and weren't processed yet are skipped by the next run
+            msg = (
+                "'{}.watermark' must be the primary key or an unique "
+                "column of the model")
+            raise exceptions.ImproperlyConfigured(msg.format(clsname))
+        if cls.get_commit_every() or cls.get_commit_interval_seconds():
+            # the checkpointed runs read the rows in primary key order
+            if len(pks) != 1 or not any(c is pks[0] for c in columns):
+                msg = (
+                    "'{}.watermark' must be the primary key of the model to "
+                    "use 'commit_every' or 'commit_interval_seconds'")
+                raise exceptions.ImproperlyConfigured(msg.format(clsname))
+        return watermark
+
+    @staticmethod
+    def is_unique_column(column, pks):
+        """True if no two rows can share a value of the ``column``."""
+        if len(pks) == 1 and column is pks[0]:
+            return True
+        if getattr(column, "unique", False):
+            return True
+        table = getattr(column, "table", None)
+        constraints = itertools.chain(
+            (c for c in getattr(table, "constraints", ())
+             if isinstance(c, db.UniqueConstraint)),
+            (i for i in getattr(table, "indexes", ()) if i.unique))
+        return any(list(c.columns) == [column] for c in constraints)
+
+    @classmethod
+    def get_chunk_size(cls):
+        chunk_size = super(Step, cls).get_chunk_size()
+        if chunk_size is None:
+            chunk_size = cls.get_positive_setting_or_none("STEP_CHUNK_SIZE")
+        return chunk_size
+
     @classmethod
     def retrieve_python_path(cls):
-        for import_string in conf.settings.STEPS:
-            if cls == util.dimport(import_string):
-                return import_string
+        return registry.python_path(cls)
 
     def generate(self):
         if self.model is None or self.conditions is None:
@@ -98,50 +440,113 @@ class Step(Processor):
             query = query.order_by(*self.ordering)
         return query
 
-    @abc.abstractmethod
+    def load_watermark(self):
+        """The ``Watermark`` of the step in this process (or None)."""
+        return self.session.query(Watermark).filter_by(
+            processor_path=self.retrieve_python_path(),
+            proc_number=self.proc_number, proc_n=self.proc_n).first()
+
+    def save_watermark(self, value):
+        mark = self.load_watermark() or Watermark(
+            processor_path=self.retrieve_python_path(),
+            proc_number=self.proc_number, proc_n=self.proc_n)
+        mark.column = str(self.get_watermark())
+        mark.value = value
+        mark.updated_at = datetime.datetime.utcnow()
+        self.session.add(mark)
+
+    def filter_by_watermark(self, query):
+        """If the step has a ``watermark`` column, restrict the query to
+        the rows beyond the last stored value and sort them by the column
+        (and then by the ``ordering``).
+
+        """
+        watermark = self.get_watermark()
+        if watermark is None:
+            return query
+        if not isinstance(query, db.Query):
+            clsname = type(self).__name__
+            raise exceptions.ImproperlyConfigured(
+                "'{}' generate don't return a query; it can't define a "
+                "'watermark'".format(clsname))
+        mark = self.load_watermark()
+        if mark is not None and mark.column == str(watermark):
+            query = query.filter(watermark > mark.value)
+        return query.order_by(None).order_by(
+            watermark, *(self.ordering or ()))
+
     def process(self, obj):
-        raise NotImplementedError()  # pragma: no cover
+        clsname = type(self).__name__
+        raise NotImplementedError(
+            "'{}' subclass must redefine 'process' or 'process_batch' "
+            "methods".format(clsname))
+
+    def process_batch(self, objs):
+        """Process a list of ``batch_size`` objects at once. By default
+        call ``process`` with every object and return all the new objects
+        to save.
+
+        """
+        proc_objs = []
+        for obj in objs:
+            generator = self.process(obj) or []
+            if not hasattr(generator, "__iter__"):
+                generator = (generator,)
+            proc_objs.extend(generator)
+        return proc_objs
+
+
+registry = ProcessorRegistry("STEPS", Step)
 
 
 # =============================================================================
 # FUNCTIONS
 # =============================================================================
 
+def call_process(step, obj):
+    """Call ``step.process(obj)`` consuming the returned generator (if
+    any), so all the work is done in the calling thread.
+
+    """
+    generator = step.process(obj)
+    if isinstance(generator, types.GeneratorType):
+        generator = list(generator)
+    return generator
+
+
 def steps_groups():
-    groups = set()
-    for cls in load_steps():
-        groups.update(cls.get_groups())
-    return tuple(sorted(groups))
+    return registry.groups()
 
 
 def load_steps(groups=None):
-    steps = []
-    logger.debug("Loading Steps Classes")
-    for import_string in conf.settings.STEPS:
-        cls = util.dimport(import_string)
-        if not (inspect.isclass(cls) and issubclass(cls, Step)):
-            msg = "STEP '{}' must be subclass of 'corral.run.Step'"
-            raise exceptions.ImproperlyConfigured(msg.format(import_string))
-        if groups is None or set(cls.get_groups()).intersection(groups):
-            steps.append(cls)
-    steps.sort(key=lambda cls: cls.__name__)
-    return tuple(steps)
-
-
-def execute_step(step_cls, sync=False):
+    return registry.processors(groups)
+
+
+def execute_step(step_cls, sync=False, procno=None, pool=None):
     if not (inspect.isclass(step_cls) and issubclass(step_cls, Step)):
         msg = "step_cls '{}' must be subclass of 'corral.run.Step'"
         raise TypeError(msg.format(step_cls))
 
+    procno = step_cls.get_procno() if procno is None else procno
+    if not isinstance(procno, six.integer_types) or procno < 1:
+        msg = "procno must be an integer greater than 0. Found '{}'"
+        raise ValueError(msg.format(procno))
+
+    # a synchronous execution runs the whole query in only one runner
+    proc_n = 1 if sync else procno
+
     procs = []
     step_cls.class_setup()
-    runner = step_cls.runner_class()
-    runner.setup(step_cls)
-    if sync:
-        runner.run()
-    else:
-        db.engine.dispose()
-        runner.start()
-    procs.append(runner)
+    for proc_number in six.moves.range(proc_n):
+        if pool is not None and not sync:
+            procs.append(pool.submit(step_cls, proc_number, proc_n))
+            continue
+        runner = step_cls.runner_class()
+        runner.setup(step_cls, proc_number, proc_n)
+        if sync:
+            runner.run()
+        else:
+            runner.start()
+        procs.append(runner)
     step_cls.class_teardown()
     return tuple(procs)
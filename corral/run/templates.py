@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Templates compiled once to render the alerts"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import abc
+import string
+
+import six
+
+from .. import exceptions
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+FORMATTER = string.Formatter()
+
+
+# =============================================================================
+# TEMPLATES
+# =============================================================================
+
+@six.add_metaclass(abc.ABCMeta)
+class Template(object):
+    """Base class of the alert templates. ``render(obj, **context)`` make
+    the object available as the first positional argument and as ``obj``.
+
+    """
+
+    def __init__(self, source, **constants):
+        self.source = source
+        self.constants = constants
+
+    def __repr__(self):
+        return "<{} {!r}>".format(type(self).__name__, self.source)
+
+    @abc.abstractmethod
+    def render(self, obj, **context):
+        raise NotImplementedError()  # pragma: no cover
+
+    def check(self, context=()):
+        """Validate that the template only reads the object and the
+        ``context`` variables given in every render. By default do nothing.
+
+        """
+        pass
+
+
+class FormatTemplate(Template):
+    """A ``str.format`` template. The values of the ``constants`` are
+    formatted only once (when the template is created) and ``fields``
+    contains the names of the variables that every render reads (used by
+    ``check`` to find the unknown ones before any render).
+
+    """
+
+    def __init__(self, source, **constants):
+        super(FormatTemplate, self).__init__(source, **constants)
+        self.compiled, self.fields = self._compile(source, constants)
+
+    def _compile(self, source, constants):
+        chunks, fields = [], set()
+        auto_idx = 0
+        for literal, field, spec, conversion in FORMATTER.parse(source):
+            chunks.append(literal.replace("{", "{{").replace("}", "}}"))
+            if field is None:
+                continue
+            if field == "":
+                field, auto_idx = str(auto_idx), auto_idx + 1
+            if "{" in spec:
+                msg = (
+                    "Nested replacement fields in the format spec of '{}' "
+                    "are not supported (template {!r})")
+                raise exceptions.ImproperlyConfigured(
+                    msg.format(field, source))
+            root = field.split(".", 1)[0].split("[", 1)[0]
+            if root in constants:
+                value = FORMATTER.get_field(field, (), constants)[0]
+                value = FORMATTER.convert_field(value, conversion)
+                value = FORMATTER.format_field(value, spec)
+                chunks.append(value.replace("{", "{{").replace("}", "}}"))
+            else:
+                fields.add(root)
+                chunks.append("{" + field)
+                if conversion:
+                    chunks.append("!" + conversion)
+                if spec:
+                    chunks.append(":" + spec)
+                chunks.append("}")
+        return "".join(chunks), frozenset(fields)
+
+    def render(self, obj, **context):
+        return self.compiled.format(obj, obj=obj, **context)
+
+    def check(self, context=()):
+        unknown = self.fields.difference(("0", "obj"), context)
+        if unknown:
+            msg = "Unknown fields {} in template {!r}. Valid fields: {}"
+            raise exceptions.ImproperlyConfigured(msg.format(
+                ", ".join(sorted(unknown)), self.source,
+                ", ".join(sorted(set(("obj",) + tuple(context))))))
+
+
+class JinjaTemplate(Template):
+    """A Jinja2 template, compiled when it is created. The object is
+    available as ``obj``.
+
+    """
+
+    def __init__(self, source, **constants):
+        import jinja2
+        super(JinjaTemplate, self).__init__(source, **constants)
+        self.compiled = jinja2.Template(source)
+
+    def render(self, obj, **context):
+        context.update(self.constants)
+        return self.compiled.render(obj=obj, **context)
+
+
+# =============================================================================
+# FUNCTIONS
+# =============================================================================
+
+def compile_template(template, **constants):
+    """Compile a string as a ``FormatTemplate`` (or a copy of the
+    ``Template`` instance) with the given constants.
+
+    """
+    if isinstance(template, Template):
+        constants.update(template.constants)
+        return type(template)(template.source, **constants)
+    return FormatTemplate(template, **constants)
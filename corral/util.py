@@ -36,6 +36,7 @@
 
 import collections
 import importlib
+import itertools
 
 
 # =============================================================================
@@ -93,3 +94,13 @@ def collect_subclasses(cls):
 def dimport(importpath, lazy=False):
     lazy_import = LazyImport(importpath)
     return lazy_import if lazy else lazy_import.resolve()
+
+
+def chunks(iterable, size):
+    """Split an iterable in lists of at most ``size`` elements"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            break
+        yield chunk
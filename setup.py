@@ -62,6 +62,7 @@ REQUIREMENTS = [
     'attrs>=16.2.0',
     'coverage>=4.0.3',
     'flake8<3.0.0',
+    'futures>=3.0.5; python_version < "3.2"',
     'Jinja2>=2.8',
     'mock>=1.3.0',
     'sadisplay>=0.4.6',
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016-2017, Cabral, Juan; Sanchez, Bruno & Berois, Martín
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+
+# * Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+# =============================================================================
+# DOCS
+# =============================================================================
+
+"""Async steps and a local HTTP stand-in (only importable on Python >= 3.5)
+
+"""
+
+
+# =============================================================================
+# IMPORTS
+# =============================================================================
+
+import asyncio
+import threading
+
+from corral import run
+
+from .models import SampleModel
+
+
+# =============================================================================
+# CONSTANTS
+# =============================================================================
+
+# the module functions replaced the Task class methods in Python 3.7
+CURRENT_TASK = getattr(asyncio, "current_task", None) or \
+    asyncio.Task.current_task
+ALL_TASKS = getattr(asyncio, "all_tasks", None) or asyncio.Task.all_tasks
+
+
+# =============================================================================
+# HTTP STAND-IN
+# =============================================================================
+
+class HTTPStandIn(object):
+    """A tiny HTTP/1.0 server running its own event loop in a thread. It
+    answers ``GET /<name>`` with ``<name>-fetched`` after ``delay`` seconds
+    and keeps the maximum number of simultaneous requests.
+
+    """
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.active = self.max_active = self.requests = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+
+    async def handle(self, reader, writer):
+        self.active += 1
+        self.requests += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            request = (await reader.readline()).split()
+            if len(request) < 2:  # the client was cancelled
+                return
+            path = request[1].decode("ascii")
+            await asyncio.sleep(self.delay)
+            writer.write(b"HTTP/1.0 200 OK\r\n\r\n")
+            writer.write("{}-fetched".format(path[1:]).encode("ascii"))
+            await writer.drain()
+        finally:
+            self.active -= 1
+            writer.close()
+            # the transport must be closed before the loop is closed
+            # (wait_closed is only available since Python 3.7)
+            if hasattr(writer, "wait_closed"):
+                try:
+                    await writer.wait_closed()
+                except ConnectionError:
+                    pass
+
+    def __enter__(self):
+        self.thread.start()
+        future = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self.handle, "127.0.0.1", 0), self.loop)
+        self.server = future.result()
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def shutdown(self):
+        # the handlers still waiting a request (of cancelled clients) must
+        # finish before the loop is closed
+        self.server.close()
+        await self.server.wait_closed()
+        current = CURRENT_TASK(loop=self.loop)
+        handlers = [
+            t for t in ALL_TASKS(loop=self.loop) if t is not current]
+        for task in handlers:
+            task.cancel()
+        if handlers:
+            await asyncio.gather(*handlers, return_exceptions=True)
+
+    def __exit__(self, *exc_info):
+        asyncio.run_coroutine_threadsafe(
+            self.shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+async def fetch(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write("GET {} HTTP/1.0\r\n\r\n".format(path).encode("ascii"))
+        response = await reader.read()
+    finally:
+        writer.close()
+    return response.split(b"\r\n\r\n", 1)[1].decode("ascii")
+
+
+# =============================================================================
+# STEPS
+# =============================================================================
+
+class FetchStep(run.AsyncStep):
+
+    model = SampleModel
+    conditions = [
+        SampleModel.name.like("obj-%"), ~SampleModel.name.like("%-fetched%")]
+    ordering = [SampleModel.id]
+
+    concurrency = 3
+
+    port = None
+
+    async def process(self, obj):
+        obj.name = await fetch(self.port, "/" + obj.name)
+
+
+class FetchAndCreateStep(FetchStep):
+
+    async def process(self, obj):
+        await super(FetchAndCreateStep, self).process(obj)
+        return SampleModel(name=obj.name + "-new")
+
+
+class FailStep(FetchStep):
+
+    async def process(self, obj):
+        if obj.name == "obj-3":
+            raise ValueError(obj.name)
+        await super(FailStep, self).process(obj)
@@ -42,6 +42,11 @@
 # =============================================================================
 
 import os
+import time
+import unittest
+import datetime
+import signal
+import multiprocessing
 
 import mock
 
@@ -51,7 +56,7 @@ from corral.cli import commands as builtin_commands
 from . import commands
 from .steps import TestLoader, Step1, Step2
 from .alerts import Alert1
-from .base import BaseTest
+from .base import BaseTest, TEMP_DIR
 
 
 # =============================================================================
@@ -99,6 +104,23 @@ class TestCli(BaseTest):
                     self.assertTrue(setup.called)
                     self.assertTrue(hdl.called)
 
+    def test_selected_command(self):
+        self.assertEqual(
+            cli.selected_command(["-x", "run", "-s", "Step1"]), "run")
+        self.assertEqual(cli.selected_command(["--help"]), "")
+
+    @mock.patch("sys.argv", new=["test", "foo"])
+    def test_only_selected_command_setup(self, *args):
+        with mock.patch("corral.core.setup_environment"), \
+                mock.patch("tests.commands.TestAPICommand.handle"), \
+                mock.patch("corral.cli.commands.LSSteps.setup") as lssteps:
+            cli.run_from_command_line()
+            self.assertFalse(lssteps.called)
+
+        with mock.patch("corral.cli.commands.LSSteps.setup") as lssteps:
+            cli.create_parser()
+            self.assertTrue(lssteps.called)
+
     @mock.patch("corral.core.setup_environment")
     @mock.patch("tests.commands.TestAPICommand.handle", side_effect=Exception)
     @mock.patch("sys.stderr")
@@ -544,6 +566,25 @@ class Run(BaseTest):
             expected = [mock.call(Step2, sync=True)]
             execute_step.assert_has_calls(expected)
 
+    @mock.patch("sys.argv",
+                new=["test", "run", "--steps", "Step1", "--procs", "3"])
+    @mock.patch("corral.core.setup_environment")
+    def test_run_procs(self, *args):
+        with mock.patch("corral.run.execute_step") as execute_step:
+            cli.run_from_command_line()
+            expected = [mock.call(Step1, sync=False, procno=3)]
+            execute_step.assert_has_calls(expected)
+
+    @mock.patch("sys.argv",
+                new=["test", "run", "--steps", "Step1", "--procs", "0"])
+    @mock.patch("corral.core.setup_environment")
+    @mock.patch("sys.stderr")
+    @mock.patch("sys.stdout")
+    def test_run_invalid_procs(self, *args):
+        with mock.patch("corral.run.execute_step"):
+            with self.assertRaises(SystemExit):
+                cli.run_from_command_line()
+
     @mock.patch("sys.argv",
                 new=["test", "run", "--steps", "Step2", "Step2", "--sync"])
     @mock.patch("corral.core.setup_environment")
@@ -787,6 +828,274 @@ class Test(BaseTest):
                     sys_exit.assert_called_with(1)
 
 
+class SlowRunner(run.step.StepRunner):
+    """Write a file when the run starts and another when it finish"""
+
+    def run(self):
+        path = os.path.join(TEMP_DIR, "slow_{}".format(os.getpid()))
+        open(path + ".started", "w").close()
+        time.sleep(1)
+        open(path + ".done", "w").close()
+
+
+class SlowStep(Step1):
+
+    runner_class = SlowRunner
+
+
+def clear_slow_marks():
+    for fname in os.listdir(TEMP_DIR):
+        if fname.startswith("slow_"):
+            os.remove(os.path.join(TEMP_DIR, fname))
+
+
+def serve_in_new_group(pool_size=1):
+    os.setpgrp()
+    argv = ["test", "serve", "--pool-size", str(pool_size),
+            "--min-interval", "60", "--max-interval", "60"]
+    with mock.patch("sys.argv", argv), \
+            mock.patch("corral.core.setup_environment"), \
+            mock.patch("corral.run.load_steps", return_value=(SlowStep,)), \
+            mock.patch("corral.run.load_alerts", return_value=()), \
+            mock.patch("sys.stdout"):
+        cli.run_from_command_line()
+
+
+class Serve(BaseTest):
+
+    @mock.patch("sys.argv", new=["test", "serve", "--min-interval", "2",
+                                 "--max-interval", "10", "-w", "3"])
+    @mock.patch("corral.core.setup_environment")
+    def test_serve(self, *args):
+        with mock.patch("corral.run.serve", return_value=0) as serve, \
+                mock.patch("sys.exit") as sys_exit:
+            cli.run_from_command_line()
+            processors, execute = serve.call_args[0]
+            self.assertEqual(
+                processors, list(run.load_steps()) + list(run.load_alerts()))
+            kwargs = serve.call_args[1]
+            self.assertEqual(kwargs["min_interval"], 2.)
+            self.assertEqual(kwargs["max_interval"], 10.)
+            self.assertEqual(kwargs["max_workers"], 3)
+            self.assertFalse(kwargs["should_stop"]())
+            sys_exit.assert_not_called()
+
+    @mock.patch("sys.argv", new=["test", "serve", "--loader"])
+    @mock.patch("corral.core.setup_environment")
+    def test_serve_loader_and_fail(self, *args):
+        with mock.patch("corral.run.serve", return_value=2) as serve, \
+                mock.patch("sys.exit") as sys_exit:
+            cli.run_from_command_line()
+            self.assertEqual(serve.call_args[0][0][0], TestLoader)
+            sys_exit.assert_called_once_with(1)
+
+    @mock.patch("sys.argv", new=["test", "serve", "--metrics-port", "9100"])
+    @mock.patch("corral.core.setup_environment")
+    def test_serve_metrics_port(self, *args):
+        with mock.patch("corral.run.serve", return_value=0), \
+                mock.patch("corral.run.exposition.start_http_server") as srv:
+            cli.run_from_command_line()
+            srv.assert_called_once_with(9100)
+            self.assertTrue(srv.return_value.shutdown.called)
+
+    def test_serve_pool_stops_on_group_signal(self):
+        def marks(ext):
+            return [
+                fname for fname in os.listdir(TEMP_DIR)
+                if fname.startswith("slow_") and fname.endswith(ext)]
+
+        clear_slow_marks()
+        proc = multiprocessing.Process(target=serve_in_new_group)
+        proc.start()
+        self.addCleanup(proc.join)
+        try:
+            start = time.time()
+            while not marks(".started") and time.time() - start < 10:
+                time.sleep(0.05)
+            self.assertTrue(marks(".started"))
+
+            # a Ctrl-C is sent to all the process group
+            os.killpg(proc.pid, signal.SIGINT)
+            proc.join(10)
+            self.assertFalse(proc.is_alive())
+            self.assertEqual(proc.exitcode, 0)
+            self.assertTrue(marks(".done"))
+        finally:
+            if proc.is_alive():
+                os.killpg(proc.pid, signal.SIGKILL)
+
+    @unittest.skipUnless(os.path.isdir("/proc"), "requires procfs")
+    def test_serve_pool_dies_with_group(self):
+        def stat(pid):
+            # (state, parent pid) of the process
+            try:
+                with open("/proc/{}/stat".format(pid)) as fp:
+                    fields = fp.read().rsplit(")", 1)[1].split()
+            except (IOError, OSError):
+                return None, None
+            return fields[0], int(fields[1])
+
+        def alive(pid):
+            # the orphaned zombies are dead too
+            return stat(pid)[0] not in (None, "Z")
+
+        def children(pid):
+            return [
+                int(name) for name in os.listdir("/proc")
+                if name.isdigit() and stat(name)[1] == pid]
+
+        def marks(ext):
+            return [
+                fname for fname in os.listdir(TEMP_DIR)
+                if fname.startswith("slow_") and fname.endswith(ext)]
+
+        clear_slow_marks()
+        # one of the workers is idle waiting for a task
+        proc = multiprocessing.Process(target=serve_in_new_group, args=(2,))
+        proc.start()
+        self.addCleanup(proc.join)
+        workers = []
+        try:
+            start = time.time()
+            while (
+                len(workers) < 2 or not marks(".started")
+            ) and time.time() - start < 10:
+                time.sleep(0.05)
+                workers = children(proc.pid)
+            self.assertEqual(len(workers), 2)
+            self.assertTrue(marks(".started"))
+
+            # the terminal of the command is closed
+            os.killpg(proc.pid, signal.SIGHUP)
+            proc.join(10)
+            self.assertFalse(proc.is_alive())
+            start = time.time()
+            while any(map(alive, workers)) and time.time() - start < 10:
+                time.sleep(0.05)
+            self.assertFalse(any(map(alive, workers)))
+            # the worker was stopped in the middle of the task
+            time.sleep(1.5)
+            self.assertFalse(marks(".done"))
+        finally:
+            if proc.is_alive():
+                os.killpg(proc.pid, signal.SIGKILL)
+            for pid in workers:
+                if alive(pid):
+                    os.kill(pid, signal.SIGKILL)
+
+    @mock.patch("sys.argv", new=["test", "serve", "--min-interval", "-1"])
+    @mock.patch("corral.core.setup_environment")
+    @mock.patch("sys.stderr")
+    @mock.patch("sys.stdout")
+    def test_serve_invalid_interval(self, *args):
+        with mock.patch("corral.run.serve"):
+            with self.assertRaises(SystemExit):
+                cli.run_from_command_line()
+
+
+class Profile(BaseTest):
+
+    @mock.patch("sys.argv", new=["test", "profile", "-ns", "-o", "out.prof",
+                                 "--sample-interval", "0.01",
+                                 "run", "-s", "Step1"])
+    @mock.patch("corral.core.setup_environment")
+    @mock.patch("sys.stdout")
+    def test_profile_run(self, *args):
+        with mock.patch("corral.qa.run_profile",
+                        return_value="out.folded") as run_profile, \
+                mock.patch("corral.cli.commands.Profile._print") as prt:
+            cli.run_from_command_line()
+            run_profile.assert_called_once_with(
+                "out.prof", "run", ["-s", "Step1"], sample_interval=0.01)
+            prt.assert_called_once_with("out.prof", mock.ANY)
+
+    @mock.patch("sys.argv", new=["test", "profile", "-ns"])
+    @mock.patch("corral.core.setup_environment")
+    @mock.patch("sys.stdout")
+    def test_profile_tests(self, *args):
+        with mock.patch("corral.qa.run_profile",
+                        return_value=None) as run_profile, \
+                mock.patch("corral.cli.commands.Profile._print") as prt:
+            cli.run_from_command_line()
+            out = run_profile.call_args[0][0]
+            self.assertEqual(run_profile.call_args[0][1:], ("test", []))
+            prt.assert_called_once_with(out, mock.ANY)
+
+    @mock.patch("sys.argv", new=["test", "profile", "-ns", "load"])
+    @mock.patch("corral.core.setup_environment")
+    @mock.patch("sys.stderr")
+    @mock.patch("sys.stdout")
+    def test_profile_nothing(self, *args):
+        with mock.patch("corral.qa.run_profile", side_effect=ValueError), \
+                mock.patch("corral.cli.commands.Profile._print") as prt, \
+                mock.patch("sys.exit") as sys_exit:
+            cli.run_from_command_line()
+            sys_exit.assert_called_once_with(1)
+            prt.assert_not_called()
+
+
+class Stats(BaseTest):
+
+    @mock.patch("sys.argv", new=["test", "stats"])
+    @mock.patch("corral.core.setup_environment")
+    @mock.patch("sys.stdout")
+    def test_stats(self, *args):
+        run.execute_step(Step1, sync=True)
+        run.execute_step(Step1, sync=True)
+        run.execute_alert(Alert1, sync=True)
+        with mock.patch("texttable.Texttable.header") as header, \
+                mock.patch("texttable.Texttable.add_row") as row:
+            cli.run_from_command_line()
+            self.assertEqual(header.call_args[0][0][:3],
+                             ("Processor", "Type", "Runs"))
+            rows = {call[0][0][0]: call[0][0] for call in row.call_args_list}
+        self.assertEqual(rows["tests.steps.Step1"][1:4], ["step", 2, 0])
+        self.assertEqual(rows["tests.alerts.Alert1"][1:4], ["alert", 1, 0])
+
+    @mock.patch("sys.argv", new=["test", "stats", "-p", "Step1", "-n", "1"])
+    @mock.patch("corral.core.setup_environment")
+    @mock.patch("sys.stdout")
+    def test_stats_filter(self, *args):
+        run.execute_step(Step1, sync=True)
+        run.execute_step(Step1, sync=True)
+        run.execute_alert(Alert1, sync=True)
+        with mock.patch("texttable.Texttable.add_row") as row:
+            cli.run_from_command_line()
+            self.assertEqual(row.call_count, 1)
+            self.assertEqual(
+                row.call_args[0][0][:3], ["tests.steps.Step1", "step", 1])
+
+    @mock.patch("sys.argv", new=["test", "stats", "-p", "Step_1", "-n", "2"])
+    @mock.patch("corral.core.setup_environment")
+    @mock.patch("sys.stdout")
+    def test_stats_filter_by_name(self, *args):
+        from corral.db.default_models import ProcessorRun
+
+        now = datetime.datetime.now()
+        paths = [
+            "pkg.Step_1", "pkg.Step_1", "pkg.Step_1", "Step_1",
+            "pkg.OtherStep_1", "pkg.Step11"]
+        with db.session_scope() as session:
+            for idx, path in enumerate(paths):
+                session.add(ProcessorRun(
+                    processor_path=path, processor_type="step",
+                    started_at=now + datetime.timedelta(seconds=idx),
+                    wall_time=1., generated=1, exitcode=0))
+        with mock.patch("texttable.Texttable.add_row") as row:
+            cli.run_from_command_line()
+            rows = [call[0][0][:3] for call in row.call_args_list]
+        self.assertEqual(
+            rows, [["Step_1", "step", 1], ["pkg.Step_1", "step", 2]])
+
+    @mock.patch("sys.argv", new=["test", "stats"])
+    @mock.patch("corral.core.setup_environment")
+    def test_stats_empty(self, *args):
+        with mock.patch("texttable.Texttable.draw") as draw, \
+                mock.patch("sys.stdout"):
+            cli.run_from_command_line()
+            draw.assert_not_called()
+
+
 class RunAll(BaseTest):
 
     @mock.patch("corral.core.setup_environment")
@@ -803,6 +1112,38 @@ class RunAll(BaseTest):
                     execute_step.assert_any_call(Step2)
                     execute_alert.assert_any_call(Alert1)
 
+    @mock.patch("corral.core.setup_environment")
+    @mock.patch("sys.argv", new=["test", "run-all", "--workers", "2"])
+    def test_run_all_workers(self, *args):
+        with mock.patch("corral.run.schedule", return_value=[]) as schedule:
+            cli.run_from_command_line()
+            self.assertEqual(schedule.call_args[1], {"max_workers": 2})
+            self.assertEqual(
+                schedule.call_args[0][0],
+                [TestLoader] + list(run.load_steps()) +
+                list(run.load_alerts()))
+
+    @mock.patch("corral.core.setup_environment")
+    @mock.patch("sys.argv", new=["test", "run-all", "--pool-size", "2"])
+    def test_run_all_pool(self, *args):
+        with mock.patch("corral.run.ProcessorPool") as ppool, \
+                mock.patch("corral.run.execute_step") as execute_step, \
+                mock.patch("corral.run.execute_loader"), \
+                mock.patch("corral.run.execute_alert"):
+            cli.run_from_command_line()
+            ppool.assert_called_once_with(2)
+            pool = ppool.return_value.__enter__.return_value
+            execute_step.assert_any_call(Step1, pool=pool)
+
+    @mock.patch("sys.argv", new=["test", "run-all", "--workers", "0"])
+    @mock.patch("corral.core.setup_environment")
+    @mock.patch("sys.stderr")
+    @mock.patch("sys.stdout")
+    def test_run_all_invalid_workers(self, *args):
+        with mock.patch("corral.run.schedule"):
+            with self.assertRaises(SystemExit):
+                cli.run_from_command_line()
+
     @mock.patch("sys.argv", new=["test", "run-all"])
     @mock.patch("corral.core.setup_environment")
     @mock.patch("sys.stdout")
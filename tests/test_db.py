@@ -41,14 +41,18 @@
 # IMPORTS
 # =============================================================================
 
+import os
 import inspect
+import multiprocessing
 
 import mock
 
-from corral import db, util
+from corral import db, util, exceptions, run
+from corral.db.default_models import Alerted
 
 from . import models
-from .base import BaseTest
+from .steps import Step1
+from .base import BaseTest, TEMP_DIR
 
 
 # =============================================================================
@@ -101,6 +105,161 @@ class TestDB(BaseTest):
             self.assertTrue(m_create_all.called)
             self.assertEquals(m_create_all.call_args[1], {"a": 1})
 
+    def test_migrate_fills_alerted_keys(self):
+        with db.session_scope() as session:
+            sample = models.SampleModel(name="foo")
+            session.add(sample)
+            session.commit()
+            session.add(Alerted(
+                alert_path="tests.alerts.Alert1",
+                model_table=models.SampleModel.__table__.name,
+                model_ids={"id": sample.id}))
+            expected_key = str(sample.id)
+
+        with mock.patch("corral.db.alembic") as alembic:
+            db.migrate()
+        alembic.assert_called_once_with("upgrade", "head")
+        with db.session_scope() as session:
+            alerted = session.query(Alerted).one()
+            self.assertEqual(alerted.model_key, expected_key)
+
+
+class TestConnection(BaseTest):
+
+    def test_connection_options(self):
+        options = {"pool_size": 10, "pool_pre_ping": True}
+        with mock.patch("tests.settings.CONNECTION_OPTIONS", options,
+                        create=True):
+            self.assertEqual(db.get_connection_options(), options)
+            self.assertEqual(db.get_connection_options(True), {})
+        self.assertEqual(db.get_connection_options(), {})
+
+        with mock.patch("tests.settings.CONNECTION_OPTIONS", [1],
+                        create=True):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                db.get_connection_options()
+
+    @mock.patch("corral.db.engine", None)
+    @mock.patch("corral.db.create_engine")
+    @mock.patch("corral.db.Session")
+    @mock.patch("corral.db.Model")
+    def test_setup_with_options(self, Model, Session, create_engine):
+        options = {"pool_recycle": 3600, "isolation_level": "AUTOCOMMIT"}
+        with mock.patch("tests.settings.CONNECTION_OPTIONS", options,
+                        create=True):
+            db.setup()
+        create_engine.assert_called_once_with(
+            db.get_url(), echo=False, pool_recycle=3600,
+            isolation_level="AUTOCOMMIT")
+
+    def test_reset_after_fork(self):
+        pool = db.engine.pool
+        self.addCleanup(setattr, db.engine, "pool", pool)
+        db.reset_after_fork()
+        self.assertIsNot(db.engine.pool, pool)
+        self.assertIs(db._inherited_pools[-1], pool)
+
+    def test_forked_process_pool(self):
+        pool = db.engine.pool
+        reader, writer = multiprocessing.Pipe(duplex=False)
+
+        def child():
+            writer.send((
+                db.engine.pool is not pool and
+                db._inherited_pools[-1] is pool))
+
+        proc = multiprocessing.Process(target=child)
+        proc.start()
+        proc.join()
+        self.assertTrue(reader.recv())
+        self.assertIs(db.engine.pool, pool)
+
+
+class TestReadReplica(BaseTest):
+
+    def setup(self):
+        self.primary = db.create_engine(
+            "sqlite:///" + os.path.join(TEMP_DIR, "primary.db"))
+        self.replica = db.create_engine(
+            "sqlite:///" + os.path.join(TEMP_DIR, "replica.db"))
+        for engine in (self.primary, self.replica):
+            db.Model.metadata.drop_all(engine)
+            db.Model.metadata.create_all(engine)
+
+        table = models.SampleModel.__table__
+        # the replica is behind: the object 2 was processed and the 3
+        # deleted in the primary
+        self.primary.execute(table.insert(), [
+            {"id": 1, "name": None}, {"id": 2, "name": "Step1"}])
+        self.replica.execute(table.insert(), [
+            {"id": 1, "name": None}, {"id": 2, "name": None},
+            {"id": 3, "name": None}])
+
+        patch = mock.patch("corral.db.read_engines", [self.replica])
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def session(self):
+        return db.Session(bind=self.primary)
+
+    def test_read_urls(self):
+        self.assertEqual(db.get_read_urls(), [])
+        with mock.patch("tests.settings.READ_CONNECTION", "sqlite:///r.db",
+                        create=True):
+            self.assertEqual(db.get_read_urls(), ["sqlite:///r.db"])
+            self.assertEqual(db.get_read_urls(True), [])
+        with mock.patch("tests.settings.READ_CONNECTION", 1, create=True):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                db.get_read_urls()
+
+    def test_routing(self):
+        session = self.session()
+        self.assertTrue(session.replicated)
+        query = session.query(models.SampleModel)
+        self.assertEqual(query.count(), 2)
+        with session.on_replica():
+            self.assertEqual(query.count(), 3)
+            # the writes always go to the primary
+            session.add(models.SampleModel(id=4, name="new"))
+            session.flush()
+        session.commit()
+        self.assertEqual(
+            self.primary.execute("SELECT COUNT(*) FROM SampleModel").scalar(),
+            3)
+        self.assertEqual(
+            self.replica.execute("SELECT COUNT(*) FROM SampleModel").scalar(),
+            3)
+        session.close()
+
+    def test_iterate_replica(self):
+        session = self.session()
+        query = session.query(models.SampleModel).filter(
+            models.SampleModel.name == None)  # noqa
+        objs = list(session.iterate_replica(query, query, size=2))
+        self.assertEqual([obj.id for obj in objs], [1])
+        session.close()
+
+    def test_step_reads_replica(self):
+        sessionmaker = db.sessionmaker(
+            class_=db.RoutingSession, bind=self.primary)
+        processed = []
+        with mock.patch("corral.db.Session", sessionmaker), \
+                mock.patch("tests.steps.Step1.process",
+                           side_effect=lambda obj: processed.append(obj.id)):
+            run.execute_step(Step1, sync=True)
+        self.assertEqual(processed, [1])
+
+    def test_checkpointed_step_reads_replica(self):
+        sessionmaker = db.sessionmaker(
+            class_=db.RoutingSession, bind=self.primary)
+        processed = []
+        with mock.patch("corral.db.Session", sessionmaker), \
+                mock.patch("tests.steps.Step1.commit_every", 1), \
+                mock.patch("tests.steps.Step1.process",
+                           side_effect=lambda obj: processed.append(obj.id)):
+            run.execute_step(Step1, sync=True)
+        self.assertEqual(processed, [1])
+
 
 # =============================================================================
 # MAIN
@@ -41,11 +41,18 @@
 # IMPORTS
 # =============================================================================
 
+import sys
+import time
+import signal
+import pstats
 import tempfile
+import datetime
 import os
+import unittest
+import threading
 
-from corral import run, exceptions, db, conf
-from corral.db.default_models import Alerted
+from corral import run, exceptions, db, conf, util
+from corral.db.default_models import Alerted, ProcessorRun, Watermark
 from corral.run import endpoints as ep
 
 import mock
@@ -56,7 +63,34 @@ from .steps import TestLoader, Step1, Step2
 from .alerts import Alert1
 from .models import SampleModel
 
-from .base import BaseTest
+from .base import BaseTest, TEMP_DIR
+
+
+# =============================================================================
+# MODELS
+# =============================================================================
+
+# the models aren't subclasses of db.Model to keep them out of the
+# models of the test pipeline
+RelationModel = db.declarative.declarative_base()
+
+
+class SampleParent(RelationModel):
+
+    __tablename__ = 'SampleParent'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=True)
+
+
+class SampleChild(RelationModel):
+
+    __tablename__ = 'SampleChild'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=True)
+    parent_id = db.Column(db.Integer, db.ForeignKey('SampleParent.id'))
+    parent = db.relationship(SampleParent)
 
 
 # =============================================================================
@@ -86,6 +120,120 @@ class TestLoaderFunctions(BaseTest):
                 with self.assertRaises(TypeError):
                     run.execute_loader(TestLoader, sync=True)
 
+    def test_bulk_size(self):
+        self.assertIsNone(TestLoader.get_bulk_size())
+        with mock.patch("tests.steps.TestLoader.bulk_size", 10):
+            self.assertEqual(TestLoader.get_bulk_size(), 10)
+        for value in (0, -1, 1.5, "10"):
+            with mock.patch("tests.steps.TestLoader.bulk_size", value):
+                with self.assertRaises(exceptions.ImproperlyConfigured):
+                    TestLoader.get_bulk_size()
+
+    def test_execute_loader_bulk(self):
+        objs = [SampleModel(name="obj_{}".format(idx)) for idx in range(5)]
+        objs += [{"name": "row_{}".format(idx)} for idx in range(5)]
+        with mock.patch("tests.steps.TestLoader.generate",
+                        return_value=iter(objs)), \
+                mock.patch("tests.steps.TestLoader.model", SampleModel), \
+                mock.patch("tests.steps.TestLoader.bulk_size", 3), \
+                mock.patch("corral.run.loader.Loader.bulk_save",
+                           side_effect=run.Loader.bulk_save,
+                           autospec=True) as bulk_save:
+            runner = run.execute_loader(TestLoader, sync=True)[0]
+        self.assertEqual(
+            [len(call[0][1]) for call in bulk_save.call_args_list],
+            [3, 3, 3, 1])
+        self.assertEqual(runner.processed, 10)
+        with db.session_scope() as session:
+            names = {name for name, in session.query(SampleModel.name)}
+        self.assertEqual(names, {
+            "obj_{}".format(idx) for idx in range(5)} | {
+            "row_{}".format(idx) for idx in range(5)})
+
+    def test_execute_loader_bulk_invalid(self):
+        with mock.patch("tests.steps.TestLoader.bulk_size", 3):
+            with mock.patch("tests.steps.TestLoader.generate",
+                            return_value=[None]):
+                with self.assertRaises(TypeError):
+                    run.execute_loader(TestLoader, sync=True)
+            with mock.patch("tests.steps.TestLoader.generate",
+                            return_value=[{"name": "foo"}]):
+                with self.assertRaises(exceptions.ImproperlyConfigured):
+                    run.execute_loader(TestLoader, sync=True)
+
+    def test_execute_loader_bulk_validate(self):
+        def validate(self, obj):
+            if obj["name"] == "row_3":
+                raise ValueError(obj)
+
+        rows = [{"name": "row_{}".format(idx)} for idx in range(5)]
+        with mock.patch("tests.steps.TestLoader.generate",
+                        return_value=iter(rows)), \
+                mock.patch("tests.steps.TestLoader.model", SampleModel), \
+                mock.patch("tests.steps.TestLoader.bulk_size", 10), \
+                mock.patch("tests.steps.TestLoader.validate", validate):
+            with self.assertRaises(ValueError):
+                run.execute_loader(TestLoader, sync=True)
+        with db.session_scope() as session:
+            self.assertEqual(session.query(SampleModel).count(), 0)
+
+    def test_bulk_save_override(self):
+        def save(self, obj):
+            pass
+
+        with mock.patch("tests.steps.TestLoader.bulk_size", 10), \
+                mock.patch("tests.steps.TestLoader.save", save):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                TestLoader.get_bulk_size()
+        with mock.patch("tests.steps.TestLoader.save", save):
+            self.assertIsNone(TestLoader.get_bulk_size())
+
+    def test_bulk_rows_relationship(self):
+        obj = SampleModel(name="foo")
+        obj.__dict__["parent"] = SampleModel(name="bar")
+        mapper = db.inspect(SampleModel)
+        with mock.patch.object(
+                mapper, "relationships", [mock.Mock(key="parent")]):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                TestLoader(None).bulk_rows([obj])
+            del obj.__dict__["parent"]
+            self.assertEqual(len(TestLoader(None).bulk_rows([obj])), 1)
+
+    def test_copy_value(self):
+        from corral.run import loader
+        self.assertEqual(loader.copy_value(None), "\\N")
+        self.assertEqual(loader.copy_value(True), "t")
+        self.assertEqual(loader.copy_value(1.5), "1.5")
+        self.assertEqual(
+            loader.copy_value(u"a\tb\nc\\"), u"a\\tb\\nc\\\\")
+        self.assertEqual(
+            float(loader.copy_value(1 / 3.)), 1 / 3.)
+        self.assertEqual(loader.copy_value(12), u"12")
+        self.assertEqual(
+            loader.copy_value(b"a\tb"),
+            u"a\\tb" if six.PY2 else u"\\\\x610962")
+
+    def test_copy_rows(self):
+        from corral.run import loader
+
+        Base = db.declarative.declarative_base()
+
+        class KeyModel(Base):
+            __tablename__ = "key_model"
+            id = db.Column(db.Integer, primary_key=True)
+            value = db.Column("real_name", db.String(10), key="value")
+
+        connection = mock.MagicMock()
+        connection.dialect = db.create_engine("sqlite://").dialect
+        cursor = connection.connection.cursor.return_value
+        loader.copy_rows(
+            connection, KeyModel.__table__, ("id", "value"),
+            [{"id": 1, "value": u"a"}, {"id": 2, "value": None}])
+        sql, buff = cursor.copy_expert.call_args[0]
+        self.assertEqual(sql, 'COPY key_model (id, real_name) FROM STDIN')
+        self.assertEqual(buff.getvalue(), u"1\ta\n2\t\\N\n")
+        cursor.close.assert_called_once_with()
+
 
 class TestStepFunctions(BaseTest):
 
@@ -97,7 +245,11 @@ class TestStepFunctions(BaseTest):
             self.assertIn(group, groups)
 
         patch = ["A", "B", "C"]
+        self.addCleanup(run.step.registry.clear)
         with mock.patch("tests.steps.Step1.groups", patch, create=True):
+            # the groups are indexed only once
+            self.assertNotIn("A", run.steps_groups())
+            run.step.registry.clear()
             groups = run.steps_groups()
             expected = tuple(sorted(Step1.groups + Step2.groups))
             self.assertEquals(groups, expected)
@@ -111,6 +263,28 @@ class TestStepFunctions(BaseTest):
             with self.assertRaises(exceptions.ImproperlyConfigured):
                 run.load_steps()
 
+    def test_registry(self):
+        registry = run.step.registry
+        self.assertIs(registry.by_name("Step1"), Step1)
+        self.assertIsNone(registry.by_name("Foo"))
+        self.assertIs(registry.by_path("tests.steps.Step2"), Step2)
+        self.assertEqual(Step1.retrieve_python_path(), "tests.steps.Step1")
+        self.assertEqual(registry.processors(["foo"]), ())
+
+        with mock.patch("corral.run.registry.util.dimport",
+                        wraps=util.dimport) as dimport:
+            run.load_steps()
+            run.steps_groups()
+            Step2.retrieve_python_path()
+            self.assertFalse(dimport.called)
+
+            with mock.patch("corral.conf.settings.STEPS",
+                            new=["tests.steps.Step2"]):
+                self.assertEqual(run.load_steps(), (Step2,))
+                self.assertIsNone(Step1.retrieve_python_path())
+            self.assertEqual(run.load_steps(), (Step1, Step2))
+            self.assertEqual(dimport.call_count, 3)
+
     def test_step_return_no_model(self):
         with mock.patch("tests.steps.Step1.generate", return_value=[None]):
             with self.assertRaises(TypeError):
@@ -149,6 +323,418 @@ class TestStepFunctions(BaseTest):
             sample = session.query(SampleModel).get(sample_id)
             self.assertEqual(sample.name, "Step2")
 
+    def test_execute_step_procno(self):
+        procs = run.execute_step(Step1, sync=True, procno=3)
+        self.assertEqual(len(procs), 1)
+
+        with mock.patch("corral.run.step.StepRunner.start") as proc_start:
+            procs = run.execute_step(Step1, procno=3)
+            self.assertEqual(proc_start.call_count, 3)
+            self.assertEqual(
+                [(p.proc_number, p.proc_n) for p in procs],
+                [(0, 3), (1, 3), (2, 3)])
+
+        with mock.patch("tests.steps.Step1.procno", 2):
+            with mock.patch("corral.run.step.StepRunner.start"):
+                procs = run.execute_step(Step1)
+                self.assertEqual(len(procs), 2)
+
+        with self.assertRaises(ValueError):
+            run.execute_step(Step1, procno=0)
+        with mock.patch("tests.steps.Step1.procno", "foo"):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                run.execute_step(Step1)
+
+    def test_filter_by_proc(self):
+        with db.session_scope() as session:
+            for idx in range(10):
+                session.add(SampleModel(name=None))
+
+        ids = []
+        with db.session_scope() as session:
+            step = Step1(session)
+            for proc_number in range(3):
+                query = step.filter_by_proc(
+                    step.generate(), proc_number, 3)
+                proc_ids = [obj.id for obj in query]
+                self.assertTrue(
+                    all(pid % 3 == proc_number for pid in proc_ids))
+                ids.extend(proc_ids)
+            all_ids = [obj.id for obj in step.generate()]
+        self.assertCountEqual(ids, all_ids)
+
+        with db.session_scope() as session:
+            step = Step1(session)
+            self.assertIs(step.filter_by_proc([None], 0, 1)[0], None)
+            with self.assertRaises(NotImplementedError):
+                step.filter_by_proc([None], 0, 2)
+
+    def test_execute_step_partitioned(self):
+        with db.session_scope() as session:
+            for idx in range(10):
+                session.add(SampleModel(name=None))
+
+        processed = []
+
+        def process(self, obj):
+            processed.append((self.proc_number, obj.id))
+
+        with mock.patch("tests.steps.Step1.process", process):
+            for proc_number in range(2):
+                runner = Step1.runner_class()
+                runner.setup(Step1, proc_number, 2)
+                runner.run()
+
+        self.assertEqual(len(processed), 10)
+        for proc_number, obj_id in processed:
+            self.assertEqual(obj_id % 2, proc_number)
+
+    def test_chunk_size(self):
+        self.assertIsNone(Step1.get_chunk_size())
+        with mock.patch("tests.steps.Step1.chunk_size", 10):
+            self.assertEqual(Step1.get_chunk_size(), 10)
+        with mock.patch("tests.settings.STEP_CHUNK_SIZE", 20,
+                        create=True):
+            self.assertEqual(Step1.get_chunk_size(), 20)
+            with mock.patch("tests.steps.Step1.chunk_size", 10):
+                self.assertEqual(Step1.get_chunk_size(), 10)
+        with mock.patch("tests.steps.Step1.chunk_size", 0):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                Step1.get_chunk_size()
+        for invalid in (0, -1, "10", 1.5):
+            with mock.patch("tests.settings.STEP_CHUNK_SIZE", invalid,
+                            create=True):
+                with self.assertRaises(exceptions.ImproperlyConfigured):
+                    Step1.get_chunk_size()
+            with mock.patch("tests.settings.ALERT_CHUNK_SIZE", invalid,
+                            create=True):
+                with self.assertRaises(exceptions.ImproperlyConfigured):
+                    Alert1.get_chunk_size()
+
+    def test_execute_step_stream(self):
+        with db.session_scope() as session:
+            for idx in range(5):
+                session.add(SampleModel(name=None))
+
+        processed, queries = [], []
+
+        def process(self, obj):
+            processed.append(obj.id)
+
+        def stream(self, query):
+            queries.append(run.Step.stream(self, query))
+            return queries[-1]
+
+        with mock.patch("tests.steps.Step1.chunk_size", 2), \
+                mock.patch("tests.steps.Step1.process", process), \
+                mock.patch("tests.steps.Step1.stream", stream):
+            run.execute_step(Step1, sync=True)
+
+        self.assertEqual(len(processed), 5)
+        self.assertEqual(queries[0]._yield_per, 2)
+
+        with mock.patch("tests.steps.Step1.process", process), \
+                mock.patch("tests.steps.Step1.stream", stream):
+            run.execute_step(Step1, sync=True)
+        self.assertIsNone(queries[1]._yield_per)
+
+    def test_commit_options(self):
+        self.assertIsNone(Step1.get_commit_every())
+        self.assertIsNone(Step1.get_commit_interval_seconds())
+        with mock.patch("tests.steps.Step1.commit_every", -1):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                Step1.get_commit_every()
+        with mock.patch("tests.steps.Step1.commit_interval_seconds", "1"):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                Step1.get_commit_interval_seconds()
+
+    def test_paginate(self):
+        with db.session_scope() as session:
+            for idx in range(7):
+                session.add(SampleModel(name=str(idx)))
+
+        with db.session_scope() as session:
+            step = Step1(session)
+            query = session.query(SampleModel).order_by(SampleModel.name)
+            ids = [obj.id for obj in step.paginate(query, 3)]
+            expected = [
+                obj.id for obj in
+                session.query(SampleModel).order_by(SampleModel.id)]
+            self.assertEqual(ids, expected)
+            self.assertEqual(
+                list(step.paginate(iter([1, 2, 3]), 2)), [1, 2, 3])
+
+    def _checkpoint_run(self, fail_at):
+        def process(self, obj):
+            if obj.id == fail_at:
+                raise ValueError(obj.id)
+            obj.name = "processed_{}".format(obj.id)
+
+        with mock.patch("tests.steps.Step1.process", process):
+            try:
+                run.execute_step(Step1, sync=True)
+            except ValueError:
+                pass
+
+        with db.session_scope() as session:
+            query = session.query(SampleModel).filter(
+                SampleModel.name != None)  # noqa
+            return sorted(obj.id for obj in query)
+
+    def test_execute_step_commit_every(self):
+        with db.session_scope() as session:
+            for idx in range(10):
+                session.add(SampleModel(name=None))
+        with db.session_scope() as session:
+            ids = sorted(obj.id for obj in session.query(SampleModel))
+
+        with mock.patch("tests.steps.Step1.commit_every", 3):
+            processed = self._checkpoint_run(fail_at=ids[7])
+            self.assertEqual(processed, ids[:6])
+
+            processed = self._checkpoint_run(fail_at=None)
+            self.assertEqual(processed, ids)
+
+    def test_execute_step_commit_interval(self):
+        with db.session_scope() as session:
+            for idx in range(5):
+                session.add(SampleModel(name=None))
+        with db.session_scope() as session:
+            ids = sorted(obj.id for obj in session.query(SampleModel))
+
+        with mock.patch("tests.steps.Step1.commit_interval_seconds", 1e-9):
+            processed = self._checkpoint_run(fail_at=ids[3])
+            self.assertEqual(processed, ids[:3])
+
+    def test_execute_step_commit_interval_paginates(self):
+        with db.session_scope() as session:
+            for idx in range(5):
+                session.add(SampleModel(name=None))
+        with db.session_scope() as session:
+            ids = sorted(obj.id for obj in session.query(SampleModel))
+
+        paginate = Step1.paginate
+        sizes = []
+
+        def spy(self, query, size):
+            sizes.append(size)
+            return paginate(self, query, size)
+
+        with mock.patch("tests.steps.Step1.commit_interval_seconds", 60), \
+                mock.patch("tests.steps.Step1.paginate", spy), \
+                mock.patch("corral.run.step.CHECKPOINT_PAGE_SIZE", 2):
+            processed = self._checkpoint_run(fail_at=None)
+        self.assertEqual(sizes, [2])
+        self.assertEqual(processed, ids)
+
+    def test_execute_step_checkpoint_lazy_relationship(self):
+        def process(self, obj):
+            obj.name = "child_of_{}".format(obj.parent.name)
+
+        def process_batch(self, objs):
+            for obj in objs:
+                process(self, obj)
+
+        options = [
+            {"commit_interval_seconds": 1e-9},
+            {"commit_every": 3, "batch_size": 2}]
+        RelationModel.metadata.create_all(db.engine)
+        self.addCleanup(RelationModel.metadata.drop_all, db.engine)
+        for opts in options:
+            with db.session_scope() as session:
+                session.query(SampleChild).delete()
+                session.query(SampleParent).delete()
+                for idx in range(7):
+                    parent = SampleParent(name="parent_{}".format(idx))
+                    session.add(SampleChild(parent=parent))
+
+            patches = [
+                mock.patch("tests.steps.Step1.model", SampleChild),
+                mock.patch(
+                    "tests.steps.Step1.conditions",
+                    [SampleChild.name == None]),  # noqa
+                mock.patch("tests.steps.Step1.ordering", None),
+                mock.patch("tests.steps.Step1.process", process),
+                mock.patch("tests.steps.Step1.process_batch", process_batch),
+                # the models don't extend db.Model
+                mock.patch("tests.steps.Step1.validate"),
+                mock.patch("corral.run.step.CHECKPOINT_PAGE_SIZE", 3)]
+            patches.extend(
+                mock.patch("tests.steps.Step1." + k, v)
+                for k, v in opts.items())
+            for patch in patches:
+                patch.start()
+            try:
+                run.execute_step(Step1, sync=True)
+            finally:
+                for patch in reversed(patches):
+                    patch.stop()
+
+            with db.session_scope() as session:
+                names = sorted(
+                    child.name for child in session.query(SampleChild))
+            self.assertEqual(
+                names, ["child_of_parent_{}".format(i) for i in range(7)])
+
+    def test_execute_step_process_batch(self):
+        with db.session_scope() as session:
+            for idx in range(5):
+                session.add(SampleModel(name=None))
+
+        batches = []
+
+        def process_batch(self, objs):
+            batches.append(len(objs))
+            for obj in objs:
+                obj.name = "batch_{}".format(obj.id)
+            return SampleModel(name="new_{}".format(len(batches)))
+
+        with mock.patch("tests.steps.Step1.batch_size", 2), \
+                mock.patch("tests.steps.Step1.process_batch", process_batch):
+            run.execute_step(Step1, sync=True)
+
+        self.assertEqual(batches, [2, 2, 1])
+        with db.session_scope() as session:
+            names = [obj.name for obj in session.query(SampleModel)]
+            self.assertEqual(len(names), 8)
+            self.assertEqual(
+                len([n for n in names if n.startswith("batch_")]), 5)
+
+    def test_execute_step_default_process_batch(self):
+        with db.session_scope() as session:
+            session.add(SampleModel(name="Step1"))
+
+        with mock.patch("tests.steps.Step2.batch_size", 10):
+            run.execute_step(Step2, sync=True)
+
+        with db.session_scope() as session:
+            names = sorted(obj.name for obj in session.query(SampleModel))
+            self.assertEqual(names, ["Step2", "foo"])
+
+        with mock.patch("tests.steps.Step2.batch_size", 10), \
+                mock.patch("tests.steps.Step2.process_batch",
+                           return_value=[None]):
+            with db.session_scope() as session:
+                session.add(SampleModel(name="Step1"))
+            with self.assertRaises(TypeError):
+                run.execute_step(Step2, sync=True)
+
+    def test_execute_step_threads(self):
+        with db.session_scope() as session:
+            for idx in range(20):
+                session.add(SampleModel(name=None))
+
+        threads, savers = set(), set()
+        barrier = threading.Event()
+
+        def process(self, obj):
+            threads.add(threading.current_thread().ident)
+            # wait to have all the workers busy at the same time
+            barrier.wait(0.5 if len(threads) < 4 else 0)
+            barrier.set()
+            obj.name = "thread_{}".format(obj.id)
+            yield SampleModel(name="new_{}".format(obj.id))
+
+        def save(self, obj):
+            savers.add(threading.current_thread().ident)
+            self.session.add(obj)
+
+        with mock.patch("tests.steps.Step1.executor", "threads"), \
+                mock.patch("tests.steps.Step1.max_workers", 4), \
+                mock.patch("tests.steps.Step1.process", process), \
+                mock.patch("tests.steps.Step1.save", save):
+            runner = run.execute_step(Step1, sync=True)[0]
+
+        self.assertEqual(len(threads), 4)
+        self.assertEqual(savers, {threading.current_thread().ident})
+        self.assertEqual(runner.processed, 20)
+        self.assertEqual(runner.metrics.saved, 40)
+        self.assertEqual(sum(runner.metrics.process_latency), 20)
+        with db.session_scope() as session:
+            names = [obj.name for obj in session.query(SampleModel)]
+            self.assertEqual(len(names), 40)
+            self.assertEqual(
+                len([n for n in names if n.startswith("thread_")]), 20)
+
+    def test_execute_step_threads_error(self):
+        with db.session_scope() as session:
+            for idx in range(5):
+                session.add(SampleModel(name=None))
+
+        with mock.patch("tests.steps.Step1.executor", "threads"), \
+                mock.patch("tests.steps.Step1.process",
+                           side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                run.execute_step(Step1, sync=True)
+        with mock.patch("tests.steps.Step1.executor", "threads"), \
+                mock.patch("tests.steps.Step1.process", return_value=[None]):
+            with self.assertRaises(TypeError):
+                run.execute_step(Step1, sync=True)
+        with db.session_scope() as session:
+            self.assertEqual(
+                session.query(SampleModel).filter(
+                    SampleModel.name != None).count(), 0)  # noqa
+
+    def test_invalid_executor(self):
+        self.assertIsNone(Step1.get_executor())
+        with mock.patch("tests.steps.Step1.executor", "processes"):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                Step1.get_executor()
+        with mock.patch("tests.steps.Step1.executor", "threads"), \
+                mock.patch("tests.steps.Step1.batch_size", 10):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                Step1.get_executor()
+        with mock.patch("tests.steps.Step1.max_workers", 0):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                Step1.get_max_workers()
+
+    def test_execute_step_batch_uses_save(self):
+        with db.session_scope() as session:
+            session.add(SampleModel(name=None))
+
+        saved = []
+
+        def save(self, obj):
+            saved.append(obj.name)
+            self.session.add(obj)
+
+        with mock.patch("tests.steps.Step1.batch_size", 2), \
+                mock.patch("tests.steps.Step1.save", save):
+            run.execute_step(Step1, sync=True)
+        self.assertEqual(saved, ["Step1"])
+
+    def test_step_without_process(self):
+        class BatchStep(run.Step):
+
+            model = SampleModel
+            conditions = [SampleModel.name == None]  # noqa
+            batch_size = 10
+
+            def process_batch(self, objs):
+                for obj in objs:
+                    obj.name = "batch_{}".format(obj.id)
+
+        with db.session_scope() as session:
+            session.add(SampleModel(name=None))
+
+        # a step can define only process_batch
+        with mock.patch.object(BatchStep, "batch_size", None):
+            with self.assertRaises(NotImplementedError):
+                run.execute_step(BatchStep, sync=True)
+        run.execute_step(BatchStep, sync=True)
+        with db.session_scope() as session:
+            self.assertEqual(
+                session.query(SampleModel).filter(
+                    SampleModel.name.like("batch_%")).count(), 1)
+
+    def test_runner_processed(self):
+        with db.session_scope() as session:
+            session.add(SampleModel(name=None))
+        runner = run.execute_step(Step1, sync=True)[0]
+        self.assertEqual(runner.processed, 1)
+        runner = run.execute_step(Step1, sync=True)[0]
+        self.assertEqual(runner.processed, 0)
+
     def test_default_generate_without_model_or_conditions(self):
         with mock.patch("tests.steps.Step1.model", None):
             with self.assertRaises(NotImplementedError):
@@ -158,6 +744,192 @@ class TestStepFunctions(BaseTest):
                 run.execute_step(Step1, sync=True)
 
 
+@unittest.skipIf(sys.version_info < (3, 5), "requires async def")
+class TestAsyncStep(BaseTest):
+
+    def setUp(self):
+        from . import async_steps
+        self.steps = async_steps
+        with db.session_scope() as session:
+            for idx in range(10):
+                session.add(SampleModel(name="obj-{}".format(idx)))
+
+    def execute(self, step_cls, delay=0.05):
+        with self.steps.HTTPStandIn(delay) as server, \
+                mock.patch.object(step_cls, "port", server.port):
+            self.server = server
+            return run.execute_step(step_cls, sync=True)[0]
+
+    def names(self):
+        with db.session_scope() as session:
+            return sorted(obj.name for obj in session.query(SampleModel))
+
+    def test_execute(self):
+        runner = self.execute(self.steps.FetchStep)
+        self.assertIsInstance(runner, run.async_step.AsyncStepRunner)
+        self.assertEqual(runner.processed, 10)
+        self.assertEqual(runner.metrics.saved, 10)
+        self.assertEqual(sum(runner.metrics.process_latency), 10)
+        self.assertEqual(self.server.requests, 10)
+        self.assertEqual(self.server.max_active, 3)
+        self.assertEqual(
+            self.names(),
+            sorted("obj-{}-fetched".format(idx) for idx in range(10)))
+
+    def test_concurrency_overlaps_requests(self):
+        with mock.patch.object(self.steps.FetchStep, "concurrency", 10):
+            start = time.time()
+            self.execute(self.steps.FetchStep, delay=0.2)
+            elapsed = time.time() - start
+        self.assertEqual(self.server.max_active, 10)
+        self.assertLess(elapsed, 10 * 0.2)
+
+    def test_new_objects_and_commit_every(self):
+        with mock.patch.object(
+                self.steps.FetchAndCreateStep, "commit_every", 4):
+            runner = self.execute(self.steps.FetchAndCreateStep)
+        self.assertEqual(runner.metrics.saved, 20)
+        names = self.names()
+        self.assertEqual(len(names), 20)
+        self.assertIn("obj-0-fetched-new", names)
+        self.assertIn("obj-9-fetched", names)
+
+    def test_process_error(self):
+        with self.assertRaises(ValueError):
+            self.execute(self.steps.FailStep)
+        # the session of the failed step is rolled back
+        self.assertEqual(
+            self.names(), sorted("obj-{}".format(idx) for idx in range(10)))
+
+    def test_invalid_concurrency(self):
+        for concurrency in (None, 0, "2"):
+            with mock.patch.object(
+                    self.steps.FetchStep, "concurrency", concurrency):
+                with self.assertRaises(exceptions.ImproperlyConfigured):
+                    self.steps.FetchStep.get_concurrency()
+
+    def test_process_not_implemented(self):
+        with mock.patch.object(
+                self.steps.FetchStep, "process", run.AsyncStep.process):
+            with self.assertRaises(NotImplementedError):
+                self.execute(self.steps.FetchStep)
+
+
+class TestWatermark(BaseTest):
+
+    def setUp(self):
+        self.addCleanup(mock.patch.stopall)
+        mock.patch("tests.steps.Step1.watermark", SampleModel.id).start()
+        mock.patch("tests.steps.Step1.process", self.process).start()
+
+    def process(self, obj):
+        obj.name = "Step1_{}".format(obj.id)
+
+    def add(self, number):
+        with db.session_scope() as session:
+            objs = [SampleModel(name=None) for idx in range(number)]
+            session.add_all(objs)
+            session.commit()
+            return [obj.id for obj in objs]
+
+    def marks(self):
+        with db.session_scope() as session:
+            return [
+                (mark.processor_path, mark.column, mark.value)
+                for mark in session.query(Watermark)]
+
+    def test_incremental_generate(self):
+        ids = self.add(5)
+        runner = run.execute_step(Step1, sync=True)[0]
+        self.assertEqual(runner.processed, 5)
+        self.assertEqual(
+            self.marks(), [("tests.steps.Step1", "SampleModel.id", ids[-1])])
+
+        # an old row that match the conditions again is never generated
+        with db.session_scope() as session:
+            session.query(SampleModel).filter(
+                SampleModel.id == ids[0]).update({"name": None})
+        new_ids = self.add(3)
+        runner = run.execute_step(Step1, sync=True)[0]
+        self.assertEqual(runner.processed, 3)
+        self.assertEqual(self.marks()[0][2], new_ids[-1])
+
+        runner = run.execute_step(Step1, sync=True)[0]
+        self.assertEqual(runner.processed, 0)
+        self.assertEqual(self.marks()[0][2], new_ids[-1])
+
+    def test_other_column_mark_is_ignored(self):
+        self.add(2)
+        with db.session_scope() as session:
+            session.add(Watermark(
+                processor_path="tests.steps.Step1", proc_number=0, proc_n=1,
+                column="SampleModel.name", value=1000))
+        runner = run.execute_step(Step1, sync=True)[0]
+        self.assertEqual(runner.processed, 2)
+        self.assertEqual(self.marks()[0][1], "SampleModel.id")
+
+    def test_failed_run_keeps_mark(self):
+        ids = self.add(4)
+
+        def process(step, obj):
+            if obj.id == ids[3]:
+                raise ValueError()
+            self.process(obj)
+
+        with mock.patch("tests.steps.Step1.process", process):
+            with self.assertRaises(ValueError):
+                run.execute_step(Step1, sync=True)
+        self.assertEqual(self.marks(), [])
+
+        with mock.patch("tests.steps.Step1.process", process), \
+                mock.patch("tests.steps.Step1.commit_every", 2):
+            with self.assertRaises(ValueError):
+                run.execute_step(Step1, sync=True)
+        self.assertEqual(self.marks()[0][2], ids[1])
+
+    def test_tracker_out_of_order(self):
+        objs = [SampleModel(id=idx) for idx in (1, 2, 3)]
+        tracker = run.step.WatermarkTracker(SampleModel.id)
+        self.assertEqual(list(tracker.track(objs)), objs)
+        tracker.saved(objs[1])
+        tracker.saved(objs[2])
+        self.assertIsNone(tracker.advance())
+        tracker.saved(objs[0])
+        self.assertEqual(tracker.advance(), 3)
+        self.assertIsNone(tracker.advance())
+
+    def test_threads(self):
+        ids = self.add(10)
+        with mock.patch("tests.steps.Step1.executor", "threads"), \
+                mock.patch("tests.steps.Step1.max_workers", 3):
+            runner = run.execute_step(Step1, sync=True)[0]
+        self.assertEqual(runner.processed, 10)
+        self.assertEqual(self.marks()[0][2], ids[-1])
+
+    def test_invalid_watermark(self):
+        with mock.patch("tests.steps.Step1.watermark", "id"):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                Step1.get_watermark()
+        with mock.patch("tests.steps.Step1.watermark", SampleModel.name), \
+                mock.patch("tests.steps.Step1.commit_every", 10):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                Step1.get_watermark()
+        with mock.patch("tests.steps.Step1.watermark", Watermark.value):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                Step1.get_watermark()
+        with mock.patch("tests.steps.Step1.generate", return_value=[]):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                run.execute_step(Step1, sync=True)
+
+    def test_unique_watermark(self):
+        with mock.patch("tests.steps.Step1.watermark", SampleModel.name):
+            self.assertIs(Step1.get_watermark(), SampleModel.name)
+        pks = db.inspect(Watermark).primary_key
+        self.assertTrue(Step1.is_unique_column(Watermark.__table__.c.id, pks))
+        self.assertFalse(
+            Step1.is_unique_column(Watermark.__table__.c.proc_n, pks))
+
+
 class TestAlertFunctions(BaseTest):
 
     def test_groups(self):
@@ -166,7 +938,9 @@ class TestAlertFunctions(BaseTest):
             self.assertIn(group, groups)
 
         expected = ["A", "B", "C"]
+        self.addCleanup(run.alert.registry.clear)
         with mock.patch("tests.alerts.Alert1.groups", expected, create=True):
+            run.alert.registry.clear()
             groups = run.alerts_groups()
             self.assertCountEqual(groups, expected)
 
@@ -217,6 +991,118 @@ class TestAlertFunctions(BaseTest):
             self.assertEquals(alerted.model, sample)
             self.assertEquals(alerted.alert, Alert1)
 
+    def test_execute_alert_excludes_only_registered(self):
+        alert_to = Alert1.alert_to[0]
+        with db.session_scope() as session:
+            samples = [
+                SampleModel(name="catch_alert_{}".format(idx))
+                for idx in range(3)]
+            session.add_all(samples)
+            session.commit()
+            session.add(Alerted(
+                alert_path="tests.alerts.Alert1",
+                model_table=SampleModel.__table__.name,
+                model_key=str(samples[1].id)))
+            session.add(Alerted(
+                alert_path="tests.alerts.Alert2",
+                model_table=SampleModel.__table__.name,
+                model_key=str(samples[0].id)))
+            expected_key = str(samples[0].id)
+
+        with mock.patch("tests.alerts.Alert1.conditions",
+                        [SampleModel.name.like("catch_alert_%")]):
+            run.execute_alert(Alert1, sync=True)
+        self.assertEquals(
+            alert_to.fp.getvalue(), "catch_alert_0catch_alert_2")
+        with db.session_scope() as session:
+            keys = {
+                key for key, in session.query(Alerted.model_key).filter_by(
+                    alert_path="tests.alerts.Alert1")}
+            self.assertIn(expected_key, keys)
+            self.assertEqual(len(keys), 3)
+
+    def test_filter_auto_registered_in_database(self):
+        with db.session_scope() as session:
+            alert = Alert1(session)
+            sql = str(alert.generate().statement.compile(db.engine))
+        self.assertIn("NOT (EXISTS (SELECT", sql)
+        self.assertIn(Alerted.__tablename__, sql)
+
+    def test_alerted_model_key(self):
+        with db.session_scope() as session:
+            sample = SampleModel(name="catch_alert")
+            session.add(sample)
+            session.commit()
+            columns = Alerted.model_to_columns(sample)
+            self.assertEqual(columns, {
+                "model_table": SampleModel.__table__.name,
+                "model_key": str(sample.id)})
+
+            key = Alerted.model_class_to_key_expression(SampleModel)
+            found = session.query(SampleModel).filter(
+                key == columns["model_key"]).one()
+            self.assertIs(found, sample)
+
+    def test_alerted_key_types(self):
+        Base = db.declarative.declarative_base()
+
+        class FloatKey(Base):
+            __tablename__ = "float_key"
+            id = db.Column(db.Float, primary_key=True)
+
+        class CompositeKey(Base):
+            __tablename__ = "composite_key"
+            name = db.Column(db.String(50), primary_key=True)
+            number = db.Column(db.Integer, primary_key=True)
+
+        with self.assertRaises(exceptions.ImproperlyConfigured):
+            Alerted.model_class_to_key_expression(FloatKey)
+        with self.assertRaises(exceptions.ImproperlyConfigured):
+            Alerted.model_to_key(FloatKey(id=1.5))
+
+        # the separator is escaped in the composite keys
+        engine = db.create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        session = db.sessionmaker(bind=engine)()
+        objs = [
+            CompositeKey(name=u"a,1", number=2),
+            CompositeKey(name=u"a", number=12),
+            CompositeKey(name=u"a\\", number=3)]
+        session.add_all(objs)
+        session.commit()
+        key = Alerted.model_class_to_key_expression(CompositeKey)
+        for obj in objs:
+            model_key = Alerted.model_to_key(obj)
+            found = session.query(CompositeKey).filter(
+                key == model_key).one()
+            self.assertIs(found, obj)
+            self.assertEqual(
+                Alerted.key_to_values(CompositeKey, model_key),
+                (obj.name, obj.number))
+        with self.assertRaises(ValueError):
+            Alerted.key_to_values(CompositeKey, u"a\\,1")
+        self.assertEqual(
+            [Alerted.model_to_key(obj) for obj in objs],
+            [u"a\\,1,2", u"a,12", u"a\\\\,3"])
+        session.close()
+
+    def test_chunk_size(self):
+        self.assertIsNone(Alert1.get_chunk_size())
+        with mock.patch("tests.settings.ALERT_CHUNK_SIZE", 20,
+                        create=True):
+            self.assertEqual(Alert1.get_chunk_size(), 20)
+
+    def test_execute_alert_stream(self):
+        alert_to = Alert1.alert_to[0]
+        with db.session_scope() as session:
+            session.add(SampleModel(name="catch_alert"))
+
+        with mock.patch("tests.alerts.Alert1.chunk_size", 1):
+            run.execute_alert(Alert1, sync=True)
+        self.assertEquals(alert_to.fp.getvalue(), "catch_alert")
+        with db.session_scope() as session:
+            self.assertEqual(session.query(Alerted).count(), 1)
+
     def test_execute_alert_default_render(self):
         alert_to = Alert1.alert_to[0]
 
@@ -307,6 +1193,616 @@ class TestAlertFunctions(BaseTest):
             expected = (conf.settings.EMAIL["user"], to)
             self.assertEquals(actual, expected)
 
+    @mock.patch("smtplib.SMTP")
+    def test_email_endpoint_digest(self, smtp):
+        with db.session_scope() as session:
+            session.add_all([
+                SampleModel(name="catch_alert_{}".format(idx))
+                for idx in range(3)])
+
+        to = ["foo@faa.com"]
+        alert_to = ep.Email(to, message="obj {0.name}", digest=True)
+        with mock.patch("tests.alerts.Alert1.alert_to", [alert_to]), \
+                mock.patch("tests.alerts.Alert1.conditions",
+                           [SampleModel.name.like("catch_alert_%")]):
+            run.execute_alert(Alert1, sync=True)
+        self.assertEqual(alert_to.server.sendmail.call_count, 1)
+        sent_from, recipients, msg = alert_to.server.sendmail.call_args[0]
+        self.assertEqual(recipients, to)
+        for idx in range(3):
+            self.assertIn("obj catch_alert_{}".format(idx), msg)
+
+    def test_execute_alert_batch(self):
+        alert_to = Alert1.alert_to[0]
+        with db.session_scope() as session:
+            session.add_all([
+                SampleModel(name="catch_alert_{}".format(idx))
+                for idx in range(5)])
+
+        with mock.patch("tests.alerts.Alert1.conditions",
+                        [SampleModel.name.like("catch_alert_%")]), \
+                mock.patch("tests.alerts.Alert1.batch_size", 2), \
+                mock.patch.object(alert_to, "process_batch",
+                                  wraps=alert_to.process_batch) as batch:
+            runner = run.execute_alert(Alert1, sync=True)[0]
+        self.assertEqual(
+            [len(call[0][0]) for call in batch.call_args_list], [2, 2, 1])
+        self.assertEqual(runner.processed, 5)
+        self.assertEqual(
+            alert_to.fp.getvalue(),
+            "".join("catch_alert_{}".format(idx) for idx in range(5)))
+        with db.session_scope() as session:
+            self.assertEqual(session.query(Alerted).count(), 5)
+
+    def test_execute_alert_delivery_workers(self):
+        alert_to = Alert1.alert_to[0]
+        with db.session_scope() as session:
+            session.add_all([
+                SampleModel(name="catch_alert_{}".format(idx))
+                for idx in range(5)])
+
+        with mock.patch("tests.alerts.Alert1.conditions",
+                        [SampleModel.name.like("catch_alert_%")]), \
+                mock.patch("tests.alerts.Alert1.delivery_workers", 2):
+            run.execute_alert(Alert1, sync=True)
+        self.assertEqual(
+            alert_to.fp.getvalue(),
+            "".join("catch_alert_{}".format(idx) for idx in range(5)))
+
+    def test_execute_alert_delivery_error(self):
+        with db.session_scope() as session:
+            session.add(SampleModel(name="catch_alert"))
+
+        alert_to = mock.MagicMock(background=True)
+        alert_to.deliver.side_effect = ValueError
+        with mock.patch("tests.alerts.Alert1.alert_to", [alert_to]), \
+                mock.patch("tests.alerts.Alert1.delivery_workers", 1):
+            with self.assertRaises(ValueError):
+                run.execute_alert(Alert1, sync=True)
+        self.assertFalse(alert_to.flush.called)
+        self.assertTrue(alert_to.teardown.called)
+        # the objects are registered only if all the deliveries succeed
+        with db.session_scope() as session:
+            self.assertEqual(session.query(Alerted).count(), 0)
+
+    def test_execute_alert_delivery_workers_only_get_payloads(self):
+        with db.session_scope() as session:
+            session.add_all([
+                SampleModel(name="catch_alert_{}".format(idx))
+                for idx in range(3)])
+
+        main_thread = threading.current_thread()
+        rendered, delivered = [], []
+
+        def render_alert(self, utcnow, endpoint, obj):
+            rendered.append(threading.current_thread())
+            return obj.name
+
+        background = ep.File(ep.File.MEMORY)
+        background.deliver = lambda payload: delivered.append(
+            (threading.current_thread(), payload))
+        foreground = mock.MagicMock(background=False)
+        with mock.patch("tests.alerts.Alert1.alert_to",
+                        [background, foreground]), \
+                mock.patch("tests.alerts.Alert1.conditions",
+                           [SampleModel.name.like("catch_alert_%")]), \
+                mock.patch("tests.alerts.Alert1.render_alert", render_alert), \
+                mock.patch("tests.alerts.Alert1.batch_size", 3), \
+                mock.patch("tests.alerts.Alert1.delivery_workers", 1):
+            run.execute_alert(Alert1, sync=True)
+
+        self.assertEqual(set(rendered), {main_thread})
+        self.assertEqual(len(delivered), 1)
+        thread, payload = delivered[0]
+        self.assertIsNot(thread, main_thread)
+        self.assertEqual(
+            payload, "catch_alert_0catch_alert_1catch_alert_2")
+        self.assertEqual(foreground.process_batch.call_count, 1)
+        self.assertFalse(foreground.deliver.called)
+
+
+class TestMetrics(BaseTest):
+
+    def test_step_run_recorded(self):
+        with db.session_scope() as session:
+            session.add(SampleModel())
+
+        run.execute_step(Step1, sync=True)
+        with db.session_scope() as session:
+            record = session.query(ProcessorRun).one()
+            self.assertEqual(record.processor_path, "tests.steps.Step1")
+            self.assertEqual(record.processor_type, "step")
+            self.assertEqual(
+                (record.proc_number, record.proc_n), (0, 1))
+            self.assertEqual(record.generated, 1)
+            self.assertEqual(record.saved, 1)
+            self.assertEqual(record.exitcode, 0)
+            self.assertGreaterEqual(record.wall_time, record.process_time)
+            self.assertGreater(record.commit_time, 0)
+            self.assertGreater(record.peak_rss, 0)
+
+    def test_loader_and_alert_run_recorded(self):
+        run.execute_loader(TestLoader, sync=True)
+        with mock.patch("tests.alerts.Alert1.conditions",
+                        [SampleModel.name == "foo"]):
+            run.execute_alert(Alert1, sync=True)
+        with db.session_scope() as session:
+            records = {
+                r.processor_type: (r.generated, r.saved)
+                for r in session.query(ProcessorRun)}
+        self.assertEqual(records, {"loader": (1, 1), "alert": (1, 1)})
+
+    def test_failed_run_recorded(self):
+        with mock.patch("tests.steps.TestLoader.generate",
+                        return_value=[None]):
+            with self.assertRaises(TypeError):
+                run.execute_loader(TestLoader, sync=True)
+        with db.session_scope() as session:
+            record = session.query(ProcessorRun).one()
+            self.assertEqual(record.exitcode, 1)
+
+    def test_record_runs_disabled(self):
+        with mock.patch("tests.settings.RECORD_RUNS", False, create=True):
+            run.execute_loader(TestLoader, sync=True)
+        with db.session_scope() as session:
+            self.assertEqual(session.query(ProcessorRun).count(), 0)
+
+    def test_record_error_is_logged(self):
+        with mock.patch("corral.run.metrics.ProcessorRun",
+                        side_effect=ValueError("foo")), \
+                mock.patch("corral.run.metrics.logger") as logger:
+            run.execute_loader(TestLoader, sync=True)
+        self.assertTrue(logger.warning.called)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(run.metrics.percentile(values, 50), 50)
+        self.assertEqual(run.metrics.percentile(values, 95), 95)
+        self.assertEqual(run.metrics.percentile(values, 100), 100)
+        self.assertEqual(run.metrics.percentile([3], 99), 3)
+        self.assertIsNone(run.metrics.percentile([], 50))
+
+    def test_summarize(self):
+        now = datetime.datetime.utcnow()
+        runs = [
+            ProcessorRun(started_at=now, wall_time=2., generated=10,
+                         saved=5, exitcode=0, peak_rss=10),
+            ProcessorRun(started_at=now, wall_time=3., generated=40,
+                         saved=5, exitcode=1, peak_rss=20)]
+        summary = run.metrics.summarize(runs)
+        self.assertEqual(summary["runs"], 2)
+        self.assertEqual(summary["failures"], 1)
+        self.assertEqual(summary["throughput"], 10.)
+        self.assertEqual(summary["p50"], 2.)
+        self.assertEqual(summary["p99"], 3.)
+        self.assertEqual(summary["peak_rss"], 20)
+
+
+class PipeRunner(run.step.StepRunner):
+
+    def run(self):
+        with self.measure() as metrics:
+            metrics.generated = 3
+
+
+class TestExposition(BaseTest):
+
+    def snapshot(self, **kwargs):
+        snapshot = run.metrics.RunMetrics(Step1).snapshot()
+        snapshot.update(wall_time=1., process_time=0.5, exitcode=0,
+                        peak_rss=2, generated=4, saved=3)
+        snapshot["process_latency"][0] = 4
+        snapshot.update(kwargs)
+        return snapshot
+
+    def test_collect_metrics_sync(self):
+        with db.session_scope() as session:
+            session.add(SampleModel())
+        procs = run.execute_step(Step1, sync=True)
+        snapshot = procs[0].collect_metrics()
+        self.assertEqual(snapshot["generated"], 1)
+        self.assertEqual(snapshot["commits"], 1)
+        self.assertGreater(snapshot["db_time"], 0)
+        self.assertEqual(sum(snapshot["process_latency"]), 1)
+
+    def test_collect_metrics_from_process(self):
+        runner = PipeRunner()
+        runner.setup(Step1)
+        self.assertIsNone(runner.collect_metrics())
+        with mock.patch("tests.settings.RECORD_RUNS", False, create=True):
+            runner.start()
+            runner.join()
+        self.assertEqual(runner.exitcode, 0)
+        self.assertEqual(runner.collect_metrics()["generated"], 3)
+
+    def test_render(self):
+        registry = run.exposition.MetricsRegistry()
+        registry.observe(self.snapshot())
+        registry.observe(self.snapshot(exitcode=1))
+        registry.observe(None)
+        text = registry.render()
+        labels = 'processor="tests.steps.Step1",type="step"'
+        self.assertIn("# TYPE corral_runs counter", text)
+        self.assertIn("corral_runs_total{" + labels + "} 2", text)
+        self.assertIn("corral_run_failures_total{" + labels + "} 1", text)
+        self.assertIn(
+            "corral_objects_processed_total{" + labels + "} 8", text)
+        self.assertIn("corral_objects_saved_total{" + labels + "} 6", text)
+        self.assertIn(
+            "corral_last_run_peak_rss_bytes{" + labels + "} 2048", text)
+        self.assertIn("# TYPE corral_process_latency_seconds histogram", text)
+        self.assertIn(
+            'corral_process_latency_seconds_bucket{' + labels +
+            ',le="0.0001"} 8', text)
+        self.assertIn(
+            'corral_process_latency_seconds_bucket{' + labels +
+            ',le="+Inf"} 8', text)
+        self.assertIn(
+            "corral_process_latency_seconds_count{" + labels + "} 8", text)
+        self.assertIn(
+            "corral_process_latency_seconds_sum{" + labels + "} 1.0", text)
+        self.assertTrue(text.endswith("# EOF\n"))
+
+        registry.clear()
+        self.assertEqual(
+            registry.render().count("corral_runs_total"), 0)
+
+    def test_write(self):
+        registry = run.exposition.MetricsRegistry()
+        registry.observe(self.snapshot())
+        path = os.path.join(TEMP_DIR, "metrics.prom")
+        registry.write(path)
+        with open(path) as fp:
+            self.assertEqual(fp.read(), registry.render())
+        self.assertEqual(
+            [fname for fname in os.listdir(TEMP_DIR)
+             if fname.endswith(".tmp")], [])
+
+    def test_observe(self):
+        registry = run.exposition.MetricsRegistry()
+        proc = mock.MagicMock()
+        proc.collect_metrics.return_value = self.snapshot()
+        path = os.path.join(TEMP_DIR, "observed.prom")
+        with mock.patch("tests.settings.METRICS_FILE", path, create=True):
+            run.exposition.observe([proc, object()], registry=registry)
+        with open(path) as fp:
+            self.assertIn("corral_runs_total", fp.read())
+
+    def test_observe_write_error_is_logged(self):
+        path = os.path.join(TEMP_DIR, "not-exists", "metrics.prom")
+        with mock.patch("tests.settings.METRICS_FILE", path, create=True), \
+                mock.patch("corral.run.exposition.logger") as logger:
+            run.exposition.observe(
+                [], registry=run.exposition.MetricsRegistry())
+        self.assertTrue(logger.warning.called)
+
+    def test_http_server(self):
+        registry = run.exposition.MetricsRegistry()
+        registry.observe(self.snapshot())
+        server = run.exposition.start_http_server(
+            0, addr="127.0.0.1", registry=registry)
+        try:
+            url = "http://127.0.0.1:{}/metrics".format(
+                server.server_address[1])
+            response = six.moves.urllib.request.urlopen(url)
+            self.assertEqual(
+                response.headers["Content-Type"],
+                run.exposition.CONTENT_TYPE)
+            self.assertEqual(
+                response.read().decode("utf-8"), registry.render())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestProfiling(BaseTest):
+
+    def setUp(self):
+        super(TestProfiling, self).setUp()
+        self.directory = tempfile.mkdtemp(dir=TEMP_DIR)
+
+    def env(self, **kwargs):
+        env = {run.profiling.PROFILE_DIR_ENV: self.directory}
+        env.update(kwargs)
+        return mock.patch.dict("os.environ", env)
+
+    def test_disabled(self):
+        run.execute_step(Step1, sync=True)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_profile_runner(self):
+        with self.env():
+            run.execute_step(Step1, sync=True)
+        expected = "tests.steps.Step1-0-{}.prof".format(os.getpid())
+        self.assertEqual(os.listdir(self.directory), [expected])
+        stats = pstats.Stats(os.path.join(self.directory, expected))
+        self.assertTrue(any(
+            func[2] == "generate" for func in stats.stats))
+
+    def test_sampler(self):
+        env = {run.profiling.SAMPLE_INTERVAL_ENV: "0.001"}
+        with self.env(**env):
+            run.execute_step(Step1, sync=True)
+        self.assertEqual(
+            sorted(os.path.splitext(f)[1]
+                   for f in os.listdir(self.directory)),
+            [".folded", ".prof"])
+
+    def test_sampler_stacks(self):
+        sampler = run.profiling.Sampler()
+        sampler._sample(signal.SIGPROF, sys._getframe())
+        sampler._sample(signal.SIGPROF, sys._getframe())
+        (stack, count), = sampler.samples.items()
+        self.assertTrue(stack.endswith(":test_sampler_stacks"))
+        self.assertEqual(count, 2)
+
+    def test_merge_profiles(self):
+        with self.env():
+            run.execute_step(Step1, sync=True)
+            run.execute_loader(TestLoader, sync=True)
+        out = os.path.join(self.directory, "merged.out")
+        self.assertEqual(run.profiling.merge_profiles(self.directory, out), 2)
+        functions = {func[2] for func in pstats.Stats(out).stats}
+        self.assertIn("generate", functions)
+        self.assertIn("setup", functions)
+
+        empty = tempfile.mkdtemp(dir=TEMP_DIR)
+        self.assertEqual(run.profiling.merge_profiles(empty, out), 0)
+
+    def test_merge_samples(self):
+        for fname, content in (("a.folded", "a;b 2\na;c 1\n"),
+                               ("b.folded", "a;b 3\n")):
+            with open(os.path.join(self.directory, fname), "w") as fp:
+                fp.write(content)
+        out = os.path.join(TEMP_DIR, "merged.folded")
+        self.assertEqual(run.profiling.merge_samples(self.directory, out), 2)
+        with open(out) as fp:
+            self.assertEqual(fp.read(), "a;b 5\na;c 1\n")
+
+
+class FakeProc(object):
+
+    def __init__(self, exitcode=0, polls=1):
+        self._exitcode = exitcode
+        self._polls = polls
+
+    @property
+    def exitcode(self):
+        if self._polls:
+            self._polls -= 1
+            return None
+        return self._exitcode
+
+    def join(self):
+        self._polls = 0
+
+
+class TestScheduler(BaseTest):
+
+    def test_dag_without_dependencies(self):
+        dag = run.processors_dag([TestLoader, Step1, Step2, Alert1])
+        self.assertEqual(list(dag.keys()), [TestLoader, Step1, Step2, Alert1])
+        self.assertTrue(all(not v for v in dag.values()))
+
+    def test_dag_depends_on_and_consumes(self):
+        with mock.patch("tests.steps.Step1.depends_on", ["TestLoader"]), \
+                mock.patch("tests.steps.Step2.depends_on",
+                           ["tests.steps.Step1"]), \
+                mock.patch("tests.steps.Step2.produces", [SampleModel]), \
+                mock.patch("tests.alerts.Alert1.consumes", [SampleModel]):
+            dag = run.processors_dag([TestLoader, Step1, Step2, Alert1])
+        self.assertEqual(dag[TestLoader], set())
+        self.assertEqual(dag[Step1], {TestLoader})
+        self.assertEqual(dag[Step2], {Step1})
+        self.assertEqual(dag[Alert1], {Step2})
+
+    def test_dag_cycle(self):
+        with mock.patch("tests.steps.Step1.depends_on", [Step2]), \
+                mock.patch("tests.steps.Step2.depends_on", [Step1]):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                run.processors_dag([Step1, Step2])
+
+    def test_schedule_order(self):
+        started, finished = [], []
+
+        def execute(proc_cls):
+            started.append((proc_cls, tuple(finished)))
+            proc = FakeProc(polls=2)
+            finished.append(proc_cls)
+            return [proc]
+
+        with mock.patch("tests.steps.Step1.depends_on", [TestLoader]), \
+                mock.patch("tests.alerts.Alert1.depends_on", [Step1]):
+            exitcodes = run.schedule(
+                [TestLoader, Step1, Step2, Alert1], execute,
+                poll_interval=0)
+
+        self.assertEqual(exitcodes, [0, 0, 0, 0])
+        started_cls = [cls for cls, _ in started]
+        self.assertLess(
+            started_cls.index(TestLoader), started_cls.index(Step1))
+        self.assertLess(started_cls.index(Step1), started_cls.index(Alert1))
+        # Step2 has not dependencies so starts with the loader
+        self.assertEqual(started_cls[:2], [TestLoader, Step2])
+
+    def test_schedule_max_workers(self):
+        running, max_running = [], [0]
+
+        class Proc(FakeProc):
+            def join(self):
+                running.remove(self)
+
+        def execute(proc_cls):
+            proc = Proc(polls=1)
+            running.append(proc)
+            max_running[0] = max(max_running[0], len(running))
+            return [proc]
+
+        run.schedule(
+            [TestLoader, Step1, Step2, Alert1], execute,
+            max_workers=2, poll_interval=0)
+        self.assertEqual(max_running[0], 2)
+
+    def test_schedule_skip_failed_dependencies(self):
+        executed = []
+
+        def execute(proc_cls):
+            executed.append(proc_cls)
+            return [FakeProc(exitcode=int(proc_cls is TestLoader))]
+
+        with mock.patch("tests.steps.Step1.depends_on", [TestLoader]), \
+                mock.patch("tests.alerts.Alert1.depends_on", [Step1]):
+            exitcodes = run.schedule(
+                [TestLoader, Step1, Step2, Alert1], execute,
+                poll_interval=0)
+
+        self.assertEqual(executed, [TestLoader, Step2])
+        self.assertEqual(exitcodes, [1, 0])
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestDaemon(BaseTest):
+
+    def test_next_interval(self):
+        from corral.run import daemon
+        self.assertEqual(daemon.next_interval(8, 1, 1, 60, 2), 1)
+        self.assertEqual(daemon.next_interval(8, 0, 1, 60, 2), 16)
+        self.assertEqual(daemon.next_interval(40, 0, 1, 60, 2), 60)
+        self.assertEqual(daemon.next_interval(0, 0, 1, 60, 2), 2)
+
+    def test_serve_backoff(self):
+        executions = {Step1: [], Step2: []}
+        clock = FakeClock()
+
+        def execute(proc_cls):
+            executions[proc_cls].append(clock.now)
+            proc = FakeProc(exitcode=0, polls=0)
+            proc.processed = int(proc_cls is Step1)
+            return [proc]
+
+        with mock.patch("corral.run.daemon.time", clock):
+            failures = run.serve(
+                [Step1, Step2], execute, min_interval=1, max_interval=8,
+                should_stop=lambda: clock.now >= 30, poll_interval=0.5)
+
+        self.assertEqual(failures, 0)
+        # Step1 always process something
+        self.assertGreater(len(executions[Step1]), 20)
+        # Step2 waits 2, 4, 8, 8, 8... seconds
+        step2 = executions[Step2]
+        waits = [round(b - a) for a, b in zip(step2, step2[1:])]
+        self.assertEqual(waits[:4], [2, 4, 8, 8])
+
+    def test_serve_failures_and_stop(self):
+        calls = []
+
+        def execute(proc_cls):
+            calls.append(proc_cls)
+            proc = FakeProc(exitcode=1, polls=3)
+            proc.processed = 0
+            return [proc]
+
+        failures = run.serve(
+            [Step1], execute, should_stop=lambda: bool(calls),
+            poll_interval=0)
+        self.assertEqual(calls, [Step1])
+        self.assertEqual(failures, 1)
+
+
+class FakeAsyncResult(object):
+
+    def __init__(self, value=None, error=None, ready=True):
+        self.value, self.error, self._ready = value, error, ready
+        self.waited = False
+
+    def ready(self):
+        return self._ready
+
+    def get(self):
+        if self.error:
+            raise self.error
+        return self.value
+
+    def wait(self, timeout=None):
+        self.waited = True
+
+
+class TestPool(BaseTest):
+
+    def test_run_processor(self):
+        from corral.run import pool
+        with db.session_scope() as session:
+            session.add(SampleModel(name=None))
+        exitcode, processed, snapshot = pool.run_processor(Step1)
+        self.assertEqual((exitcode, processed), (0, 1))
+        self.assertEqual(snapshot["generated"], 1)
+        with mock.patch("tests.steps.Step1.generate",
+                        side_effect=ValueError):
+            with mock.patch("corral.run.pool.logger"):
+                exitcode, processed, snapshot = pool.run_processor(Step1)
+        self.assertEqual((exitcode, processed), (1, 0))
+        self.assertEqual(snapshot["exitcode"], 1)
+
+    def test_pool_task(self):
+        from corral.run import pool
+        task = pool.PoolTask(Step1, FakeAsyncResult(ready=False))
+        self.assertIsNone(task.exitcode)
+        self.assertEqual(task.processed, 0)
+        task.join()
+        self.assertTrue(task._result.waited)
+
+        self.assertIsNone(task.collect_metrics())
+
+        task = pool.PoolTask(
+            Step1, FakeAsyncResult(value=(0, 10, {"generated": 10})))
+        self.assertEqual(task.exitcode, 0)
+        self.assertEqual(task.processed, 10)
+        self.assertEqual(task.collect_metrics(), {"generated": 10})
+
+        task = pool.PoolTask(Step1, FakeAsyncResult(error=ValueError()))
+        self.assertEqual(task.exitcode, 1)
+        self.assertIsNone(task.collect_metrics())
+
+    def test_processor_pool(self):
+        from corral.run import pool
+        with mock.patch("multiprocessing.Pool") as mpool, \
+                mock.patch("corral.db.engine"):
+            with run.ProcessorPool(2) as ppool:
+                task = ppool.submit(Step1, 1, 2)
+            self.assertEqual(mpool.call_args[0], (2,))
+            mpool.return_value.apply_async.assert_called_once_with(
+                pool.run_processor, (Step1, 1, 2))
+            self.assertIs(task.target, Step1)
+            self.assertTrue(mpool.return_value.close.called)
+
+            with self.assertRaises(ValueError):
+                with run.ProcessorPool(2):
+                    raise ValueError()
+            self.assertTrue(mpool.return_value.terminate.called)
+
+    def test_execute_with_pool(self):
+        ppool = mock.MagicMock()
+        procs = run.execute_step(Step1, procno=2, pool=ppool)
+        self.assertEqual(len(procs), 2)
+        ppool.submit.assert_has_calls(
+            [mock.call(Step1, 0, 2), mock.call(Step1, 1, 2)])
+
+        run.execute_alert(Alert1, pool=ppool)
+        ppool.submit.assert_called_with(Alert1)
+        run.execute_loader(TestLoader, pool=ppool)
+        ppool.submit.assert_called_with(TestLoader)
+
 
 class EmailEndpoint(BaseTest):
 
@@ -326,11 +1822,257 @@ class EmailEndpoint(BaseTest):
         self.assertEquals(
             ep.Email([""], subject="foo").get_subject(None), "foo")
 
+    def test_subject_by_object(self):
+        class ObjEmail(ep.Email):
+            def get_subject(self, obj):
+                return "alert {}".format(obj.name)
+
+        email = ObjEmail(["foo@faa.com"])
+        with mock.patch("corral.run.endpoints.smtp_pool"):
+            email.setup(Alert1(None))
+        self.assertEqual(
+            email.prepare([SampleModel(name="foo")])[0][2], "alert foo")
+        email.teardown(None, None, None)
+
     def test_message(self):
         self.assertEquals(
             ep.Email([""], message="foo - {}").get_message("faa"), "foo - faa")
 
 
+class DeliveryQueue(BaseTest):
+
+    def test_order_by_endpoint(self):
+        delivered = {"a": [], "b": []}
+
+        class Endpoint(object):
+            def __init__(self, name):
+                self.name = name
+
+            def deliver(self, payload):
+                delivered[self.name].extend(payload)
+
+        endpoints = [Endpoint("a"), Endpoint("b")]
+        delivery = ep.DeliveryQueue(2, maxsize=1)
+        for idx in range(10):
+            for endpoint in endpoints:
+                delivery.put(endpoint, [idx])
+        delivery.join()
+        self.assertEqual(delivered, {"a": list(range(10)),
+                                     "b": list(range(10))})
+
+    def test_error(self):
+        endpoint = mock.MagicMock()
+        endpoint.deliver.side_effect = [ValueError, None]
+        delivery = ep.DeliveryQueue(1)
+        delivery.put(endpoint, [1])
+        delivery.put(endpoint, [2])
+        with self.assertRaises(ValueError):
+            delivery.join()
+        self.assertEqual(endpoint.deliver.call_count, 1)
+
+
+class SMTPPool(BaseTest):
+
+    settings = {"server": "localhost:25", "tls": True,
+                "user": "foo", "password": "secret"}
+
+    @mock.patch("smtplib.SMTP")
+    def test_reuse(self, smtp):
+        smtp.return_value.noop.return_value = (250, b"OK")
+        pool = ep.SMTPPool()
+        server = pool.acquire(self.settings)
+        server.starttls.assert_called_once_with()
+        server.login.assert_called_once_with("foo", "secret")
+        pool.release(self.settings, server)
+        self.assertIs(pool.acquire(self.settings), server)
+        self.assertEqual(smtp.call_count, 1)
+        server.noop.assert_called_once_with()
+
+        other = dict(self.settings, server="otherhost:25")
+        pool.acquire(other)
+        self.assertEqual(smtp.call_count, 2)
+
+    @mock.patch("smtplib.SMTP")
+    def test_reconnect_dead(self, smtp):
+        dead, alive = mock.MagicMock(), mock.MagicMock()
+        dead.noop.side_effect = ep.smtplib.SMTPServerDisconnected
+        smtp.side_effect = [dead, alive]
+        pool = ep.SMTPPool()
+        pool.release(self.settings, pool.acquire(self.settings))
+        self.assertIs(pool.acquire(self.settings), alive)
+        dead.quit.assert_called_once_with()
+
+    @mock.patch("smtplib.SMTP")
+    def test_check_after_and_max_idle(self, smtp):
+        smtp.side_effect = lambda *args: mock.MagicMock()
+        pool = ep.SMTPPool(check_after=60)
+        server = pool.acquire(self.settings)
+        pool.release(self.settings, server)
+        self.assertIs(pool.acquire(self.settings), server)
+        self.assertFalse(server.noop.called)
+
+        pool = ep.SMTPPool(max_idle=0)
+        server = pool.acquire(self.settings)
+        pool.release(self.settings, server)
+        with mock.patch("time.time", return_value=ep.time.time() + 1):
+            self.assertIsNot(pool.acquire(self.settings), server)
+        server.quit.assert_called_once_with()
+
+    @mock.patch("smtplib.SMTP")
+    def test_fork(self, smtp):
+        smtp.side_effect = lambda *args: mock.MagicMock()
+        pool = ep.SMTPPool()
+        server = pool.acquire(self.settings)
+        pool.release(self.settings, server)
+        with mock.patch("os.getpid", return_value=-1):
+            self.assertIsNot(pool.acquire(self.settings), server)
+        self.assertFalse(server.quit.called)
+
+    @mock.patch("smtplib.SMTP")
+    def test_close(self, smtp):
+        smtp.side_effect = lambda *args: mock.MagicMock()
+        pool = ep.SMTPPool()
+        server = pool.acquire(self.settings)
+        pool.release(self.settings, server)
+        pool.close()
+        server.quit.assert_called_once_with()
+        self.assertIsNot(pool.acquire(self.settings), server)
+
+    @mock.patch("smtplib.SMTP")
+    def test_email_resend_on_disconnect(self, smtp):
+        broken, fresh = mock.MagicMock(), mock.MagicMock()
+        broken.sendmail.side_effect = ep.smtplib.SMTPServerDisconnected
+        smtp.side_effect = [broken, fresh]
+        email = ep.Email(["foo@faa.com"], subject="foo", message="{}")
+        with mock.patch("corral.run.endpoints.smtp_pool", ep.SMTPPool()):
+            email.setup(Alert1)
+            email.process("faa")
+            email.teardown(None, None, None)
+        broken.close.assert_called_once_with()
+        self.assertEqual(fresh.sendmail.call_count, 1)
+
+    def test_local_server(self):
+        try:
+            smtpd = __import__("smtpd")
+            asyncore = __import__("asyncore")
+        except ImportError:
+            raise unittest.SkipTest("smtpd is not available")
+
+        received = []
+
+        class Server(smtpd.SMTPServer):
+            def process_message(self, peer, mailfrom, rcpttos, data,
+                                **kwargs):
+                received.append((mailfrom, rcpttos))
+
+        server = Server(("127.0.0.1", 0), None)
+        host, port = server.socket.getsockname()
+        thread = threading.Thread(
+            target=asyncore.loop, kwargs={"timeout": 0.05})
+        thread.daemon = True
+        thread.start()
+
+        settings = {"server": "{}:{}".format(host, port), "tls": False,
+                    "user": "foo@faa.com", "password": None}
+        pool = ep.SMTPPool()
+        try:
+            with mock.patch.dict(conf.settings.EMAIL, settings), \
+                    mock.patch("corral.run.endpoints.smtp_pool", pool):
+                for idx in range(2):
+                    email = ep.Email(["to@faa.com"], subject="foo",
+                                     message="{}")
+                    email.setup(Alert1)
+                    email.process(idx)
+                    email.teardown(None, None, None)
+                    if not idx:
+                        first = email.server
+                self.assertIs(email.server, first)
+        finally:
+            pool.close()
+            server.close()
+            thread.join()
+        self.assertEqual(
+            received, [("foo@faa.com", ["to@faa.com"])] * 2)
+
+
+class Templates(BaseTest):
+
+    def test_format_template(self):
+        template = run.templates.FormatTemplate(
+            "[{project_name}] {{{}}} {obj.name!r:>8} {now}",
+            project_name="a{b}")
+        self.assertEqual(template.fields, {"0", "obj", "now"})
+        self.assertEqual(
+            template.compiled, "[a{{b}}] {{{0}}} {obj.name!r:>8} {now}")
+        obj = SampleModel(name="foo")
+        self.assertEqual(
+            template.render(obj, now="today"),
+            "[a{{b}}] {{{}}}    'foo' today".format(obj))
+
+    def test_format_template_nested_spec(self):
+        for source in ("{obj.name:{width}}", "{x:>{width}}"):
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                run.templates.FormatTemplate(source, x=1, width=3)
+
+    def test_format_template_check(self):
+        template = run.templates.FormatTemplate(
+            "{project_name} {} {obj.name} {now}", project_name="foo")
+        template.check(("now",))
+        with self.assertRaises(exceptions.ImproperlyConfigured):
+            template.check()
+        with self.assertRaises(exceptions.ImproperlyConfigured):
+            run.templates.FormatTemplate("{1}").check()
+        run.templates.JinjaTemplate("{{ unknown }}").check()
+
+        with mock.patch("tests.alerts.Alert1.alert_template", "{nme}"):
+            alert = Alert1(None)
+            with self.assertRaises(exceptions.ImproperlyConfigured):
+                alert.setup()
+
+    def test_jinja_template(self):
+        template = run.templates.JinjaTemplate(
+            "{{ project_name }}: {{ obj.name }} {{ now }}",
+            project_name="foo")
+        self.assertEqual(
+            template.render(SampleModel(name="faa"), now="today"),
+            "foo: faa today")
+
+    def test_compile_template(self):
+        compiled = run.templates.compile_template("{x}", x=1)
+        self.assertIsInstance(compiled, run.templates.FormatTemplate)
+        self.assertEqual(compiled.render(None), "1")
+
+        jinja = run.templates.JinjaTemplate("{{ x }}{{ y }}", y=2)
+        compiled = run.templates.compile_template(jinja, x=1)
+        self.assertIsNot(compiled, jinja)
+        self.assertEqual(compiled.render(None), "12")
+
+    def test_alert_template(self):
+        alert = Alert1(None)
+        now = datetime.datetime.utcnow()
+        with mock.patch("corral.run.alert.conf") as mconf:
+            mconf.PACKAGE = "foo"
+            alert.setup()
+            mconf.PACKAGE = "changed"
+            rendered = run.Alert.render_alert(alert, now, None, "obj")
+        alert.teardown(None, None, None)
+        self.assertEqual(rendered, run.alert.ALERT_TEMPLATE.format(
+            project_name="foo", now=now.isoformat(), obj="obj"))
+
+        jinja = run.templates.JinjaTemplate("{{ project_name }} {{ obj }}")
+        with mock.patch("tests.alerts.Alert1.alert_template", jinja):
+            alert = Alert1(None)
+            self.assertEqual(
+                run.Alert.render_alert(alert, now, None, "obj"),
+                "{} obj".format(conf.PACKAGE))
+
+    def test_email_message_template(self):
+        jinja = run.templates.JinjaTemplate("obj {{ obj.name }}")
+        email = ep.Email([""], message=jinja)
+        self.assertEqual(
+            email.get_message(SampleModel(name="foo")), "obj foo")
+
+
 class FileEndpoint(BaseTest):
 
     def test_memory(self):
@@ -345,6 +2087,103 @@ class FileEndpoint(BaseTest):
         codecs_open.assert_called_once_with("foo", "a", "utf8")
         f.teardown(None, None, None)
 
+    @mock.patch("codecs.open")
+    def test_file_buffering(self, codecs_open):
+        f = ep.File("foo", buffering=1024)
+        f.setup(None)
+        codecs_open.assert_called_once_with(
+            "foo", "a", "utf8", buffering=1024)
+        f.teardown(None, None, None)
+
+    def _file_endpoint(self, **kwargs):
+        path = os.path.join(tempfile.mkdtemp(dir=TEMP_DIR), "alerts.log")
+        f = ep.File(path, **kwargs)
+        f.setup(Alert1(None))
+        f.render_alert = lambda obj: "{}\n".format(obj)
+        return path, f
+
+    def test_rotate_by_size(self):
+        path, f = self._file_endpoint(max_bytes=4)
+        for idx in range(3):
+            f.process("ab{}".format(idx))
+        f.teardown(None, None, None)
+
+        dirname = os.path.dirname(path)
+        rotated = sorted(
+            fn for fn in os.listdir(dirname) if fn != "alerts.log")
+        self.assertEqual(len(rotated), 2)
+        contents = []
+        for fn in rotated:
+            with open(os.path.join(dirname, fn)) as fp:
+                contents.append(fp.read())
+        self.assertEqual(contents, ["ab0\n", "ab1\n"])
+        with open(path) as fp:
+            self.assertEqual(fp.read(), "ab2\n")
+
+    def test_rotate_by_time_compress(self):
+        import gzip
+
+        path, f = self._file_endpoint(rotate_interval=60, compress=True)
+        f.process("foo")
+        with mock.patch("time.time", return_value=ep.time.time() + 61):
+            f.process("faa")
+        f.teardown(None, None, None)
+
+        dirname = os.path.dirname(path)
+        rotated = [
+            fn for fn in os.listdir(dirname)
+            if fn not in ("alerts.log", ".alerts.log.created")]
+        self.assertEqual(len(rotated), 1)
+        self.assertTrue(rotated[0].endswith(".gz"))
+        with gzip.open(os.path.join(dirname, rotated[0])) as fp:
+            self.assertEqual(fp.read(), b"foo\n")
+        with open(path) as fp:
+            self.assertEqual(fp.read(), "faa\n")
+
+    def test_rotate_by_time_between_runs(self):
+        path, f = self._file_endpoint(rotate_interval=60)
+        f.process("foo")
+        f.teardown(None, None, None)
+
+        # every alert run setup the endpoint again
+        now = ep.time.time()
+        for offset, expected in ((30, 1), (61, 2)):
+            with mock.patch("time.time", return_value=now + offset):
+                f.setup(Alert1(None))
+                f.process("faa")
+                f.teardown(None, None, None)
+            files = [
+                fn for fn in os.listdir(os.path.dirname(path))
+                if fn.startswith("alerts.log")]
+            self.assertEqual(len(files), expected)
+        with open(path) as fp:
+            self.assertEqual(fp.read(), "faa\n")
+
+    def test_flush_interval_fsync(self):
+        path, f = self._file_endpoint(flush_interval=60, fsync=True)
+        with mock.patch("os.fsync") as fsync:
+            f.process("foo")
+            self.assertFalse(fsync.called)
+            with mock.patch("time.time", return_value=ep.time.time() + 61):
+                f.process("faa")
+            fsync.assert_called_once_with(f.fp.fileno())
+        with open(path) as fp:
+            self.assertEqual(fp.read(), "foo\nfaa\n")
+        f.teardown(None, None, None)
+
+    def test_json_lines(self):
+        import json
+
+        path, f = self._file_endpoint(json_lines=True)
+        f.process_batch(["foo", "faa"])
+        f.teardown(None, None, None)
+        with open(path) as fp:
+            records = [json.loads(line) for line in fp]
+        self.assertEqual(
+            [r["message"] for r in records], ["foo", "faa"])
+        self.assertEqual(
+            {r["alert"] for r in records}, {"tests.alerts.Alert1"})
+
     def test_real_file(self):
         fd, path = tempfile.mkstemp()
         try:
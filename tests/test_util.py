@@ -82,6 +82,15 @@ class CollectSubclasses(BaseTest):
         self.assertCountEqual(actual, expected)
 
 
+class Chunks(BaseTest):
+
+    def test_chunks(self):
+        actual = list(util.chunks(range(7), 3))
+        expected = [[0, 1, 2], [3, 4, 5], [6]]
+        self.assertEqual(actual, expected)
+        self.assertEqual(list(util.chunks([], 3)), [])
+
+
 class DImport(BaseTest):
 
     def test_dimport(self):